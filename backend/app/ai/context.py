@@ -1,20 +1,158 @@
 """
 Context pack builder for injecting compact finance context into LLM messages.
 """
-from datetime import datetime, timedelta
-from typing import Dict, Any, Optional
+import asyncio
+import hashlib
+import heapq
+import json
+import re
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, List, Optional, Tuple
 from uuid import UUID
 
-from sqlalchemy import select, func
+from sqlalchemy import BigInteger, Row, bindparam, cast, func, literal, null, select, union_all
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import Executable
 
 import os
 
 from app.models import Transaction
-from app.crud import get_dashboard_summary
+from app.crud import get_dashboard_summary, get_transaction_version
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
 
 # Default transaction limit for context pack
 AI_CONTEXT_PACK_TX_LIMIT = int(os.getenv("AI_CONTEXT_PACK_TX_LIMIT", "6"))
+# How long a built pack is reused across chat turns (0 disables caching)
+AI_CONTEXT_PACK_CACHE_TTL = int(os.getenv("AI_CONTEXT_PACK_CACHE_TTL", "30"))
+_CONTEXT_PACK_CACHE_MAX_USERS = 10_000
+# Candidate pool multiplier for relevance-ranked recent transactions
+_RELEVANCE_POOL_FACTOR = 4
+_RELEVANCE_TERM_RE = re.compile(r"\w{3,}")
+_UTC_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+# Longer descriptions are cut (with an ellipsis) to keep prompt tokens down
+_DESCRIPTION_MAX_CHARS = 80
+
+# In-process pack cache: user_id -> ((time bucket, write version, tx_limit), pack)
+_context_pack_cache: Dict[UUID, Tuple[Tuple[int, int, int], Dict[str, Any]]] = {}
+# Builds in progress, so concurrent misses for the same key share one build
+_context_pack_inflight: Dict[Tuple[UUID, Tuple[int, int, int]], "asyncio.Future[Dict[str, Any]]"] = {}
+
+
+def _cents(amount: Any) -> Any:
+    """SQL expression converting a money column/aggregate to integer cents."""
+    return cast(func.round(amount * 100), BigInteger)
+
+
+# Amounts come back from the database as integer cents: sums stay exact and
+# no Decimal/float conversion runs per row until the pack is emitted.
+# Recent transactions (last N transactions, regardless of month).
+# Wrapped in a subquery so ORDER BY/LIMIT apply inside the UNION.
+_recent_subquery = (
+    select(
+        Transaction.type,
+        Transaction.category,
+        _cents(Transaction.amount).label("amount_cents"),
+        Transaction.occurred_at,
+        # One extra char tells us whether the description was cut
+        func.substr(Transaction.description, 1, _DESCRIPTION_MAX_CHARS + 1).label("description"),
+    )
+    .where(Transaction.user_id == bindparam("user_id"))
+    .order_by(Transaction.occurred_at.desc())
+    .limit(bindparam("limit"))
+    .subquery()
+)
+_recent_query = select(literal("recent").label("src"), *_recent_subquery.c)
+
+# Aggregate month-to-date totals in the database (one row per type/category)
+_month_query = (
+    select(
+        literal("month").label("src"),
+        Transaction.type,
+        Transaction.category,
+        _cents(func.sum(Transaction.amount)),
+        null(),
+        null(),
+    )
+    .where(
+        Transaction.user_id == bindparam("user_id"),
+        Transaction.occurred_at >= bindparam("month_start"),
+    )
+    .group_by(Transaction.type, Transaction.category)
+)
+
+# Both reads hit the same table for the same user: sent as one tagged UNION ALL.
+# Built once at import; callers bind user_id, month_start and limit per call.
+_CONTEXT_PACK_STATEMENT = union_all(_recent_query, _month_query)
+
+
+def _format_utc(value: datetime) -> str:
+    """Format a datetime as a second-precision UTC timestamp (naive values are taken as UTC)."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return value.strftime(_UTC_FORMAT)
+
+
+async def _fetch_all(
+    db: AsyncSession,
+    statement: Executable,
+    params: Optional[Dict[str, Any]] = None,
+) -> List[Row]:
+    """
+    Run a read-only statement on its own short-lived session.
+    
+    An AsyncSession cannot run two statements concurrently, so each independent
+    read of the context pack gets a sibling session bound to the same engine.
+    
+    Results are buffered rather than streamed: context pack statements are
+    bounded by the recent-transaction pool plus one aggregated row per
+    type/category, so the working set does not grow with transaction volume.
+    
+    Args:
+        db: Request session (only its bind is reused)
+        statement: SELECT statement to execute
+        params: Optional bound parameter values
+        
+    Returns:
+        All result rows
+    """
+    async with AsyncSession(bind=db.bind) as session:
+        result = await session.execute(statement, params)
+        return list(result.all())
+
+
+def _relevance_terms(text: Optional[str]) -> set[str]:
+    """Lowercased word terms (3+ chars) used for lexical relevance matching."""
+    return set(_RELEVANCE_TERM_RE.findall(text.lower())) if text else set()
+
+
+def _select_relevant(
+    entries: List[Tuple[datetime, Dict[str, Any]]],
+    relevant_to: str,
+    limit: int,
+) -> List[Tuple[datetime, Dict[str, Any]]]:
+    """
+    Keep the `limit` entries whose category/description best match the text.
+    
+    Ties (including "nothing matches") fall back to recency, so the result is
+    never worse than the plain last-N slice. Output stays newest first.
+    """
+    terms = _relevance_terms(relevant_to)
+    if not terms or len(entries) <= limit:
+        return entries[:limit]
+    
+    def score(item: Tuple[int, Tuple[datetime, Dict[str, Any]]]) -> Tuple[int, int]:
+        index, (_, entry) = item
+        entry_terms = _relevance_terms(f"{entry['category']} {entry['description'] or ''}")
+        return (-len(terms & entry_terms), index)
+    
+    kept = sorted(sorted(enumerate(entries), key=score)[:limit])
+    return [entry for _, entry in kept]
 
 
 async def build_finance_context_pack(
@@ -22,6 +160,9 @@ async def build_finance_context_pack(
     user_id: UUID,
     now: Optional[datetime] = None,
     tx_limit: Optional[int] = None,
+    relevant_to: Optional[str] = None,
+    include_recent: bool = True,
+    include_mtd: bool = True,
 ) -> Dict[str, Any]:
     """
     Build a compact finance context pack for the user.
@@ -29,84 +170,274 @@ async def build_finance_context_pack(
     This provides recent financial snapshot without sending entire DB.
     Used to enable personalized responses and proactive insights.
     
+    When `now` is not provided the pack is cached for AI_CONTEXT_PACK_CACHE_TTL
+    seconds, keyed by the user's transaction write version so any transaction
+    write invalidates it. Concurrent misses for the same user share one build.
+    Cached packs are shared: treat the result as read-only.
+    
+    When `relevant_to` is provided (e.g. the user's message), recent transactions
+    are picked from a larger recency pool by lexical overlap with their
+    category/description instead of plain last-N. Such packs are not cached.
+    
+    `include_recent=False` / `include_mtd=False` drop that section and skip its
+    query (as does `tx_limit=0` for the recent query); partial packs are not cached.
+    
     Args:
         db: Database session
         user_id: User ID
-        now: Current datetime (defaults to utcnow)
+        now: Current datetime (defaults to now in UTC; naive values are taken as UTC)
         tx_limit: Maximum number of recent transactions to include (defaults to AI_CONTEXT_PACK_TX_LIMIT)
+        relevant_to: Optional text to rank recent transactions against
+        include_recent: Include the recent_transactions section
+        include_mtd: Include the month_to_date section
         
     Returns:
         Dictionary with finance context (balance, month-to-date, recent transactions)
     """
-    if now is None:
-        now = datetime.utcnow()
-    
     if tx_limit is None:
         tx_limit = AI_CONTEXT_PACK_TX_LIMIT
     
-    # Get balance summary
-    summary = await get_dashboard_summary(db, user_id)
+    partial = not (include_recent and include_mtd)
+    if now is not None or relevant_to or partial or AI_CONTEXT_PACK_CACHE_TTL <= 0:
+        return await _build_finance_context_pack(
+            db,
+            user_id,
+            now or datetime.now(timezone.utc),
+            tx_limit,
+            relevant_to,
+            include_recent=include_recent,
+            include_mtd=include_mtd,
+        )
+    
+    cache_key = (
+        int(time.time() // AI_CONTEXT_PACK_CACHE_TTL),
+        get_transaction_version(user_id),
+        tx_limit,
+    )
+    cached = _context_pack_cache.get(user_id)
+    if cached is not None and cached[0] == cache_key:
+        return cached[1]
+    
+    inflight_key = (user_id, cache_key)
+    build = _context_pack_inflight.get(inflight_key)
+    if build is None:
+        build = asyncio.ensure_future(_build_and_cache(db.bind, user_id, cache_key, tx_limit))
+        _context_pack_inflight[inflight_key] = build
+        build.add_done_callback(lambda _: _context_pack_inflight.pop(inflight_key, None))
+    # Shield so one cancelled waiter does not abort the build for the others
+    return await asyncio.shield(build)
+
+
+async def _build_and_cache(
+    bind: Any,
+    user_id: UUID,
+    cache_key: Tuple[int, int, int],
+    tx_limit: int,
+) -> Dict[str, Any]:
+    """
+    Build a pack for the current time and store it in the per-user cache.
+    
+    The build is shared by concurrent callers and can outlive the request that
+    started it, so it runs on its own session instead of that request's.
+    """
+    async with AsyncSession(bind=bind) as session:
+        pack = await _build_finance_context_pack(session, user_id, datetime.now(timezone.utc), tx_limit)
+    if user_id not in _context_pack_cache and len(_context_pack_cache) >= _CONTEXT_PACK_CACHE_MAX_USERS:
+        # Evict the oldest inserted entry to keep memory bounded
+        _context_pack_cache.pop(next(iter(_context_pack_cache)))
+    _context_pack_cache[user_id] = (cache_key, pack)
+    return pack
+
+
+async def _build_finance_context_pack(
+    db: AsyncSession,
+    user_id: UUID,
+    now: datetime,
+    tx_limit: int,
+    relevant_to: Optional[str] = None,
+    include_recent: bool = True,
+    include_mtd: bool = True,
+) -> Dict[str, Any]:
+    """Query the database and assemble the finance context pack (uncached)."""
+    recent_pool = tx_limit * _RELEVANCE_POOL_FACTOR if relevant_to else tx_limit
+    query_recent = include_recent and tx_limit > 0
     
     # Get month start
     month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
     
-    # Get month-to-date transactions
-    month_query = select(Transaction).where(
-        Transaction.user_id == user_id,
-        Transaction.occurred_at >= month_start,
-    )
-    month_result = await db.execute(month_query)
-    month_transactions = list(month_result.scalars().all())
+    # Only send the members of the tagged UNION ALL this pack needs
+    params: Dict[str, Any] = {"user_id": user_id}
+    if query_recent and include_mtd:
+        statement: Optional[Executable] = _CONTEXT_PACK_STATEMENT
+        params.update(month_start=month_start, limit=recent_pool)
+    elif query_recent:
+        statement = _recent_query
+        params["limit"] = recent_pool
+    elif include_mtd:
+        statement = _month_query
+        params["month_start"] = month_start
+    else:
+        statement = None
     
-    # Calculate month-to-date totals
-    month_income = sum(
-        float(tx.amount) for tx in month_transactions if tx.type == "INCOME"
-    )
-    month_expense = sum(
-        float(tx.amount) for tx in month_transactions if tx.type == "EXPENSE"
+    # Overlap the context read with the dashboard summary
+    if statement is None:
+        summary = await get_dashboard_summary(db, user_id)
+        context_rows: List[Row] = []
+    else:
+        summary, context_rows = await asyncio.gather(
+            get_dashboard_summary(db, user_id),
+            _fetch_all(db, statement, params),
+        )
+    
+    # Single pass over the tagged rows: aggregate month-to-date totals and
+    # convert recent rows, touching each amount/timestamp exactly once
+    month_income_cents = 0
+    month_expense_cents = 0
+    expense_cents_by_category: Dict[str, int] = {}
+    recent_entries: List[Tuple[datetime, Dict[str, Any]]] = []
+    for src, tx_type, category, cents, occurred_at, description in context_rows:
+        if src == "recent":
+            if description and len(description) > _DESCRIPTION_MAX_CHARS:
+                description = description[:_DESCRIPTION_MAX_CHARS] + "…"
+            recent_entries.append((
+                occurred_at,
+                {
+                    "occurred_at": _format_utc(occurred_at) if occurred_at else None,
+                    "type": tx_type,
+                    "amount": cents / 100,
+                    "category": category,
+                    "description": description,
+                },
+            ))
+        elif tx_type == "INCOME":
+            month_income_cents += cents
+        elif tx_type == "EXPENSE":
+            month_expense_cents += cents
+            expense_cents_by_category[category] = cents
+    
+    # UNION ALL does not guarantee member order; break timestamp ties on the
+    # row contents so identical data always serializes identically
+    recent_entries.sort(
+        key=lambda item: (
+            item[0],
+            item[1]["type"],
+            item[1]["amount"],
+            item[1]["category"],
+            item[1]["description"] or "",
+        ),
+        reverse=True,
     )
+    if relevant_to:
+        recent_entries = _select_relevant(recent_entries, relevant_to, tx_limit)
     
     # Get top expense categories (month-to-date)
-    expense_by_category: Dict[str, float] = {}
-    for tx in month_transactions:
-        if tx.type == "EXPENSE":
-            category = tx.category
-            expense_by_category[category] = expense_by_category.get(category, 0.0) + float(tx.amount)
-    
     top_expense_categories = [
-        {"category": cat, "amount": amt}
-        for cat, amt in sorted(expense_by_category.items(), key=lambda x: x[1], reverse=True)[:5]
+        {"category": cat, "amount": cents / 100}
+        for cat, cents in heapq.nsmallest(5, expense_cents_by_category.items(), key=lambda x: (-x[1], x[0]))
     ]
     
-    # Get recent transactions (last N transactions, regardless of month)
-    recent_query = (
-        select(Transaction)
-        .where(Transaction.user_id == user_id)
-        .order_by(Transaction.occurred_at.desc())
-        .limit(tx_limit)
-    )
-    recent_result = await db.execute(recent_query)
-    recent_transactions = list(recent_result.scalars().all())
+    # Quantize as_of to the hour so the serialized pack (and any provider-side
+    # prompt cache keyed on it) only changes when the underlying data does
+    as_of = now.replace(minute=0, second=0, microsecond=0)
     
-    return {
+    pack: Dict[str, Any] = {
         "currency": "BRL",
-        "as_of": now.isoformat() + "Z",
+        "as_of": _format_utc(as_of),
         "balance": {
             "amount": float(summary.total_balance),
         },
-        "month_to_date": {
-            "income_total": month_income,
-            "expense_total": month_expense,
-            "top_expense_categories": top_expense_categories,
-        },
-        "recent_transactions": [
-            {
-                "occurred_at": tx.occurred_at.isoformat() if tx.occurred_at else None,
-                "type": tx.type,
-                "amount": float(tx.amount),
-                "category": tx.category,
-                "description": tx.description,
-            }
-            for tx in recent_transactions
-        ],
     }
+    if include_mtd:
+        pack["month_to_date"] = {
+            "income_total": month_income_cents / 100,
+            "expense_total": month_expense_cents / 100,
+            "top_expense_categories": top_expense_categories,
+        }
+    if include_recent:
+        pack["recent_transactions"] = [entry for _, entry in recent_entries]
+    return pack
+
+
+def serialize_finance_context_pack(pack: Dict[str, Any]) -> Tuple[str, str]:
+    """
+    Serialize a context pack canonically for prompt injection.
+    
+    Keys are sorted and whitespace is stripped, so the same data always yields
+    the same text and callers can key prompt caches on the returned version.
+    Uses orjson when installed; the stdlib fallback produces identical output.
+    
+    Args:
+        pack: Context pack from build_finance_context_pack
+        
+    Returns:
+        Tuple of (JSON text, version hash of that text)
+    """
+    if ORJSON_AVAILABLE:
+        payload = orjson.dumps(pack, option=orjson.OPT_SORT_KEYS)
+        text = payload.decode("utf-8")
+    else:
+        text = json.dumps(pack, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+        payload = text.encode("utf-8")
+    version = hashlib.sha256(payload).hexdigest()[:16]
+    return text, version
+
+
+def render_finance_context_pack_text(pack: Dict[str, Any]) -> str:
+    """
+    Render a context pack as a compact fixed-layout text block.
+    
+    Cheaper to produce than JSON and uses fewer prompt tokens (no quoting or
+    repeated keys). Recent transactions are one line each:
+    occurred_at|type|amount|category|description.
+    
+    Args:
+        pack: Context pack from build_finance_context_pack
+        
+    Returns:
+        Plain-text rendering of the pack
+    """
+    lines = [
+        f"currency={pack['currency']}",
+        f"as_of={pack['as_of']}",
+        f"balance={pack['balance']['amount']:.2f}",
+    ]
+    mtd = pack.get("month_to_date")
+    if mtd is not None:
+        top = ";".join(
+            f"{item['category']}:{item['amount']:.2f}" for item in mtd["top_expense_categories"]
+        )
+        lines.append(f"mtd_income={mtd['income_total']:.2f}")
+        lines.append(f"mtd_expense={mtd['expense_total']:.2f}")
+        lines.append(f"mtd_top_expense_categories={top}")
+    recent = pack.get("recent_transactions")
+    if recent is not None:
+        lines.append("recent_transactions=occurred_at|type|amount|category|description")
+        for tx in recent:
+            description = " ".join((tx["description"] or "").split())
+            lines.append(
+                f"{tx['occurred_at'] or ''}|{tx['type']}|{tx['amount']:.2f}|{tx['category']}|{description}"
+            )
+    return "\n".join(lines)
+
+
+async def build_finance_context_pack_text(
+    db: AsyncSession,
+    user_id: UUID,
+    now: Optional[datetime] = None,
+    tx_limit: Optional[int] = None,
+    relevant_to: Optional[str] = None,
+    include_recent: bool = True,
+    include_mtd: bool = True,
+) -> str:
+    """
+    Build the finance context pack and render it as compact text.
+    
+    Accepts the same arguments as build_finance_context_pack (and shares its cache).
+    
+    Returns:
+        Plain-text rendering of the pack
+    """
+    pack = await build_finance_context_pack(
+        db, user_id, now, tx_limit, relevant_to, include_recent=include_recent, include_mtd=include_mtd
+    )
+    return render_finance_context_pack_text(pack)
@@ -1,22 +1,74 @@
 """
 AI Gateway: Provider-agnostic orchestration for Zefa chatbot agent.
 """
+import asyncio
+import hashlib
+import json
+import logging
 import os
 import random
-from datetime import datetime, timedelta
-from typing import Any, Dict, List, Optional
+import re
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple
 from uuid import UUID, uuid4
 
+import httpx
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.ai import semantic_cache
 from app.ai.prompt import SYSTEM_PROMPT
-from app.ai.tools import TOOLS, execute_tool
-from app.ai.context import build_finance_context_pack
+from app.crud import get_transaction_version
+from app.ai.tools import MUTATING_TOOLS, TOOLS, TOOLS_DIGEST, execute_read_tool_isolated, execute_tools_parallel
+from app.ai.context import (
+    build_finance_context_pack,
+    render_finance_context_pack_text,
+    serialize_finance_context_pack,
+)
 from app.chat.schemas import ChatAssistantMeta, ChatUiEvent
 
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+# Provider SDKs are optional: only the configured provider needs to be installed
+try:
+    from openai import AsyncOpenAI
+except ImportError:
+    AsyncOpenAI = None
+
+try:
+    from anthropic import AsyncAnthropic
+except ImportError:
+    AsyncAnthropic = None
+
+try:
+    from google import genai
+    from google.genai import errors as genai_errors
+    from google.genai import types
+except ImportError:
+    genai = None
+    genai_errors = None
+    types = None
+
+logger = logging.getLogger("zefa.ai")
+
+# System prompt message shared by every chat turn. Message dicts are never
+# mutated after they are added to a prompt, so one instance is safe to reuse.
+_SYSTEM_MESSAGE: Dict[str, str] = {"role": "system", "content": SYSTEM_PROMPT}
+
 
 # Confirmation messages variations
-CONFIRMATION_TITLES = [
+CONFIRMATION_TITLES = (
     "Tá na mão.",
     "Fechado.",
     "Pronto.",
@@ -25,39 +77,176 @@ CONFIRMATION_TITLES = [
     "Feito.",
     "Concluído.",
     "Salvo.",
-]
+)
 
-CONFIRMATION_SUBTITLES_EXPENSE = [
+CONFIRMATION_SUBTITLES_EXPENSE = (
     "Despesa registrada pra você não perder o controle.",
     "Gasto anotado com sucesso.",
     "Despesa salva no seu histórico.",
     "Registrei essa despesa pra você.",
-]
+)
 
-CONFIRMATION_SUBTITLES_INCOME = [
+CONFIRMATION_SUBTITLES_INCOME = (
     "Receita registrada pra você acompanhar.",
     "Entrada anotada com sucesso.",
     "Receita salva no seu histórico.",
     "Registrei essa receita pra você.",
-]
+)
+
+_N_TITLES = len(CONFIRMATION_TITLES)
+_SUBTITLES = {True: CONFIRMATION_SUBTITLES_INCOME, False: CONFIRMATION_SUBTITLES_EXPENSE}
 
 
 def get_random_confirmation_title() -> str:
     """Get a random confirmation title."""
-    return random.choice(CONFIRMATION_TITLES)
+    return CONFIRMATION_TITLES[random.randrange(_N_TITLES)]
 
 
 def get_random_confirmation_subtitle(is_income: bool) -> str:
     """Get a random confirmation subtitle based on transaction type."""
-    if is_income:
-        return random.choice(CONFIRMATION_SUBTITLES_INCOME)
-    return random.choice(CONFIRMATION_SUBTITLES_EXPENSE)
+    subtitles = _SUBTITLES[bool(is_income)]
+    return subtitles[random.randrange(len(subtitles))]
+
+
+# Canned replies for small-talk messages (normalized: lowercased, no trailing punctuation)
+TRIVIAL_RESPONSES = {
+    "oi": "Oi! Como posso ajudar com suas finanças hoje?",
+    "olá": "Olá! Como posso ajudar com suas finanças hoje?",
+    "ola": "Olá! Como posso ajudar com suas finanças hoje?",
+    "bom dia": "Bom dia! Como posso ajudar com suas finanças hoje?",
+    "boa tarde": "Boa tarde! Como posso ajudar com suas finanças hoje?",
+    "boa noite": "Boa noite! Como posso ajudar com suas finanças hoje?",
+    "obrigado": "De nada! Se precisar, é só chamar.",
+    "obrigada": "De nada! Se precisar, é só chamar.",
+    "valeu": "Tamo junto! Se precisar, é só chamar.",
+    "ok": "👍",
+    "blz": "👍",
+    "beleza": "👍",
+}
+
+
+def _trivial_response(messages: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Return a canned reply when the last message is user small talk, else None."""
+    if not messages or messages[-1].get("role") != "user":
+        return None
+    normalized = (messages[-1].get("content") or "").strip().lower().rstrip("!.?… ")
+    content = TRIVIAL_RESPONSES.get(normalized)
+    if content is None:
+        return None
+    return {"role": "assistant", "content": content, "tool_calls": []}
+
+
+# Keywords for actions that require data modification or specific queries
+ACTION_KEYWORDS = (
+    # Create/Add
+    "criar", "registrar", "adicionar", "create", "add", "register",
+    # Edit/Update
+    "alterar", "altera", "mudar", "muda", "editar", "edita", "atualizar", "atualiza",
+    "update", "edit", "change", "modify", "modificar",
+    # Delete/Remove
+    "deletar", "deleta", "remover", "remove", "excluir", "exclui", "apagar", "apaga",
+    "delete", "exclude",
+    # Query
+    "saldo", "gasto", "gastei", "receita", "despesa", "extrato",
+    "quanto", "balance", "transaction", "spending",
+    "transação", "transacao",  # Explicit transaction mentions
+    "listar", "list", "mostrar", "show", "ver", "ver todas",
+)
+
+# Phrases showing the assistant asked for missing transaction details
+CLARIFICATION_MARKERS = (
+    "categoria", "descrição", "descricao", "qual foi", "com o quê", "com o que",
+    "foi despesa", "foi receita", "entrada ou saída", "entrada ou saida",
+    "quando foi", "qual data", "data dessa", "pode confirmar",
+)
+
+
+def _compile_substring_matcher(phrases: Tuple[str, ...]) -> "re.Pattern[str]":
+    """
+    Compile phrases into one case-insensitive alternation (longest first) so a
+    single scan finds any substring match without lowercasing the text.
+    """
+    alternation = "|".join(re.escape(phrase) for phrase in sorted(set(phrases), key=len, reverse=True))
+    return re.compile(alternation, re.IGNORECASE)
+
+
+# Finance-related intents that get the finance context pack. Broader than
+# ACTION_KEYWORDS: the pack is included liberally to enable insights, while
+# tools are only attached for explicit finance actions.
+CONTEXT_PACK_KEYWORDS = (
+    # Query
+    "saldo", "gasto", "gastei", "receita", "despesa", "extrato",
+    "fim do mês", "sobrou", "quanto", "transação", "transacao",
+    "balance", "transaction", "spending",
+    # Create/Add
+    "criar", "registrar", "adicionar", "create", "add", "register",
+    # Edit/Update
+    "alterar", "altera", "mudar", "muda", "editar", "edita", "atualizar", "atualiza",
+    "update", "edit", "change", "modify", "modificar",
+    # Delete/Remove
+    "deletar", "deleta", "remover", "remove", "excluir", "exclui", "apagar", "apaga",
+    "delete", "remove", "exclude",
+    # Analysis
+    "análise", "analise", "insight", "resumo", "total", "soma", "média",
+    # General finance
+    "dinheiro", "valor", "preço", "custo", "pagamento",
+    "como estou", "como vai", "situação", "situacao", "status",
+    "financeiro", "finanças", "financas", "grana", "reais",
+    # List/Show
+    "listar", "list", "mostrar", "show", "ver", "ver todas",
+)
+
+_ACTION_KEYWORDS_RE = _compile_substring_matcher(ACTION_KEYWORDS)
+_CLARIFICATION_MARKERS_RE = _compile_substring_matcher(CLARIFICATION_MARKERS)
+# Context-pack keywords are matched as whole words (so "add" does not match
+# "address"): single words by set lookup, multi-word phrases by one pattern
+_CONTEXT_PACK_KEYWORD_WORDS = frozenset(k for k in CONTEXT_PACK_KEYWORDS if " " not in k)
+_CONTEXT_PACK_PHRASES_RE = _compile_substring_matcher(tuple(k for k in CONTEXT_PACK_KEYWORDS if " " in k))
+_WORD_RE = re.compile(r"\w+")
+
+
+def should_include_context_pack(user_message: str) -> bool:
+    """
+    Determine if the finance context pack should be injected for a message.
+    
+    Words are looked up in a frozenset, with a trailing "s" dropped as well so
+    plurals ("gastos", "despesas") match their keyword.
+    
+    Args:
+        user_message: User's message text
+        
+    Returns:
+        True if the message mentions a finance-related intent
+    """
+    words = _WORD_RE.findall(user_message.lower())
+    if not _CONTEXT_PACK_KEYWORD_WORDS.isdisjoint(words):
+        return True
+    if not _CONTEXT_PACK_KEYWORD_WORDS.isdisjoint(word[:-1] for word in words if word.endswith("s")):
+        return True
+    return _CONTEXT_PACK_PHRASES_RE.search(user_message) is not None
+
+
+# Modes whose decision does not depend on the message
+_TOOLS_MODE_FIXED_DECISIONS = {"always": True, "never": False}
+
+
+def _should_attach_tools_heuristic(user_message: str) -> bool:
+    """
+    Attach tools only for explicit finance actions (creating transactions,
+    querying specific data) to reduce token usage, whether or not the context
+    pack is included. The context pack is included more liberally to enable
+    insights without tools.
+    """
+    return _ACTION_KEYWORDS_RE.search(user_message) is not None
 
 
 def should_attach_tools(user_message: str, include_context_pack: bool) -> bool:
     """
     Determine if tools should be attached based on AI_TOOLS_MODE.
     
+    AI_TOOLS_MODE is read per call (not specialized at import) so it can be
+    overridden at runtime; "always"/"never" resolve with one dict lookup.
+    
     Args:
         user_message: User's message text
         include_context_pack: Whether finance context pack is being included
@@ -65,44 +254,13 @@ def should_attach_tools(user_message: str, include_context_pack: bool) -> bool:
     Returns:
         True if tools should be attached, False otherwise
     """
-    if AI_TOOLS_MODE == "always":
-        return True
-    elif AI_TOOLS_MODE == "never":
-        return False
-    elif AI_TOOLS_MODE == "heuristic":
-        # In heuristic mode, attach tools only for explicit finance actions
-        # (creating transactions, querying specific data) to reduce token usage.
-        # Context pack is included more liberally to enable insights without tools.
-        user_text_lower = user_message.lower()
-        
-        # Tools are needed for actions that require data modification or specific queries
-        action_keywords = [
-            # Create/Add
-            "criar", "registrar", "adicionar", "create", "add", "register",
-            # Edit/Update
-            "alterar", "altera", "mudar", "muda", "editar", "edita", "atualizar", "atualiza",
-            "update", "edit", "change", "modify", "modificar",
-            # Delete/Remove
-            "deletar", "deleta", "remover", "remove", "excluir", "exclui", "apagar", "apaga",
-            "delete", "remove", "exclude",
-            # Query
-            "saldo", "gasto", "gastei", "receita", "despesa", "extrato",
-            "quanto", "balance", "transaction", "spending",
-            "transação", "transacao",  # Explicit transaction mentions
-            "listar", "list", "mostrar", "show", "ver", "ver todas",
-        ]
-        
-        # If context pack is included, it means it's finance-related, so attach tools
-        if include_context_pack:
-            # But only if it's an action that needs tools (not just conversational)
-            if any(keyword in user_text_lower for keyword in action_keywords):
-                return True
-        
-        # Also check for action keywords even if context pack wasn't included
-        return any(keyword in user_text_lower for keyword in action_keywords)
-    else:
-        # Unknown mode, default to heuristic behavior
-        return include_context_pack
+    decision = _TOOLS_MODE_FIXED_DECISIONS.get(AI_TOOLS_MODE)
+    if decision is not None:
+        return decision
+    if AI_TOOLS_MODE == "heuristic":
+        return _should_attach_tools_heuristic(user_message)
+    # Unknown mode, default to heuristic behavior
+    return include_context_pack
 
 
 def should_force_tools_from_context(recent_messages: List[Dict[str, str]]) -> bool:
@@ -120,16 +278,53 @@ def should_force_tools_from_context(recent_messages: List[Dict[str, str]]) -> bo
     if not last_assistant:
         return False
 
-    content = (last_assistant.get("content") or "").lower()
-    clarification_markers = [
-        "categoria", "descrição", "descricao", "qual foi", "com o quê", "com o que",
-        "foi despesa", "foi receita", "entrada ou saída", "entrada ou saida",
-        "quando foi", "qual data", "data dessa", "pode confirmar",
-    ]
-    return any(marker in content for marker in clarification_markers)
+    return _CLARIFICATION_MARKERS_RE.search(last_assistant.get("content") or "") is not None
+
+
+def _json_default(value: Any) -> str:
+    """Encode the non-JSON types tool results carry (datetimes) for the json fallback."""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
 
 
-def compact_tool_result(result: Any) -> str:
+def _dumps_compact(value: Any) -> str:
+    """Serialize a JSON value without whitespace (orjson when installed)."""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=_json_default)
+
+
+def _dumps_bounded(value: Any, max_chars: int) -> str:
+    """
+    Serialize a dict or list compactly, stopping once max_chars is exceeded.
+    
+    Members are encoded one at a time, so the output is the same prefix a full
+    compact serialization would have, without encoding the remainder of a
+    large payload. The result may be longer than max_chars; callers cut it.
+    """
+    if isinstance(value, dict):
+        opening, closing = "{", "}"
+        members = (f"{_dumps_compact(str(key))}:{_dumps_compact(item)}" for key, item in value.items())
+    else:
+        opening, closing = "[", "]"
+        members = (_dumps_compact(item) for item in value)
+    
+    parts = [opening]
+    length = 1
+    for index, member in enumerate(members):
+        if index:
+            parts.append(",")
+            length += 1
+        parts.append(member)
+        length += len(member)
+        if length > max_chars:
+            return "".join(parts)
+    parts.append(closing)
+    return "".join(parts)
+
+
+def compact_tool_result(result: Any, max_chars: Optional[int] = None) -> str:
     """
     Compact tool result for injection into LLM prompt.
     
@@ -137,16 +332,17 @@ def compact_tool_result(result: Any) -> str:
     - Removing pretty-printing (no indent)
     - Truncating arrays to top N items
     - Truncating long strings
-    - Enforcing AI_TOOL_RESULTS_MAX_CHARS limit
+    - Enforcing a character limit (serialization stops early)
     
     Args:
         result: Tool result (dict, list, or primitive)
+        max_chars: Character limit (defaults to AI_TOOL_RESULTS_MAX_CHARS)
         
     Returns:
         Compact string representation
     """
-    import json
-    
+    if max_chars is None:
+        max_chars = AI_TOOL_RESULTS_MAX_CHARS
     if isinstance(result, dict):
         # Truncate arrays in dict values
         compacted = {}
@@ -159,22 +355,22 @@ def compact_tool_result(result: Any) -> str:
                 compacted[key] = value[:500] + "..."
             else:
                 compacted[key] = value
-        result_str = json.dumps(compacted, ensure_ascii=False, separators=(',', ':'))
+        result_str = _dumps_bounded(compacted, max_chars)
     elif isinstance(result, list):
         # Truncate long lists
         if len(result) > 10:
             compacted = result[:10] + [f"... ({len(result) - 10} more items)"]
         else:
             compacted = result
-        result_str = json.dumps(compacted, ensure_ascii=False, separators=(',', ':'))
+        result_str = _dumps_bounded(compacted, max_chars)
     else:
         result_str = str(result)
         if len(result_str) > 500:
             result_str = result_str[:500] + "..."
     
     # Enforce max chars limit
-    if len(result_str) > AI_TOOL_RESULTS_MAX_CHARS:
-        result_str = result_str[:AI_TOOL_RESULTS_MAX_CHARS] + "... (truncated)"
+    if len(result_str) > max_chars:
+        result_str = result_str[:max_chars] + "... (truncated)"
     
     return result_str
 
@@ -185,12 +381,89 @@ AI_MODEL_CHAT = os.getenv("AI_MODEL_CHAT", "gpt-4o-mini")
 AI_MAX_CONTEXT_MESSAGES = int(os.getenv("AI_MAX_CONTEXT_MESSAGES", "20"))
 AI_SUMMARY_TOKEN_BUDGET = int(os.getenv("AI_SUMMARY_TOKEN_BUDGET", "500"))
 AI_MAX_OUTPUT_TOKENS = int(os.getenv("AI_MAX_OUTPUT_TOKENS", "1500"))
+# Prompt token budget: oldest history is dropped to fit (0 disables)
+AI_CONTEXT_TOKEN_BUDGET = int(os.getenv("AI_CONTEXT_TOKEN_BUDGET", "8000"))
 AI_TOOLS_MODE = os.getenv("AI_TOOLS_MODE", "heuristic")  # always, heuristic, never
 AI_TOOL_RESULTS_MAX_CHARS = int(os.getenv("AI_TOOL_RESULTS_MAX_CHARS", "4000"))
 AI_CONTEXT_PACK_TX_LIMIT = int(os.getenv("AI_CONTEXT_PACK_TX_LIMIT", "6"))
+# Rank context pack recent transactions by relevance to the user message (bypasses pack cache)
+AI_CONTEXT_PACK_RELEVANCE = os.getenv("AI_CONTEXT_PACK_RELEVANCE", "0") == "1"
+# Context pack prompt format: "json" (canonical JSON) or "text" (compact fixed layout)
+AI_CONTEXT_PACK_FORMAT = os.getenv("AI_CONTEXT_PACK_FORMAT", "json").lower()
+
+# Stream the first tool-enabled LLM call and start read-only tools as soon as
+# their call is complete, overlapping tool execution with the rest of the reply
+AI_STREAM_TOOL_CALLS = os.getenv("AI_STREAM_TOOL_CALLS", "0") == "1"
 
-# Ephemeral API keys storage (in-memory only, scoped by user_id)
+# Mark the stable prompt prefix for provider-side prompt caching (Anthropic)
+AI_PROMPT_CACHE = os.getenv("AI_PROMPT_CACHE", "1") == "1"
+
+# Answer small-talk messages locally without calling the provider
+AI_TRIVIAL_SHORTCUT = os.getenv("AI_TRIVIAL_SHORTCUT", "0") == "1"
+
+# Exact-match response cache (seconds; 0 disables)
+AI_CACHE_TTL = int(os.getenv("AI_CACHE_TTL", "60"))
+_L1_CACHE_MAX_ENTRIES = 2048
+
+# L1 cache: sha256 of the request -> (expires_at, response), in LRU order
+_l1_cache: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+# Provider calls in progress, so concurrent identical requests share one call
+_llm_inflight: Dict[Tuple[UUID, str], "asyncio.Future[Dict[str, Any]]"] = {}
+
+# Rendered context pack prompt message per user: user_id -> (pack, format, message).
+# Cached packs are shared objects, so an identity match means the text is current.
+_context_pack_messages: Dict[UUID, Tuple[Dict[str, Any], str, Dict[str, str]]] = {}
+_CONTEXT_PACK_MESSAGES_MAX_USERS = 10_000
+
+# Provider SDK clients reused across calls (keep-alive connection pools), keyed by
+# (provider, sha256(api_key)) in LRU order so raw keys are not kept as dict keys;
+# bounded because ephemeral user keys churn
+_PROVIDER_CLIENTS_MAX = 32
+_provider_clients: "OrderedDict[Tuple[str, str], Any]" = OrderedDict()
+# Providers whose SDK client owns its HTTP transport (not _shared_http_client):
+# evicted clients are closed after a grace period covering in-flight calls
+_OWN_TRANSPORT_PROVIDERS = frozenset({"gemini"})
+_EVICTED_CLIENT_CLOSE_DELAY = 60.0
+# Pending delayed closes of evicted clients (task -> client)
+_client_close_tasks: Dict["asyncio.Task[None]", Any] = {}
+
+# One HTTP connection pool shared by the OpenAI/Anthropic SDK clients, so calls
+# reuse keep-alive TCP+TLS connections to the provider whichever API key they
+# use (a client per key would otherwise open its own pool). Created on first
+# use, closed on shutdown by close_provider_clients.
+_HTTP_CLIENT_LIMITS = httpx.Limits(max_connections=256, max_keepalive_connections=64)
+_http_client: Optional[httpx.AsyncClient] = None
+
+# Ephemeral API keys storage (in-memory only, scoped by user_id);
+# expires_at is a time.monotonic() deadline
 _ephemeral_api_keys: Dict[UUID, Dict[str, Any]] = {}
+# How often the background sweeper drops expired ephemeral keys
+_API_KEY_SWEEP_INTERVAL_SECONDS = 300
+
+# Provider -> env var holding its server-side API key
+_ENV_API_KEY_VARS = {
+    "openai": "OPENAI_API_KEY",
+    "anthropic": "ANTHROPIC_API_KEY",
+    "gemini": "GEMINI_API_KEY",
+}
+# Snapshot of the server-side API keys (see reload_env_api_keys)
+_env_api_keys: Dict[str, str] = {}
+
+
+def reload_env_api_keys() -> None:
+    """
+    Re-read the server-side provider API keys from the environment.
+    
+    Keys are snapshotted at import instead of read on every request; call this
+    (e.g. on SIGHUP) after rotating secrets. Values are stripped to avoid \\r\\n
+    from GCP Secret Manager.
+    """
+    _env_api_keys.clear()
+    for provider, var in _ENV_API_KEY_VARS.items():
+        _env_api_keys[provider] = (os.getenv(var) or "").strip()
+
+
+reload_env_api_keys()
 
 
 def get_api_key(user_id: UUID) -> Optional[str]:
@@ -203,25 +476,16 @@ def get_api_key(user_id: UUID) -> Optional[str]:
     Returns:
         API key if available, None otherwise
     """
-    # First check environment variable (strip to avoid \r\n from GCP Secret Manager)
-    if AI_PROVIDER == "openai":
-        env_key = (os.getenv("OPENAI_API_KEY") or "").strip()
-        if env_key:
-            return env_key
-    elif AI_PROVIDER == "anthropic":
-        env_key = (os.getenv("ANTHROPIC_API_KEY") or "").strip()
-        if env_key:
-            return env_key
-    elif AI_PROVIDER == "gemini":
-        env_key = (os.getenv("GEMINI_API_KEY") or "").strip()
-        if env_key:
-            return env_key
+    # First check the server-side key snapshot
+    env_key = _env_api_keys.get(AI_PROVIDER)
+    if env_key:
+        return env_key
     
     # Check ephemeral storage
     if user_id in _ephemeral_api_keys:
         key_data = _ephemeral_api_keys[user_id]
         # Check if expired
-        if datetime.utcnow() < key_data["expires_at"]:
+        if time.monotonic() < key_data["expires_at"]:
             return (key_data["key"] or "").strip()
         else:
             # Remove expired key
@@ -241,22 +505,160 @@ def set_ephemeral_api_key(user_id: UUID, api_key: str, ttl_minutes: int = 60) ->
     """
     _ephemeral_api_keys[user_id] = {
         "key": (api_key or "").strip(),
-        "expires_at": datetime.utcnow() + timedelta(minutes=ttl_minutes),
+        "expires_at": time.monotonic() + ttl_minutes * 60,
     }
 
 
+def sweep_expired_api_keys() -> int:
+    """
+    Drop expired ephemeral API keys (keys that are never looked up again would
+    otherwise stay in memory).
+    
+    Returns:
+        Number of keys removed
+    """
+    now = time.monotonic()
+    expired = [user_id for user_id, key_data in _ephemeral_api_keys.items() if key_data["expires_at"] <= now]
+    for user_id in expired:
+        _ephemeral_api_keys.pop(user_id, None)
+    return len(expired)
+
+
+async def run_api_key_sweeper(interval_seconds: float = _API_KEY_SWEEP_INTERVAL_SECONDS) -> None:
+    """Periodically sweep expired ephemeral API keys (run as a background task)."""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        sweep_expired_api_keys()
+
+
+_token_encoder: Any = None
+
+# Encoded token counts by a 16-byte digest of the message text (LRU), so the
+# memo does not hold the texts themselves. The same history, summary and
+# context pack are re-counted on every tool iteration and every turn.
+_TOKEN_COUNTS_MAX = 4096
+_token_counts: "OrderedDict[bytes, int]" = OrderedDict()
+
+
+def _count_tokens(text: str) -> int:
+    """
+    Count prompt tokens for text.
+    
+    Uses tiktoken for OpenAI models when installed (memoized per text digest);
+    otherwise (other providers, unknown models, no tiktoken) approximates one
+    token per 4 characters.
+    """
+    global _token_encoder
+    if TIKTOKEN_AVAILABLE and AI_PROVIDER == "openai":
+        if _token_encoder is None:
+            try:
+                _token_encoder = tiktoken.encoding_for_model(AI_MODEL_CHAT)
+            except Exception:
+                _token_encoder = False
+        if _token_encoder:
+            digest = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+            count = _token_counts.get(digest)
+            if count is not None:
+                _token_counts.move_to_end(digest)
+                return count
+            count = len(_token_encoder.encode(text, disallowed_special=()))
+            _token_counts[digest] = count
+            if len(_token_counts) > _TOKEN_COUNTS_MAX:
+                _token_counts.popitem(last=False)
+            return count
+    return (len(text) + 3) // 4
+
+
+def trim_messages(
+    messages: List[Dict[str, Any]],
+    budget: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Drop the oldest history messages so the prompt fits a token budget.
+    
+    Leading system messages (prompt, summary, context pack) and the current
+    turn are always kept: the last message, and after tool execution the
+    user's question with every assistant tool-call message and tool-results
+    message that follows it. The newest history messages that fit are kept in
+    order, and a system note records how many older messages were omitted.
+    
+    Args:
+        messages: Messages about to be sent to the provider
+        budget: Token budget (defaults to AI_CONTEXT_TOKEN_BUDGET; 0 disables)
+        
+    Returns:
+        The original list when it fits, otherwise a trimmed copy
+    """
+    budget = AI_CONTEXT_TOKEN_BUDGET if budget is None else budget
+    if budget <= 0 or len(messages) <= 2:
+        return messages
+    
+    head_len = 0
+    while head_len < len(messages) - 1 and messages[head_len].get("role") == "system":
+        head_len += 1
+    
+    # Current turn: step back over (assistant tool calls, tool results) pairs so
+    # follow-up calls keep the question the results answer
+    tail_start = len(messages) - 1
+    while (
+        tail_start - 2 >= head_len
+        and messages[tail_start - 1].get("role") == "assistant"
+        and messages[tail_start - 1].get("tool_calls")
+    ):
+        tail_start -= 2
+    tail = messages[tail_start:]
+    
+    running = sum(_count_tokens(m.get("content") or "") for m in messages[:head_len])
+    running += sum(_count_tokens(m.get("content") or "") for m in tail)
+    history = messages[head_len:tail_start]
+    kept = 0
+    for message in reversed(history):
+        tokens = _count_tokens(message.get("content") or "")
+        if running + tokens > budget:
+            break
+        running += tokens
+        kept += 1
+    
+    dropped = len(history) - kept
+    if not dropped:
+        return messages
+    return [
+        *messages[:head_len],
+        {"role": "system", "content": f"({dropped} mensagens anteriores omitidas por limite de contexto)"},
+        *history[dropped:],
+        *tail,
+    ]
+
+
 async def call_llm(
     messages: List[Dict[str, str]],
     tools: Optional[List[Dict[str, Any]]] = None,
     api_key: Optional[str] = None,
+    user_id: Optional[UUID] = None,
 ) -> Dict[str, Any]:
     """
     Call LLM provider (OpenAI, Anthropic, or Gemini) with messages and optional tools.
     
+    With AI_TRIVIAL_SHORTCUT enabled, small-talk messages ("oi", "obrigado",
+    "ok", ...) get a canned reply without a provider call, unless tools are
+    attached or the last assistant message asked for confirmation/details.
+    
+    When `user_id` is given, identical requests within AI_CACHE_TTL seconds are
+    answered from an exact-match (L1) cache, unless the user's transactions
+    changed in between. When AI_SEMANTIC_CACHE is also
+    enabled, read-only turns (no tools attached, no pending clarification) are
+    answered from the per-user semantic cache (L2) when a similar message was
+    answered recently; L2 hits back-fill L1. Concurrent identical requests
+    without tools (double submits, client retries) share one provider call.
+    
+    History that does not fit AI_CONTEXT_TOKEN_BUDGET is trimmed oldest-first
+    (see trim_messages) before caching and dispatch.
+    
     Args:
         messages: List of message dicts with 'role' and 'content'
         tools: Optional list of tool definitions
         api_key: API key (if None, will try to get from env)
+        user_id: Optional user ID scoping the response caches
         
     Returns:
         LLM response dict
@@ -265,48 +667,276 @@ async def call_llm(
         ValueError: If provider is not supported or API key is missing
         Exception: If API call fails
     """
+    # Never shortcut a turn that may act: with tools attached, or when "ok" may
+    # be the answer to a confirmation/clarification question
+    if AI_TRIVIAL_SHORTCUT and not tools and not should_force_tools_from_context(messages):
+        trivial = _trivial_response(messages)
+        if trivial is not None:
+            return trivial
+    
+    messages = trim_messages(messages)
+    
+    l1_key = _l1_cache_key(messages, tools, user_id) if user_id is not None and AI_CACHE_TTL > 0 else None
+    if l1_key is not None:
+        cached = _l1_cache.get(l1_key)
+        if cached is not None and cached[0] > time.monotonic():
+            _l1_cache.move_to_end(l1_key)
+            return dict(cached[1])
+    
+    if user_id is None or tools:
+        # Requests with tools are never coalesced: tool calls may write
+        return await _call_llm_uncached(messages, tools, api_key, user_id, l1_key)
+    
+    inflight_key = (user_id, l1_key or _l1_cache_key(messages, tools, user_id))
+    call = _llm_inflight.get(inflight_key)
+    if call is None:
+        call = asyncio.ensure_future(_call_llm_uncached(messages, tools, api_key, user_id, l1_key))
+        _llm_inflight[inflight_key] = call
+        call.add_done_callback(lambda _: _llm_inflight.pop(inflight_key, None))
+    # Shield so one cancelled waiter does not abort the call for the others;
+    # each waiter gets its own copy because callers attach metadata
+    return dict(await asyncio.shield(call))
+
+
+async def _call_llm_uncached(
+    messages: List[Dict[str, str]],
+    tools: Optional[List[Dict[str, Any]]],
+    api_key: Optional[str],
+    user_id: Optional[UUID],
+    l1_key: Optional[str],
+) -> Dict[str, Any]:
+    """Answer from the semantic cache or the provider, then populate the caches (see call_llm)."""
+    cache_safe = (
+        semantic_cache.AI_SEMANTIC_CACHE
+        and user_id is not None
+        and AI_PROVIDER == "openai"  # embeddings use the OpenAI API
+        and not tools
+        and not should_force_tools_from_context(messages)
+    )
+    if cache_safe:
+        cached = await semantic_cache.lookup(user_id, messages, api_key)
+        if cached is not None:
+            if l1_key is not None:
+                _l1_cache_store(l1_key, cached)
+            return cached
+    
     if AI_PROVIDER == "openai":
-        return await _call_openai(messages, tools, api_key)
+        response = await _call_openai(messages, tools, api_key)
     elif AI_PROVIDER == "anthropic":
-        return await _call_anthropic(messages, tools, api_key)
+        response = await _call_anthropic(messages, tools, api_key)
     elif AI_PROVIDER == "gemini":
-        return await _call_gemini(messages, tools, api_key)
+        response = await _call_gemini(messages, tools, api_key)
     else:
         raise ValueError(f"Unsupported AI provider: {AI_PROVIDER}")
+    
+    if not response.get("tool_calls"):
+        # Replies that request tool calls are never replayed: tools may write
+        if l1_key is not None:
+            _l1_cache_store(l1_key, response)
+        if cache_safe:
+            await semantic_cache.store(user_id, messages, response, api_key)
+    return response
 
 
-async def _call_openai(
+def _l1_cache_key(
+    messages: List[Dict[str, Any]],
+    tools: Optional[List[Dict[str, Any]]],
+    user_id: UUID,
+) -> str:
+    """
+    Hash everything that determines the provider request into an L1 cache key.
+    
+    The user's transaction write version is included, so a create/update/delete
+    makes earlier replies unreachable (they may describe stale balances).
+    """
+    payload = json.dumps(
+        {
+            "user_id": str(user_id),
+            "transaction_version": get_transaction_version(user_id),
+            "provider": AI_PROVIDER,
+            "model": AI_MODEL_CHAT,
+            "max_tokens": AI_MAX_OUTPUT_TOKENS,
+            "messages": messages,
+            # The shared registry is fingerprinted instead of re-encoded per call
+            "tools": TOOLS_DIGEST if tools is TOOLS else tools,
+        },
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _l1_cache_store(key: str, response: Dict[str, Any]) -> None:
+    """Insert a response into the L1 cache, evicting expired and least recently used entries."""
+    now = time.monotonic()
+    _l1_cache[key] = (now + AI_CACHE_TTL, dict(response))
+    _l1_cache.move_to_end(key)
+    while _l1_cache:
+        oldest_key, (expires_at, _) = next(iter(_l1_cache.items()))
+        if len(_l1_cache) <= _L1_CACHE_MAX_ENTRIES and expires_at > now:
+            break
+        del _l1_cache[oldest_key]
+
+
+async def call_llm_stream(
     messages: List[Dict[str, str]],
     tools: Optional[List[Dict[str, Any]]] = None,
     api_key: Optional[str] = None,
-) -> Dict[str, Any]:
+) -> AsyncIterator[Dict[str, Any]]:
     """
-    Call OpenAI API.
+    Stream an LLM reply from the configured provider.
+    
+    Yields {"delta": text} events as text arrives and a {"tool_call": ...}
+    event as soon as each tool call is complete (in model-emitted order), then
+    a single final {"done": True, "response": ...} event whose response has the
+    same shape as call_llm's and lists the same tool call dicts.
+    Streaming bypasses the response caches.
     
     Args:
-        messages: List of message dicts
-        tools: Optional tool definitions
-        api_key: API key
+        messages: List of message dicts with 'role' and 'content'
+        tools: Optional list of tool definitions
+        api_key: API key (if None, will try to get from env)
+        
+    Yields:
+        Delta and tool call events followed by one done event
+        
+    Raises:
+        ValueError: If provider is not supported or API key is missing
+    """
+    messages = trim_messages(messages)
+    if AI_PROVIDER == "openai":
+        stream = _stream_openai(messages, tools, api_key)
+    elif AI_PROVIDER == "anthropic":
+        stream = _stream_anthropic(messages, tools, api_key)
+    elif AI_PROVIDER == "gemini":
+        stream = _stream_gemini(messages, tools, api_key)
+    else:
+        raise ValueError(f"Unsupported AI provider: {AI_PROVIDER}")
+    
+    async for event in stream:
+        yield event
+
+
+def _cached_client(provider: str, api_key: str, factory: Callable[[str], Any]) -> Any:
+    """
+    Return the cached SDK client for (provider, api_key), creating it on first use.
+    
+    Creation is synchronous, so concurrent callers on the event loop cannot
+    build duplicate clients for the same key.
+    
+    Args:
+        provider: Provider name
+        api_key: Resolved API key
+        factory: Builds a new client from the API key
         
     Returns:
-        OpenAI response dict
+        Provider SDK client
     """
+    key = (provider, hashlib.sha256(api_key.encode("utf-8")).hexdigest())
+    client = _provider_clients.get(key)
+    if client is not None:
+        _provider_clients.move_to_end(key)
+        return client
+    
+    client = factory(api_key)
+    _provider_clients[key] = client
+    if len(_provider_clients) > _PROVIDER_CLIENTS_MAX:
+        # OpenAI/Anthropic clients are dropped, not closed: their connections
+        # belong to the shared pool (_shared_http_client), which other clients
+        # still use. Clients with their own transport are closed.
+        (evicted_provider, _), evicted = _provider_clients.popitem(last=False)
+        if evicted_provider in _OWN_TRANSPORT_PROVIDERS:
+            _schedule_client_close(evicted)
+    return client
+
+
+def _schedule_client_close(client: Any) -> None:
+    """Close an evicted client once calls that already hold it have finished."""
     try:
-        from openai import AsyncOpenAI
-    except ImportError:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return  # No event loop: nothing can be in flight, the transport is GC'd
+    
+    async def close_later() -> None:
+        await asyncio.sleep(_EVICTED_CLIENT_CLOSE_DELAY)
+        await _close_client(client)
+    
+    task = loop.create_task(close_later())
+    _client_close_tasks[task] = client
+    task.add_done_callback(lambda done: _client_close_tasks.pop(done, None))
+
+
+async def _close_client(client: Any) -> None:
+    """
+    Close a provider SDK client, logging (not raising) failures.
+    
+    OpenAI/Anthropic clients have an async close(); a Gemini client has a
+    sync close() for its sync transport and aio.aclose() for the async one
+    (in google-genai versions that provide them).
+    """
+    closers = (getattr(client, "close", None), getattr(getattr(client, "aio", None), "aclose", None))
+    for close in closers:
+        if close is None:
+            continue
+        try:
+            result = close()
+            if asyncio.iscoroutine(result):
+                await result
+        except Exception as e:
+            logger.warning("Failed to close provider client: %s: %s", type(e).__name__, e)
+
+
+def _shared_http_client() -> httpx.AsyncClient:
+    """Return the HTTP client shared by provider SDK clients, creating it on first use."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(limits=_HTTP_CLIENT_LIMITS, timeout=60.0)
+    return _http_client
+
+
+async def close_provider_clients() -> None:
+    """Close every cached provider SDK client and release the shared connection pool."""
+    global _http_client
+    clients = list(_provider_clients.values())
+    _provider_clients.clear()
+    # Evicted clients still waiting for their delayed close are closed now
+    for task, client in list(_client_close_tasks.items()):
+        task.cancel()
+        clients.append(client)
+    _client_close_tasks.clear()
+    for client in clients:
+        await _close_client(client)
+    http_client, _http_client = _http_client, None
+    if http_client is not None:
+        try:
+            await http_client.aclose()
+        except Exception as e:
+            logger.warning("Failed to close shared HTTP client: %s: %s", type(e).__name__, e)
+
+
+def _openai_client(api_key: Optional[str]) -> Any:
+    """Get a (cached) OpenAI client, falling back to OPENAI_API_KEY when no key is given."""
+    if AsyncOpenAI is None:
         raise ImportError("openai package is required. Install with: pip install openai")
     
     if not api_key:
-        api_key = (os.getenv("OPENAI_API_KEY") or "").strip()
+        api_key = _env_api_keys["openai"]
     else:
         api_key = (api_key or "").strip()
     
     if not api_key:
         raise ValueError("OpenAI API key is required")
     
-    client = AsyncOpenAI(api_key=api_key)
-    
-    # Prepare request
+    return _cached_client("openai", api_key, lambda key: AsyncOpenAI(api_key=key, http_client=_shared_http_client()))
+
+
+def _openai_request_params(
+    messages: List[Dict[str, str]],
+    tools: Optional[List[Dict[str, Any]]],
+) -> Dict[str, Any]:
+    """Build OpenAI chat completion request parameters."""
     request_params: Dict[str, Any] = {
         "model": AI_MODEL_CHAT,
         "messages": messages,
@@ -318,12 +948,31 @@ async def _call_openai(
         request_params["tools"] = tools
         request_params["tool_choice"] = "auto"
     
+    return request_params
+
+
+async def _call_openai(
+    messages: List[Dict[str, str]],
+    tools: Optional[List[Dict[str, Any]]] = None,
+    api_key: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Call OpenAI API.
+    
+    Args:
+        messages: List of message dicts
+        tools: Optional tool definitions
+        api_key: API key
+        
+    Returns:
+        OpenAI response dict
+    """
+    client = _openai_client(api_key)
+    
     try:
-        response = await client.chat.completions.create(**request_params)
+        response = await client.chat.completions.create(**_openai_request_params(messages, tools))
     except Exception as e:
-        print(f"[ERROR] OpenAI API call failed: {type(e).__name__}: {e}")
-        import traceback
-        print(f"[ERROR] Traceback:\n{traceback.format_exc()}")
+        logger.exception("OpenAI API call failed: %s: %s", type(e).__name__, e)
         raise
 
     # Extract response
@@ -345,37 +994,80 @@ async def _call_openai(
     return result
 
 
-async def _call_anthropic(
+async def _stream_openai(
     messages: List[Dict[str, str]],
     tools: Optional[List[Dict[str, Any]]] = None,
     api_key: Optional[str] = None,
-) -> Dict[str, Any]:
-    """
-    Call Anthropic API.
+) -> AsyncIterator[Dict[str, Any]]:
+    """Stream an OpenAI chat completion (see call_llm_stream for the event shape)."""
+    client = _openai_client(api_key)
+    stream = await client.chat.completions.create(**_openai_request_params(messages, tools), stream=True)
     
-    Args:
-        messages: List of message dicts
-        tools: Optional tool definitions
-        api_key: API key
-        
-    Returns:
-        Anthropic response dict
-    """
-    try:
-        from anthropic import AsyncAnthropic
-    except ImportError:
+    content_parts: List[str] = []
+    # Tool call fragments arrive keyed by index and must be concatenated; a call
+    # is complete once fragments for a later index start (or the stream ends)
+    tool_calls: Dict[int, Dict[str, str]] = {}
+    emitted: set[int] = set()
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        if delta.content:
+            content_parts.append(delta.content)
+            yield {"delta": delta.content}
+        for tool_call_delta in delta.tool_calls or []:
+            for index in sorted(tool_calls):
+                if index < tool_call_delta.index and index not in emitted:
+                    emitted.add(index)
+                    yield {"tool_call": tool_calls[index]}
+            tool_call = tool_calls.setdefault(tool_call_delta.index, {"id": "", "name": "", "arguments": ""})
+            if tool_call_delta.id:
+                tool_call["id"] = tool_call_delta.id
+            if tool_call_delta.function:
+                tool_call["name"] += tool_call_delta.function.name or ""
+                tool_call["arguments"] += tool_call_delta.function.arguments or ""
+    
+    for index in sorted(tool_calls):
+        if index not in emitted:
+            yield {"tool_call": tool_calls[index]}
+    
+    yield {
+        "done": True,
+        "response": {
+            "role": "assistant",
+            "content": "".join(content_parts),
+            "tool_calls": [tool_calls[index] for index in sorted(tool_calls)],
+        },
+    }
+
+
+def _anthropic_client(api_key: Optional[str]) -> Any:
+    """Get a (cached) Anthropic client, falling back to ANTHROPIC_API_KEY when no key is given."""
+    if AsyncAnthropic is None:
         raise ImportError("anthropic package is required. Install with: pip install anthropic")
     
     if not api_key:
-        api_key = (os.getenv("ANTHROPIC_API_KEY") or "").strip()
+        api_key = _env_api_keys["anthropic"]
     else:
         api_key = (api_key or "").strip()
     
     if not api_key:
         raise ValueError("Anthropic API key is required")
     
-    client = AsyncAnthropic(api_key=api_key)
+    return _cached_client("anthropic", api_key, lambda key: AsyncAnthropic(api_key=key, http_client=_shared_http_client()))
+
+
+def _anthropic_request_params(
+    messages: List[Dict[str, str]],
+    tools: Optional[List[Dict[str, Any]]],
+) -> Dict[str, Any]:
+    """
+    Build Anthropic messages request parameters.
     
+    With AI_PROMPT_CACHE, the system prompt and the history up to the message
+    before the current one are marked as cacheable, so a follow-up call (next
+    turn or tool round) only pays full price for the new tail.
+    """
     # Convert messages format (Anthropic uses different format)
     anthropic_messages = []
     for msg in messages:
@@ -386,11 +1078,19 @@ async def _call_anthropic(
             "content": msg["content"],
         })
     
-    # Prepare request
+    system: Any = SYSTEM_PROMPT
+    if AI_PROMPT_CACHE:
+        system = [{"type": "text", "text": SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}}]
+        if len(anthropic_messages) >= 2 and anthropic_messages[-2]["content"]:
+            stable_tail = anthropic_messages[-2]
+            stable_tail["content"] = [
+                {"type": "text", "text": stable_tail["content"], "cache_control": {"type": "ephemeral"}}
+            ]
+    
     request_params: Dict[str, Any] = {
         "model": AI_MODEL_CHAT,
         "messages": anthropic_messages,
-        "system": SYSTEM_PROMPT,
+        "system": system,
         "max_tokens": AI_MAX_OUTPUT_TOKENS,
     }
     
@@ -401,9 +1101,11 @@ async def _call_anthropic(
             anthropic_tools.append(tool["function"])
         request_params["tools"] = anthropic_tools
     
-    response = await client.messages.create(**request_params)
-    
-    # Extract response
+    return request_params
+
+
+def _anthropic_result(content_blocks: List[Any]) -> Dict[str, Any]:
+    """Convert Anthropic content blocks into the gateway response dict."""
     result: Dict[str, Any] = {
         "role": "assistant",
         "content": "",
@@ -411,12 +1113,11 @@ async def _call_anthropic(
     }
     
     # Extract text content and tool calls
-    for content_block in response.content:
+    for content_block in content_blocks:
         if content_block.type == "text":
             result["content"] += content_block.text
         elif content_block.type == "tool_use":
             # Anthropic provides input as dict, convert to JSON string for consistency
-            import json
             result["tool_calls"].append({
                 "id": content_block.id,
                 "name": content_block.name,
@@ -426,13 +1127,13 @@ async def _call_anthropic(
     return result
 
 
-async def _call_gemini(
+async def _call_anthropic(
     messages: List[Dict[str, str]],
     tools: Optional[List[Dict[str, Any]]] = None,
     api_key: Optional[str] = None,
 ) -> Dict[str, Any]:
     """
-    Call Google Gemini API using google-genai library.
+    Call Anthropic API.
     
     Args:
         messages: List of message dicts
@@ -440,80 +1141,113 @@ async def _call_gemini(
         api_key: API key
         
     Returns:
-        Gemini response dict
+        Anthropic response dict
     """
-    try:
-        from google import genai
-        from google.genai import types
-        import asyncio
-    except ImportError:
+    client = _anthropic_client(api_key)
+    response = await client.messages.create(**_anthropic_request_params(messages, tools))
+    return _anthropic_result(response.content)
+
+
+async def _stream_anthropic(
+    messages: List[Dict[str, str]],
+    tools: Optional[List[Dict[str, Any]]] = None,
+    api_key: Optional[str] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """Stream an Anthropic message (see call_llm_stream for the event shape)."""
+    client = _anthropic_client(api_key)
+    async with client.messages.stream(**_anthropic_request_params(messages, tools)) as stream:
+        async for text in stream.text_stream:
+            yield {"delta": text}
+        final_message = await stream.get_final_message()
+    response = _anthropic_result(final_message.content)
+    # Tool use blocks are only assembled by the SDK at the end of the stream
+    for tool_call in response["tool_calls"]:
+        yield {"tool_call": tool_call}
+    yield {"done": True, "response": response}
+
+
+def _gemini_client(api_key: Optional[str]) -> Any:
+    """Get a (cached) Gemini client, falling back to GEMINI_API_KEY when no key is given."""
+    if genai is None:
         raise ImportError("google-genai package is required. Install with: pip install google-genai")
     
     if not api_key:
-        api_key = (os.getenv("GEMINI_API_KEY") or "").strip()
+        api_key = _env_api_keys["gemini"]
     else:
         api_key = (api_key or "").strip()
     
     if not api_key:
         raise ValueError("Gemini API key is required")
     
-    # Create client (strip avoids InvalidHeader from \r\n in GCP Secret Manager value)
-    client = genai.Client(api_key=api_key)
-    
-    # Convert messages format - build conversation history and current message
-    system_instruction = SYSTEM_PROMPT
-    conversation_history = []
-    current_message = ""
+    # Strip avoids InvalidHeader from \r\n in GCP Secret Manager value
+    return _cached_client("gemini", api_key, lambda key: genai.Client(api_key=key))
+
+
+# Gateway message role -> Gemini content role
+_GEMINI_ROLES = {"user": "user", "assistant": "model", "tool": "user"}
+
+
+def _gemini_message_text(msg: Dict[str, Any]) -> str:
+    """Text of a chat turn as sent to Gemini."""
+    if msg["role"] == "tool":
+        return f"Resultado da função {msg.get('name', 'unknown')}: {msg.get('content', '')}"
+    return msg["content"]
+
+
+# Gemini Tool list for the shared TOOLS registry, converted on first use
+_gemini_registry_tools: Optional[List[Any]] = None
+
+
+def _gemini_tools(tools: List[Dict[str, Any]]) -> List[Any]:
+    """Convert tool definitions to Gemini Tools (cached for the TOOLS registry)."""
+    global _gemini_registry_tools
+    if tools is TOOLS and _gemini_registry_tools is not None:
+        return _gemini_registry_tools
+    gemini_tools = [types.Tool(function_declarations=_convert_tools_to_gemini_format(tools))]
+    if tools is TOOLS:
+        _gemini_registry_tools = gemini_tools
+    return gemini_tools
+
+
+def _gemini_request(
+    messages: List[Dict[str, str]],
+    tools: Optional[List[Dict[str, Any]]],
+) -> Tuple[Any, Any]:
+    """
+    Convert gateway messages and tools into Gemini contents and config.
     
-    # Separate system messages from conversation messages
-    user_assistant_messages = []
+    Args:
+        messages: List of message dicts
+        tools: Optional tool definitions
+        
+    Returns:
+        Tuple of (contents, GenerateContentConfig)
+    """
+    # Split system messages (combined into the instruction) from the chat turns.
+    # When the last chat turn is from the user it is sent as the current message.
+    system_parts = [SYSTEM_PROMPT] if SYSTEM_PROMPT else []
+    chat_messages = []
     for msg in messages:
         if msg["role"] == "system":
-            # Combine all system messages into instruction
-            if system_instruction:
-                system_instruction += "\n\n" + msg["content"]
-            else:
-                system_instruction = msg["content"]
+            system_parts.append(msg["content"])
         else:
-            # Collect user and assistant messages
-            user_assistant_messages.append(msg)
-    
-    # Build conversation history (all except the last user message)
-    # The last user message is the current message
-    for i, msg in enumerate(user_assistant_messages):
-        if msg["role"] == "user":
-            if i == len(user_assistant_messages) - 1:
-                # Last message is the current one
-                current_message = msg["content"]
-            else:
-                # Add to history - use Part objects for text content
-                conversation_history.append(types.Content(role="user", parts=[types.Part(text=msg["content"])]))
-        elif msg["role"] == "assistant":
-            # Add assistant response to history - use Part objects for text content
-            # Handle both text content and tool calls
-            parts = []
-            if msg.get("content"):
-                parts.append(types.Part(text=msg["content"]))
-            # Note: Gemini doesn't use "tool" role - function results are passed differently
-            # We'll handle tool results separately in the message flow
-            if parts:
-                conversation_history.append(types.Content(role="model", parts=parts))
-        elif msg["role"] == "tool":
-            # For Gemini, tool results should be passed as user messages with function response format
-            # Convert tool result to a user message describing the result
-            tool_result_text = f"Resultado da função {msg.get('name', 'unknown')}: {msg.get('content', '')}"
-            conversation_history.append(types.Content(role="user", parts=[types.Part(text=tool_result_text)]))
-    
-    # Ensure we have a current message (fallback to empty string if somehow missing)
-    if not current_message:
-        # If no user message found, use empty string (shouldn't happen in normal flow)
-        current_message = ""
+            chat_messages.append(msg)
+    system_instruction = "\n\n".join(system_parts)
+    
+    current_message = ""
+    if chat_messages and chat_messages[-1]["role"] == "user":
+        current_message = chat_messages.pop()["content"] or ""
+    
+    # Gemini has no "tool" role: tool results are described in a user turn, and
+    # assistant turns without text (tool calls only) are skipped
+    conversation_history = [
+        types.Content(role=_GEMINI_ROLES[msg["role"]], parts=[types.Part(text=_gemini_message_text(msg))])
+        for msg in chat_messages
+        if msg["role"] in _GEMINI_ROLES and (msg["role"] != "assistant" or msg.get("content"))
+    ]
     
     # Convert tools to Gemini format
-    gemini_tools = None
-    if tools:
-        function_declarations = _convert_tools_to_gemini_format(tools)
-        gemini_tools = [types.Tool(function_declarations=function_declarations)]
+    gemini_tools = _gemini_tools(tools) if tools else None
     
     # Prepare config
     config = types.GenerateContentConfig(
@@ -522,227 +1256,201 @@ async def _call_gemini(
         max_output_tokens=AI_MAX_OUTPUT_TOKENS,
     )
     
-    # Helper function to convert Gemini API errors to user-friendly messages
-    def _handle_gemini_error(error: Exception) -> Dict[str, Any]:
-        """Convert Gemini API errors to user-friendly error responses."""
-        try:
-            from google.genai import errors as genai_errors
-        except ImportError:
-            pass
-        
-        error_type = type(error).__name__
-        error_message = str(error)
+    # Build contents - use Content objects for history + current message
+    # The API accepts either a string or a list of Content objects
+    if conversation_history:
+        # If we have history, build full conversation: history + current user message
+        contents = conversation_history
+        contents.append(types.Content(role="user", parts=[types.Part(text=current_message)]))
+    else:
+        # No history, just send current message as string
+        contents = current_message if current_message else ""
+    
+    return contents, config
+
+
+def _gemini_error_response(error: Exception) -> Dict[str, Any]:
+    """Convert Gemini API errors to user-friendly error responses."""
+    error_type = type(error).__name__
+    error_message = str(error)
+    
+    # Check for specific Gemini error types
+    if "ServerError" in error_type or "503" in error_message or "UNAVAILABLE" in error_message:
+        return {
+            "role": "assistant",
+            "content": (
+                "Desculpe, o serviço de IA está temporariamente sobrecarregado. "
+                "Por favor, tente novamente em alguns instantes. "
+                "Se o problema persistir, você pode tentar usar outro provedor de IA (OpenAI ou Anthropic) "
+                "configurando a variável AI_PROVIDER no arquivo .env."
+            ),
+            "tool_calls": [],
+            "error": "service_unavailable",
+        }
+    elif "429" in error_message or "RATE_LIMIT" in error_message or "quota" in error_message.lower():
+        return {
+            "role": "assistant",
+            "content": (
+                "Desculpe, você atingiu o limite de requisições da API do Gemini. "
+                "Por favor, aguarde alguns minutos antes de tentar novamente, ou considere usar outro provedor de IA."
+            ),
+            "tool_calls": [],
+            "error": "rate_limit_exceeded",
+        }
+    elif "401" in error_message or "403" in error_message or "INVALID_API_KEY" in error_message:
+        return {
+            "role": "assistant",
+            "content": (
+                "Erro de autenticação com a API do Gemini. "
+                "Por favor, verifique se a chave GEMINI_API_KEY está correta no arquivo .env."
+            ),
+            "tool_calls": [],
+            "error": "authentication_error",
+        }
+    elif "400" in error_message or "INVALID_ARGUMENT" in error_message:
+        return {
+            "role": "assistant",
+            "content": (
+                "Erro na requisição para a API do Gemini. "
+                "Por favor, tente reformular sua mensagem ou entre em contato com o suporte."
+            ),
+            "tool_calls": [],
+            "error": "invalid_request",
+        }
+    else:
+        # Generic error
+        return {
+            "role": "assistant",
+            "content": (
+                "Desculpe, ocorreu um erro ao processar sua mensagem. "
+                "Por favor, tente novamente. Se o problema persistir, verifique a configuração da API."
+            ),
+            "tool_calls": [],
+            "error": "unknown_error",
+        }
+
+
+def _gemini_tool_call(func_call: Any) -> Dict[str, str]:
+    """Convert a Gemini function call part into the gateway tool call dict."""
+    
+    # Convert args to dict if it's not already
+    if hasattr(func_call.args, 'items'):
+        args_dict = dict(func_call.args)
+    elif isinstance(func_call.args, dict):
+        args_dict = func_call.args
+    else:
+        args_dict = {}
+    return {
+        "id": f"gemini_{uuid4().hex[:16]}",
+        "name": func_call.name,
+        "arguments": json.dumps(args_dict) if args_dict else "{}",
+    }
+
+
+async def _call_gemini(
+    messages: List[Dict[str, str]],
+    tools: Optional[List[Dict[str, Any]]] = None,
+    api_key: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Call Google Gemini API using google-genai library.
+    
+    Args:
+        messages: List of message dicts
+        tools: Optional tool definitions
+        api_key: API key
         
-        # Check for specific Gemini error types
-        if "ServerError" in error_type or "503" in error_message or "UNAVAILABLE" in error_message:
-            return {
-                "role": "assistant",
-                "content": (
-                    "Desculpe, o serviço de IA está temporariamente sobrecarregado. "
-                    "Por favor, tente novamente em alguns instantes. "
-                    "Se o problema persistir, você pode tentar usar outro provedor de IA (OpenAI ou Anthropic) "
-                    "configurando a variável AI_PROVIDER no arquivo .env."
-                ),
-                "tool_calls": [],
-                "error": "service_unavailable",
-            }
-        elif "429" in error_message or "RATE_LIMIT" in error_message or "quota" in error_message.lower():
-            return {
-                "role": "assistant",
-                "content": (
-                    "Desculpe, você atingiu o limite de requisições da API do Gemini. "
-                    "Por favor, aguarde alguns minutos antes de tentar novamente, ou considere usar outro provedor de IA."
-                ),
-                "tool_calls": [],
-                "error": "rate_limit_exceeded",
-            }
-        elif "401" in error_message or "403" in error_message or "INVALID_API_KEY" in error_message:
-            return {
-                "role": "assistant",
-                "content": (
-                    "Erro de autenticação com a API do Gemini. "
-                    "Por favor, verifique se a chave GEMINI_API_KEY está correta no arquivo .env."
-                ),
-                "tool_calls": [],
-                "error": "authentication_error",
-            }
-        elif "400" in error_message or "INVALID_ARGUMENT" in error_message:
-            return {
-                "role": "assistant",
-                "content": (
-                    "Erro na requisição para a API do Gemini. "
-                    "Por favor, tente reformular sua mensagem ou entre em contato com o suporte."
-                ),
-                "tool_calls": [],
-                "error": "invalid_request",
-            }
-        else:
-            # Generic error
-            return {
-                "role": "assistant",
-                "content": (
-                    "Desculpe, ocorreu um erro ao processar sua mensagem. "
-                    "Por favor, tente novamente. Se o problema persistir, verifique a configuração da API."
-                ),
-                "tool_calls": [],
-                "error": "unknown_error",
-            }
-    
-    # Run synchronous API call in thread pool to avoid blocking
-    def _call_gemini_sync() -> Any:
-        try:
-            # Build contents - use Content objects for history + current message
-            # The API accepts either a string or a list of Content objects
-            if conversation_history:
-                # If we have history, build full conversation: history + current user message
-                all_contents = conversation_history + [types.Content(role="user", parts=[types.Part(text=current_message)])]
-                contents = all_contents
-            else:
-                # No history, just send current message as string
-                contents = current_message if current_message else ""
-            
-            response = client.models.generate_content(
-                model=AI_MODEL_CHAT,
-                contents=contents,
-                config=config,
-            )
-            return response
-        except Exception as e:
-            print(f"[ERROR] Gemini API call failed: {type(e).__name__}: {e}")
-            import traceback
-            print(f"[ERROR] Traceback:\n{traceback.format_exc()}")
-            raise
+    Returns:
+        Gemini response dict
+    """
+    client = _gemini_client(api_key)
+    contents, config = _gemini_request(messages, tools)
     
+    # Native async client: no thread-pool hop per request
     try:
-        response = await asyncio.to_thread(_call_gemini_sync)
+        response = await client.aio.models.generate_content(
+            model=AI_MODEL_CHAT,
+            contents=contents,
+            config=config,
+        )
     except Exception as e:
-        print(f"[ERROR] Gemini API call failed: {type(e).__name__}: {e}")
-        import traceback
-        print(f"[ERROR] Traceback:\n{traceback.format_exc()}")
+        logger.exception("Gemini API call failed: %s: %s", type(e).__name__, e)
         # Return user-friendly error instead of raising
-        return _handle_gemini_error(e)
+        return _gemini_error_response(e)
+    
+    # Extract function calls and text content in a single pass over the parts
+    # (response.text is just the concatenation of the same text parts)
+    content_parts: List[str] = []
+    tool_calls: List[Dict[str, str]] = []
+    candidate = response.candidates[0] if response.candidates else None
+    parts = candidate.content.parts if candidate and candidate.content else None
+    for part in parts or ():
+        if part.function_call:
+            tool_calls.append(_gemini_tool_call(part.function_call))
+        elif part.text:
+            content_parts.append(part.text)
     
-    # Extract response
     result: Dict[str, Any] = {
         "role": "assistant",
-        "content": "",
-        "tool_calls": [],
+        "content": "".join(content_parts),
+        "tool_calls": tool_calls,
     }
     
-    # Extract function calls and text content from parts first
-    has_function_calls = False
-    if hasattr(response, 'candidates') and response.candidates:
-        candidate = response.candidates[0]
-        if hasattr(candidate, 'content') and candidate.content:
-            # Check if content has parts and it's not None
-            if hasattr(candidate.content, 'parts') and candidate.content.parts is not None:
-                import json
-                for part in candidate.content.parts:
-                    if hasattr(part, 'function_call') and part.function_call:
-                        has_function_calls = True
-                        func_call = part.function_call
-                        # Convert args to dict if it's not already
-                        if hasattr(func_call.args, 'items'):
-                            args_dict = dict(func_call.args)
-                        elif isinstance(func_call.args, dict):
-                            args_dict = func_call.args
-                        else:
-                            args_dict = {}
-                        result["tool_calls"].append({
-                            "id": f"gemini_{hash(str(func_call))}",
-                            "name": func_call.name,
-                            "arguments": json.dumps(args_dict) if args_dict else "{}",
-                        })
-                    elif hasattr(part, 'text') and part.text:
-                        result["content"] += part.text
-            elif hasattr(candidate.content, 'text') and candidate.content.text:
-                # Sometimes content.text is available directly
-                result["content"] = str(candidate.content.text)
-                print(f"[DEBUG] Extracted text from candidate.content.text: {len(result['content'])} chars")
-    
-    # Extract text content - Only try response.text if no function calls were found
-    # response.text raises ValueError when response contains function_call parts
-    if not has_function_calls:
-        try:
-            # Check if response has text attribute before accessing
-            if hasattr(response, 'text'):
-                text_content = response.text
-                # response.text can return None, empty string, or actual text
-                if text_content is not None:
-                    result["content"] = str(text_content)
-                    if result["content"]:
-                        print(f"[DEBUG] Extracted text from response.text: {len(result['content'])} chars")
-                    else:
-                        print(f"[DEBUG] response.text returned empty string")
-                else:
-                    # response.text is None - try to extract from parts as fallback
-                    print(f"[DEBUG] response.text is None, trying to extract from parts")
-        except ValueError as e:
-            # ValueError occurs when response contains function_call parts
-            # This is expected and we've already extracted from parts above
-            print(f"[DEBUG] response.text not available (function calls present): {e}")
-        except Exception as e:
-            print(f"[WARNING] Error accessing response.text: {e}")
-    
-    # If still no content, try to extract from parts (fallback)
-    if not result["content"] and hasattr(response, 'candidates') and response.candidates:
-        candidate = response.candidates[0]
-        if hasattr(candidate, 'content') and candidate.content:
-            # Try parts first
-            if hasattr(candidate.content, 'parts') and candidate.content.parts is not None:
-                for part in candidate.content.parts:
-                    if hasattr(part, 'text') and part.text:
-                        result["content"] += part.text
-                        print(f"[DEBUG] Extracted text from parts: {len(part.text)} chars")
-            # Try direct text attribute on content
-            elif hasattr(candidate.content, 'text') and candidate.content.text:
-                result["content"] = str(candidate.content.text)
-                print(f"[DEBUG] Extracted text from candidate.content.text (fallback): {len(result['content'])} chars")
-        # Try candidate.text directly
-        if not result["content"] and hasattr(candidate, 'text') and candidate.text:
-            result["content"] = str(candidate.text)
-            print(f"[DEBUG] Extracted text from candidate.text: {len(result['content'])} chars")
-        # Try response.text as last resort (may raise ValueError if function calls present)
-        if not result["content"] and not has_function_calls:
-            try:
-                if hasattr(response, 'text') and response.text:
-                    result["content"] = str(response.text)
-                    print(f"[DEBUG] Extracted text from response.text (last resort): {len(result['content'])} chars")
-            except (ValueError, AttributeError) as e:
-                print(f"[DEBUG] Could not extract from response.text: {e}")
-    
-    # Log if still no content (for debugging)
-    # Note: It's normal to have no text content when function calls are present (first LLM call)
-    if not result["content"]:
-        if has_function_calls:
-            # This is expected - Gemini returns only function calls in first response
-            print(f"[DEBUG] No text content (function calls present - this is normal)")
-        else:
-            # No function calls and no content - this might be an issue
-            print(f"[WARNING] No text content found in response (no function calls)")
-            # Avoid accessing response.text if function calls are present (raises ValueError)
-            try:
-                text_info = f"response.text type: {type(response.text)}, value: {repr(response.text)}"
-                print(f"[WARNING] {text_info}")
-            except ValueError:
-                print(f"[WARNING] response.text not available")
-            
-            if hasattr(response, 'candidates') and response.candidates:
-                candidate = response.candidates[0]
-                if hasattr(candidate, 'content'):
-                    print(f"[WARNING] candidate.content.parts: {getattr(candidate.content, 'parts', None)}")
-                    print(f"[WARNING] candidate.content.role: {getattr(candidate.content, 'role', None)}")
-            
-            # If no tool calls and no content, something went wrong
-            result["content"] = (
-                "Desculpe, não consegui gerar uma resposta. "
-                "Por favor, tente reformular sua pergunta ou verifique se há dados disponíveis."
-            )
-            print(f"[WARNING] Added fallback message due to empty response")
+    # No text is normal when Gemini only returns function calls (first LLM call)
+    if not result["content"] and not tool_calls:
+        logger.warning("No text content found in Gemini response (no function calls)")
+        result["content"] = (
+            "Desculpe, não consegui gerar uma resposta. "
+            "Por favor, tente reformular sua pergunta ou verifique se há dados disponíveis."
+        )
     
     return result
 
 
+async def _stream_gemini(
+    messages: List[Dict[str, str]],
+    tools: Optional[List[Dict[str, Any]]] = None,
+    api_key: Optional[str] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """Stream a Gemini reply via the native async client (see call_llm_stream for the event shape)."""
+    client = _gemini_client(api_key)
+    contents, config = _gemini_request(messages, tools)
+    
+    content_parts: List[str] = []
+    tool_calls: List[Dict[str, str]] = []
+    try:
+        stream = await client.aio.models.generate_content_stream(
+            model=AI_MODEL_CHAT,
+            contents=contents,
+            config=config,
+        )
+        async for chunk in stream:
+            candidate = chunk.candidates[0] if chunk.candidates else None
+            parts = candidate.content.parts if candidate and candidate.content else None
+            for part in parts or []:
+                if part.function_call:
+                    # Function call parts always arrive complete
+                    tool_calls.append(_gemini_tool_call(part.function_call))
+                    yield {"tool_call": tool_calls[-1]}
+                elif part.text:
+                    content_parts.append(part.text)
+                    yield {"delta": part.text}
+    except Exception as e:
+        logger.error("Gemini streaming call failed: %s: %s", type(e).__name__, e)
+        # Same user-friendly error response as the non-streaming call
+        yield {"done": True, "response": _gemini_error_response(e)}
+        return
+    
+    yield {
+        "done": True,
+        "response": {
+            "role": "assistant",
+            "content": "".join(content_parts),
+            "tool_calls": tool_calls,
+        },
+    }
+
+
 def _convert_tools_to_gemini_format(tools: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """
     Convert OpenAI/Anthropic tool format to Gemini function declaration format.
@@ -766,6 +1474,331 @@ def _convert_tools_to_gemini_format(tools: List[Dict[str, Any]]) -> List[Dict[st
     return gemini_functions
 
 
+def _context_pack_message(user_id: UUID, pack: Dict[str, Any]) -> Dict[str, str]:
+    """
+    Render the finance context pack system message, reusing the previous
+    rendering while build_finance_context_pack keeps returning the same pack.
+    
+    The pack cache is keyed by the user's transaction write version, so writes
+    invalidate the rendering too. Relevance-ranked packs are rebuilt per call
+    and always re-rendered.
+    
+    Args:
+        user_id: User ID
+        pack: Finance context pack
+        
+    Returns:
+        System message carrying the pack in AI_CONTEXT_PACK_FORMAT
+    """
+    cached = _context_pack_messages.get(user_id)
+    if cached is not None and cached[0] is pack and cached[1] == AI_CONTEXT_PACK_FORMAT:
+        return cached[2]
+    
+    if AI_CONTEXT_PACK_FORMAT == "text":
+        context_text = render_finance_context_pack_text(pack)
+    else:
+        context_text, _ = serialize_finance_context_pack(pack)
+    message = {
+        "role": "system",
+        "content": f"FINANCE_CONTEXT_PACK (server, scoped to user): {context_text}",
+    }
+    if user_id not in _context_pack_messages and len(_context_pack_messages) >= _CONTEXT_PACK_MESSAGES_MAX_USERS:
+        # Evict the oldest inserted entry to keep memory bounded
+        _context_pack_messages.pop(next(iter(_context_pack_messages)))
+    _context_pack_messages[user_id] = (pack, AI_CONTEXT_PACK_FORMAT, message)
+    return message
+
+
+# Instruction appended to tool results for the follow-up LLM call
+_TOOL_RESULTS_INSTRUCTION_ERROR = (
+    "Analise os resultados acima. Se houver ERROS, você deve:\n"
+    "1. Se o erro mencionar que a transação não foi encontrada, use list_transactions primeiro para encontrar a transação correta.\n"
+    "2. Use os IDs das transações encontradas para tentar novamente a operação solicitada.\n"
+    "3. Se não conseguir encontrar a transação, informe o usuário de forma clara e sugira listar todas as transações.\n"
+    "4. Responda ao usuário de forma útil mesmo se houver erros."
+)
+_TOOL_RESULTS_INSTRUCTION_OK = "Analise esses resultados e responda à pergunta do usuário de forma clara e útil."
+
+# Confirmation used when the model ends a tool turn without text, in priority
+# order: the first of these tools that succeeded picks the message
+_TOOL_FALLBACK_MESSAGES = {
+    "update_transaction": "Transação atualizada com sucesso!",
+    "delete_transaction": "Transação excluída com sucesso!",
+    "create_transaction": "Transação registrada com sucesso!",
+}
+_GENERIC_TOOL_FALLBACK_MESSAGE = "Operação realizada com sucesso!"
+
+
+def _is_tool_error(result: Any) -> bool:
+    """Whether a tool result is an error payload."""
+    return isinstance(result, dict) and bool(result.get("error"))
+
+
+def _format_tool_result(tool_result: Dict[str, Any]) -> str:
+    """Describe one tool result for the follow-up LLM call."""
+    result = tool_result["result"]
+    if _is_tool_error(result):
+        error_msg = result.get("message", result.get("error", "Erro desconhecido"))
+        return (
+            f"ERRO na função {tool_result['name']}: {error_msg}\n"
+            f"Se o erro mencionar 'not found' ou 'não encontrada', você deve primeiro usar list_transactions "
+            f"para encontrar a transação correta antes de tentar atualizar ou deletar novamente."
+        )
+    result_str = compact_tool_result(result)
+    return f"Função {tool_result['name']} executada com sucesso. Resultado:\n{result_str}"
+
+
+def _join_bounded(texts: Iterable[str], separator: str, max_chars: int) -> str:
+    """
+    Join texts like separator.join(texts), cut at max_chars with a
+    "... (truncated)" marker, without consuming texts past the cut.
+    
+    Args:
+        texts: Texts to join (may be a lazy generator)
+        separator: Separator between texts
+        max_chars: Character cap for the joined text (before the marker)
+        
+    Returns:
+        Joined (and possibly truncated) text
+    """
+    parts: List[str] = []
+    length = 0
+    for index, text in enumerate(texts):
+        if index:
+            parts.append(separator)
+            length += len(separator)
+        parts.append(text)
+        length += len(text)
+        if length > max_chars:
+            overflow = length - max_chars
+            # The overflow may extend into the separator before the last text
+            while overflow and overflow >= len(parts[-1]):
+                overflow -= len(parts.pop())
+            if overflow:
+                parts[-1] = parts[-1][:-overflow]
+            return "".join(parts) + "... (truncated)"
+    return "".join(parts)
+
+
+def _parse_tool_arguments(tool_call: Dict[str, Any]) -> Any:
+    """Decode a tool call's JSON arguments (ValueError if malformed; orjson when installed)."""
+    arguments = tool_call["arguments"]
+    if not isinstance(arguments, str):
+        return arguments
+    # orjson.JSONDecodeError subclasses ValueError, like json.JSONDecodeError
+    return orjson.loads(arguments) if ORJSON_AVAILABLE else json.loads(arguments)
+
+
+async def _stream_llm_starting_tools(
+    messages: List[Dict[str, str]],
+    tools: List[Dict[str, Any]],
+    api_key: Optional[str],
+    db: AsyncSession,
+    user_id: UUID,
+) -> Tuple[Dict[str, Any], Dict[str, Tuple[Any, "asyncio.Future[Any]"]]]:
+    """
+    Stream an LLM call and start read-only tool calls as soon as each one is
+    complete, so they run while the model is still generating.
+    
+    Only reads emitted before any mutating tool are started early (on sibling
+    sessions); everything from the first write on waits for the full reply so
+    the batch keeps its model-emitted ordering.
+    
+    Args:
+        messages: Messages to send
+        tools: Tool definitions
+        api_key: API key
+        db: Database session
+        user_id: User ID (injected from JWT, never from LLM)
+        
+    Returns:
+        Tuple of (final response dict, tool call id -> (parsed arguments, started tool run))
+    """
+    early_tool_runs: Dict[str, Tuple[Any, "asyncio.Future[Any]"]] = {}
+    seen_write = False
+    response: Dict[str, Any] = {"role": "assistant", "content": "", "tool_calls": []}
+    try:
+        async for event in call_llm_stream(messages, tools=tools, api_key=api_key):
+            tool_call = event.get("tool_call")
+            if tool_call is not None:
+                seen_write = seen_write or tool_call["name"] in MUTATING_TOOLS
+                if seen_write or not tool_call["id"] or tool_call["id"] in early_tool_runs:
+                    continue
+                try:
+                    tool_args = _parse_tool_arguments(tool_call)
+                except ValueError:
+                    continue  # Reported with the rest of the batch
+                logger.debug("Starting tool early: %s with args: %s", tool_call["name"], tool_args)
+                early_tool_runs[tool_call["id"]] = (tool_args, asyncio.ensure_future(
+                    execute_read_tool_isolated(db, user_id, tool_call["name"], tool_args)
+                ))
+            elif event.get("done"):
+                response = event["response"]
+    except BaseException:
+        for _, run in early_tool_runs.values():
+            run.cancel()
+        raise
+    
+    if response.get("error") or not response.get("tool_calls"):
+        for _, run in early_tool_runs.values():
+            run.cancel()
+        return response, {}
+    return response, early_tool_runs
+
+
+async def _execute_tool_calls(
+    db: AsyncSession,
+    user_id: UUID,
+    tool_calls: List[Dict[str, Any]],
+    early_tool_runs: Dict[str, Tuple[Any, "asyncio.Future[Any]"]],
+) -> Tuple[List[Any], List[Any]]:
+    """
+    Execute a round of tool calls, reusing runs already started while streaming.
+    
+    Args:
+        db: Database session
+        user_id: User ID (injected from JWT, never from LLM)
+        tool_calls: Tool calls in model-emitted order
+        early_tool_runs: Tool call id -> (parsed arguments, already started run)
+            (see _stream_llm_starting_tools)
+        
+    Returns:
+        Tuple of (parsed arguments, result or exception) lists aligned with tool_calls
+    """
+    tool_args_list: List[Any] = [None] * len(tool_calls)
+    outcomes: List[Any] = [None] * len(tool_calls)
+    pending: List[int] = []
+    for index, tool_call in enumerate(tool_calls):
+        early_run = early_tool_runs.get(tool_call["id"])
+        if early_run is not None:
+            tool_args_list[index] = early_run[0]  # Already parsed when the run started
+            continue
+        try:
+            tool_args_list[index] = _parse_tool_arguments(tool_call)
+        except ValueError as e:
+            outcomes[index] = e
+            continue
+        logger.debug("Executing tool: %s with args: %s", tool_call["name"], tool_args_list[index])
+        pending.append(index)
+    
+    # Early reads finish before the remaining calls run, so writes never overlap them
+    for index, tool_call in enumerate(tool_calls):
+        early_run = early_tool_runs.get(tool_call["id"])
+        if early_run is not None:
+            try:
+                outcomes[index] = await early_run[1]
+            except Exception as e:
+                outcomes[index] = e
+    
+    results = await execute_tools_parallel(
+        db,
+        user_id,
+        [(tool_calls[index]["name"], tool_args_list[index]) for index in pending],
+    )
+    for index, result in zip(pending, results):
+        outcomes[index] = result
+    return tool_args_list, outcomes
+
+
+def _as_uuid(value: Any) -> Optional[UUID]:
+    """Coerce a tool result id to a UUID (None if it is not a valid UUID)."""
+    if isinstance(value, UUID):
+        return value
+    if not isinstance(value, str):
+        return None
+    try:
+        return UUID(value)
+    except ValueError:
+        return None
+
+
+# Transaction fields copied into create/update success cards
+_TRANSACTION_CARD_FIELDS = ("id", "amount", "type", "category", "description", "occurred_at")
+
+
+def _record_created_transaction(metadata: ChatAssistantMeta, result: Dict[str, Any]) -> None:
+    """Flag a created transaction and add its success card."""
+    if "id" not in result:
+        return
+    metadata.did_create_transaction = True
+    metadata.created_transaction_id = _as_uuid(result.get("id"))
+    metadata.ui_events.append(
+        ChatUiEvent.model_construct(
+            type="success_card",
+            variant="neon",
+            accent="electric_lime",
+            title=get_random_confirmation_title(),
+            subtitle=get_random_confirmation_subtitle(result.get("type") == "INCOME"),
+            data={"transaction": {field: result.get(field) for field in _TRANSACTION_CARD_FIELDS}},
+        )
+    )
+
+
+def _record_updated_transaction(metadata: ChatAssistantMeta, result: Dict[str, Any]) -> None:
+    """Flag an updated transaction and add its success card."""
+    if "id" not in result:
+        return
+    metadata.did_update_transaction = True
+    metadata.updated_transaction_id = _as_uuid(result.get("id"))
+    metadata.ui_events.append(
+        ChatUiEvent.model_construct(
+            type="success_card",
+            variant="neon",
+            accent="electric_lime",
+            title="Atualizado.",
+            subtitle="Transação atualizada.",
+            data={"transaction": {field: result.get(field) for field in _TRANSACTION_CARD_FIELDS}},
+        )
+    )
+
+
+def _record_deleted_transaction(metadata: ChatAssistantMeta, result: Dict[str, Any]) -> None:
+    """Flag a deleted transaction and add its info card."""
+    if "deleted" not in result:
+        return
+    metadata.did_delete_transaction = True
+    metadata.deleted_transaction_id = _as_uuid(result.get("id"))
+    metadata.ui_events.append(
+        ChatUiEvent.model_construct(
+            type="info_card",
+            variant="neon",
+            accent="deep_indigo",
+            title="Removido.",
+            subtitle="Transação excluída.",
+            data={
+                "deleted_transaction_id": result.get("id"),
+                "amount": result.get("amount"),
+                "category": result.get("category"),
+            },
+        )
+    )
+
+
+# Tool name -> UI metadata recorder for its successful results
+_TOOL_METADATA_HANDLERS: Dict[str, Callable[[ChatAssistantMeta, Dict[str, Any]], None]] = {
+    "create_transaction": _record_created_transaction,
+    "update_transaction": _record_updated_transaction,
+    "delete_transaction": _record_deleted_transaction,
+}
+
+
+def _record_tool_metadata(metadata: ChatAssistantMeta, tool_name: str, result: Any) -> None:
+    """
+    Record a successful tool result on the UI metadata (flags, ids, success cards).
+    
+    Cards are built with model_construct: every field value is a literal from
+    the recorders, so per-call pydantic validation would only repeat work.
+    
+    Args:
+        metadata: Assistant metadata for the current turn (mutated in place)
+        tool_name: Name of the executed tool
+        result: Tool result
+    """
+    handler = _TOOL_METADATA_HANDLERS.get(tool_name)
+    if handler is not None and isinstance(result, dict):
+        handler(metadata, result)
+
+
 async def process_chat_message(
     db: AsyncSession,
     user_id: UUID,
@@ -788,21 +1821,21 @@ async def process_chat_message(
         include_context_pack: Whether to inject finance context pack (default False)
         
     Returns:
-        Assistant response dict with content, optional tool results, and metadata
+        Assistant response dict with content, optional tool results, and
+        metadata (a ChatAssistantMeta, serialized once by the response model)
         
     Raises:
         ValueError: If API key is missing
         Exception: If LLM call fails
     """
-    print(f"[DEBUG] ========== Processing chat message ==========")
-    print(f"[DEBUG] User: {user_id}, Conversation: {conversation_id}")
-    print(f"[DEBUG] User message: {user_message[:100]}...")
-    print(f"[DEBUG] AI Provider: {AI_PROVIDER}, Model: {AI_MODEL_CHAT}")
-    print(f"[DEBUG] Include context pack: {include_context_pack}")
+    logger.debug(
+        "Processing chat message: user=%s conversation=%s provider=%s model=%s include_context_pack=%s message=%.100s",
+        user_id, conversation_id, AI_PROVIDER, AI_MODEL_CHAT, include_context_pack, user_message,
+    )
     
     # Check for API key
     api_key = get_api_key(user_id)
-    print(f"[DEBUG] API key found: {bool(api_key)}")
+    logger.debug("API key found: %s", bool(api_key))
     if not api_key:
         # Return a message asking for API key (with empty metadata)
         metadata = ChatAssistantMeta()
@@ -817,17 +1850,11 @@ async def process_chat_message(
             ),
             "tool_calls": [],
             "needs_api_key": True,
-            "metadata": metadata.model_dump(),
+            "metadata": metadata,
         }
     
-    # Build context messages
-    messages: List[Dict[str, str]] = []
-    
-    # Add system prompt
-    messages.append({
-        "role": "system",
-        "content": SYSTEM_PROMPT,
-    })
+    # Build context messages, starting with the shared system prompt message
+    messages: List[Dict[str, str]] = [_SYSTEM_MESSAGE]
     
     # Add conversation summary if available
     if conversation_summary:
@@ -839,15 +1866,14 @@ async def process_chat_message(
     # Optionally inject finance context pack
     if include_context_pack:
         try:
-            import json
-            context_pack = await build_finance_context_pack(db, user_id)
-            context_json = json.dumps(context_pack, ensure_ascii=False)
-            messages.append({
-                "role": "system",
-                "content": f"FINANCE_CONTEXT_PACK (server, scoped to user): {context_json}",
-            })
+            context_pack = await build_finance_context_pack(
+                db,
+                user_id,
+                relevant_to=user_message if AI_CONTEXT_PACK_RELEVANCE else None,
+            )
+            messages.append(_context_pack_message(user_id, context_pack))
         except Exception as e:
-            print(f"[WARNING] Failed to build context pack: {e}")
+            logger.warning("Failed to build context pack: %s", e)
             # Continue without context pack
     
     # Add recent messages
@@ -863,57 +1889,55 @@ async def process_chat_message(
     attach_tools = should_attach_tools(user_message, include_context_pack)
     if not attach_tools and should_force_tools_from_context(recent_messages):
         attach_tools = True
-        print("[DEBUG] Forcing tools due to clarification context from previous assistant message")
+        logger.debug("Forcing tools due to clarification context from previous assistant message")
     tools_to_use = TOOLS if attach_tools else None
     
     # Debug: Log why tools are/aren't being attached
-    if AI_TOOLS_MODE == "heuristic":
-        user_text_lower = user_message.lower()
-        matched_keywords = [kw for kw in [
-            "criar", "registrar", "adicionar", "create", "add", "register",
-            "alterar", "altera", "mudar", "muda", "editar", "edita", "atualizar", "atualiza",
-            "update", "edit", "change", "modify", "modificar",
-            "deletar", "deleta", "remover", "remove", "excluir", "exclui", "apagar", "apaga",
-            "delete", "remove", "exclude",
-            "saldo", "gasto", "gastei", "receita", "despesa", "extrato",
-            "quanto", "balance", "transaction", "spending",
-            "transação", "transacao",
-            "listar", "list", "mostrar", "show", "ver", "ver todas",
-        ] if kw in user_text_lower]
-        print(f"[DEBUG] Heuristic mode: attach_tools={attach_tools}, include_context_pack={include_context_pack}, matched_keywords={matched_keywords}")
+    if AI_TOOLS_MODE == "heuristic" and logger.isEnabledFor(logging.DEBUG):
+        matched_keywords = _ACTION_KEYWORDS_RE.findall(user_message)
+        logger.debug(
+            "Heuristic mode: attach_tools=%s, include_context_pack=%s, matched_keywords=%s",
+            attach_tools, include_context_pack, matched_keywords,
+        )
     
     # First LLM call (may include tool calls)
-    print(f"[DEBUG] Calling LLM with {len(messages)} messages, {len(tools_to_use) if tools_to_use else 0} tools (mode: {AI_TOOLS_MODE})")
+    early_tool_runs: Dict[str, Tuple[Any, "asyncio.Future[Any]"]] = {}
+    logger.debug(
+        "Calling LLM with %d messages, %d tools (mode: %s)",
+        len(messages), len(tools_to_use) if tools_to_use else 0, AI_TOOLS_MODE,
+    )
     try:
-        llm_response = await call_llm(messages, tools=tools_to_use, api_key=api_key)
-        print(f"[DEBUG] LLM response received: {bool(llm_response.get('content'))}, tool_calls: {len(llm_response.get('tool_calls', []))}")
+        if AI_STREAM_TOOL_CALLS and tools_to_use:
+            llm_response, early_tool_runs = await _stream_llm_starting_tools(
+                messages, tools_to_use, api_key, db, user_id
+            )
+        else:
+            llm_response = await call_llm(messages, tools=tools_to_use, api_key=api_key, user_id=user_id)
+        logger.debug(
+            "LLM response received: content=%s, tool_calls=%d",
+            bool(llm_response.get("content")), len(llm_response.get("tool_calls") or []),
+        )
         
         # Check if response contains an error (from Gemini error handling)
         if llm_response.get("error"):
-            llm_response["metadata"] = ChatAssistantMeta().model_dump()
+            llm_response["metadata"] = ChatAssistantMeta()
             return llm_response
     except Exception as e:
-        print(f"[ERROR] LLM call failed: {type(e).__name__}: {e}")
-        import traceback
-        print(f"[ERROR] Traceback:\n{traceback.format_exc()}")
+        logger.exception("LLM call failed: %s: %s", type(e).__name__, e)
         # For Gemini, try to return user-friendly error
-        if AI_PROVIDER == "gemini":
-            try:
-                from google.genai import errors as genai_errors
-                if isinstance(e, (genai_errors.ServerError, genai_errors.ClientError, genai_errors.APIError)):
-                    metadata = ChatAssistantMeta()
-                    return {
-                        "role": "assistant",
-                        "content": (
-                            "Desculpe, ocorreu um erro ao processar sua mensagem. "
-                            "Por favor, tente novamente em alguns instantes."
-                        ),
-                        "tool_calls": [],
-                        "error": "api_error",
-                        "metadata": metadata.model_dump(),
-                    }
-            except ImportError:
-                pass
+        if AI_PROVIDER == "gemini" and genai_errors is not None:
+            if isinstance(e, (genai_errors.ServerError, genai_errors.ClientError, genai_errors.APIError)):
+                metadata = ChatAssistantMeta()
+                return {
+                    "role": "assistant",
+                    "content": (
+                        "Desculpe, ocorreu um erro ao processar sua mensagem. "
+                        "Por favor, tente novamente em alguns instantes."
+                    ),
+                    "tool_calls": [],
+                    "error": "api_error",
+                    "metadata": metadata,
+                }
         raise
     
     # Track metadata for UI events
@@ -928,104 +1952,36 @@ async def process_chat_message(
     while current_response.get("tool_calls") and tool_iterations < max_tool_iterations:
         tool_iterations += 1
         tool_results = []
-        print(f"[DEBUG] Executing {len(current_response['tool_calls'])} tool calls (iteration {tool_iterations}/{max_tool_iterations})")
-        for tool_call in current_response["tool_calls"]:
-            try:
-                import json
-                tool_args = json.loads(tool_call["arguments"]) if isinstance(tool_call["arguments"], str) else tool_call["arguments"]
-                print(f"[DEBUG] Executing tool: {tool_call['name']} with args: {tool_args}")
-                result = await execute_tool(db, user_id, tool_call["name"], tool_args)
-                print(f"[DEBUG] Tool {tool_call['name']} executed successfully. Result type: {type(result)}, Result keys: {list(result.keys()) if isinstance(result, dict) else 'not a dict'}")
-                if isinstance(result, dict):
-                    print(f"[DEBUG] Result has 'error' key: {'error' in result}, Result has 'id' key: {'id' in result}")
+        logger.debug(
+            "Executing %d tool calls (iteration %d/%d)",
+            len(current_response["tool_calls"]), tool_iterations, max_tool_iterations,
+        )
+        # Run the calls (reads overlap, writes stay in order; some may already have
+        # run while the reply was streaming) and apply results in model-emitted order
+        tool_calls = current_response["tool_calls"]
+        tool_args_list, outcomes = await _execute_tool_calls(db, user_id, tool_calls, early_tool_runs)
+        early_tool_runs = {}
+        
+        for tool_call, tool_args, result in zip(tool_calls, tool_args_list, outcomes):
+            if not isinstance(result, Exception):
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(
+                        "Tool %s executed successfully. Result keys: %s",
+                        tool_call["name"], list(result.keys()) if isinstance(result, dict) else type(result).__name__,
+                    )
                 tool_results.append({
                     "tool_call_id": tool_call["id"],
                     "name": tool_call["name"],
                     "result": result,
                 })
-
-                # Track transaction creation for UI metadata
-                if tool_call["name"] == "create_transaction" and isinstance(result, dict) and "id" in result:
-                    metadata.did_create_transaction = True
-                    try:
-                        metadata.created_transaction_id = UUID(result["id"])
-                    except (ValueError, TypeError):
-                        pass
-                    is_income = result.get("type") == "INCOME"
-                    metadata.ui_events.append(
-                        ChatUiEvent(
-                            type="success_card",
-                            variant="neon",
-                            accent="electric_lime",
-                            title=get_random_confirmation_title(),
-                            subtitle=get_random_confirmation_subtitle(is_income),
-                            data={
-                                "transaction": {
-                                    "id": result.get("id"),
-                                    "amount": result.get("amount"),
-                                    "type": result.get("type"),
-                                    "category": result.get("category"),
-                                    "description": result.get("description"),
-                                    "occurred_at": result.get("occurred_at"),
-                                }
-                            },
-                        )
-                    )
-
-                # Track transaction update for UI metadata
-                elif tool_call["name"] == "update_transaction" and isinstance(result, dict) and "id" in result:
-                    metadata.did_update_transaction = True
-                    try:
-                        metadata.updated_transaction_id = UUID(result["id"])
-                    except (ValueError, TypeError):
-                        pass
-                    metadata.ui_events.append(
-                        ChatUiEvent(
-                            type="success_card",
-                            variant="neon",
-                            accent="electric_lime",
-                            title="Atualizado.",
-                            subtitle="Transação atualizada.",
-                            data={
-                                "transaction": {
-                                    "id": result.get("id"),
-                                    "amount": result.get("amount"),
-                                    "type": result.get("type"),
-                                    "category": result.get("category"),
-                                    "description": result.get("description"),
-                                    "occurred_at": result.get("occurred_at"),
-                                }
-                            },
-                        )
-                    )
-
-                # Track transaction deletion for UI metadata
-                elif tool_call["name"] == "delete_transaction" and isinstance(result, dict) and "deleted" in result:
-                    metadata.did_delete_transaction = True
-                    try:
-                        metadata.deleted_transaction_id = UUID(result["id"])
-                    except (ValueError, TypeError):
-                        pass
-                    metadata.ui_events.append(
-                        ChatUiEvent(
-                            type="info_card",
-                            variant="neon",
-                            accent="deep_indigo",
-                            title="Removido.",
-                            subtitle="Transação excluída.",
-                            data={
-                                "deleted_transaction_id": result.get("id"),
-                                "amount": result.get("amount"),
-                                "category": result.get("category"),
-                            },
-                        )
-                    )
-            except Exception as e:
-                import traceback
-                print(f"[ERROR] Tool execution failed: {tool_call.get('name')}: {e}")
-                print(f"[ERROR] Tool args were: {tool_args}")
-                print(f"[ERROR] Traceback:\n{traceback.format_exc()}")
-                error_message = str(e)
+                _record_tool_metadata(metadata, tool_call["name"], result)
+            else:
+                logger.error(
+                    "Tool execution failed: %s: %s (args: %s)",
+                    tool_call.get("name"), result, tool_args,
+                    exc_info=result,
+                )
+                error_message = str(result)
                 tool_results.append({
                     "tool_call_id": tool_call["id"],
                     "name": tool_call["name"],
@@ -1034,7 +1990,6 @@ async def process_chat_message(
                         "message": error_message,
                     },
                 })
-                print(f"[ERROR] Added error result to tool_results. Total results: {len(tool_results)}")
 
         all_tool_results.extend(tool_results)
 
@@ -1045,86 +2000,67 @@ async def process_chat_message(
             "tool_calls": current_response["tool_calls"],
         })
 
-        tool_results_text = []
-        for tool_result in tool_results:
-            result = tool_result["result"]
-            if isinstance(result, dict) and result.get("error"):
-                error_msg = result.get("message", result.get("error", "Erro desconhecido"))
-                tool_results_text.append(
-                    f"ERRO na função {tool_result['name']}: {error_msg}\n"
-                    f"Se o erro mencionar 'not found' ou 'não encontrada', você deve primeiro usar list_transactions "
-                    f"para encontrar a transação correta antes de tentar atualizar ou deletar novamente."
-                )
-            else:
-                result_str = compact_tool_result(result)
-                tool_results_text.append(f"Função {tool_result['name']} executada com sucesso. Resultado:\n{result_str}")
-
-        if tool_results_text:
-            combined_results = "\n\n".join(tool_results_text)
-            if len(combined_results) > AI_TOOL_RESULTS_MAX_CHARS:
-                combined_results = combined_results[:AI_TOOL_RESULTS_MAX_CHARS] + "... (truncated)"
-
-            has_errors = any("ERRO" in text for text in tool_results_text)
-            if has_errors:
-                instruction = (
-                    "Analise os resultados acima. Se houver ERROS, você deve:\n"
-                    "1. Se o erro mencionar que a transação não foi encontrada, use list_transactions primeiro para encontrar a transação correta.\n"
-                    "2. Use os IDs das transações encontradas para tentar novamente a operação solicitada.\n"
-                    "3. Se não conseguir encontrar a transação, informe o usuário de forma clara e sugira listar todas as transações.\n"
-                    "4. Responda ao usuário de forma útil mesmo se houver erros."
-                )
-            else:
-                instruction = "Analise esses resultados e responda à pergunta do usuário de forma clara e útil."
+        if tool_results:
+            has_errors = any(_is_tool_error(tool_result["result"]) for tool_result in tool_results)
+            # Texts are formatted lazily: results past the char cap are never serialized
+            combined_results = _join_bounded(
+                (_format_tool_result(tool_result) for tool_result in tool_results),
+                "\n\n",
+                AI_TOOL_RESULTS_MAX_CHARS,
+            )
+
+            instruction = _TOOL_RESULTS_INSTRUCTION_ERROR if has_errors else _TOOL_RESULTS_INSTRUCTION_OK
 
             messages.append({
                 "role": "user",
                 "content": f"Aqui estão os resultados das funções executadas:\n\n{combined_results}\n\n{instruction}",
             })
 
-        print(f"[DEBUG] Calling LLM with tool results (iteration {tool_iterations})")
-        print(f"[DEBUG] Messages count: {len(messages)}, Last message role: {messages[-1]['role'] if messages else 'N/A'}")
-        print(f"[DEBUG] Tool results count: {len(tool_results)}")
-        print(f"[DEBUG] Tool results summary: {[(tr['name'], 'SUCCESS' if not (isinstance(tr.get('result'), dict) and tr.get('result', {}).get('error')) else 'ERROR') for tr in tool_results]}")
+        if logger.isEnabledFor(logging.DEBUG):
+            tool_results_summary = [
+                (tr["name"], "ERROR" if isinstance(tr.get("result"), dict) and tr["result"].get("error") else "SUCCESS")
+                for tr in tool_results
+            ]
+            logger.debug(
+                "Calling LLM with tool results (iteration %d): %d messages, tool results: %s",
+                tool_iterations, len(messages), tool_results_summary,
+            )
         try:
             current_response = await call_llm(messages, tools=TOOLS, api_key=api_key)
-            print(f"[DEBUG] LLM response received after tools: {bool(current_response.get('content'))}, tool_calls: {len(current_response.get('tool_calls', []))}")
+            logger.debug(
+                "LLM response received after tools: content=%s, tool_calls=%d",
+                bool(current_response.get("content")), len(current_response.get("tool_calls") or []),
+            )
             if current_response.get("error"):
-                current_response["metadata"] = metadata.model_dump()
+                current_response["metadata"] = metadata
                 return current_response
         except Exception as e:
-            print(f"[ERROR] LLM call failed after tools: {type(e).__name__}: {e}")
-            import traceback
-            print(f"[ERROR] Traceback:\n{traceback.format_exc()}")
+            logger.exception("LLM call failed after tools: %s: %s", type(e).__name__, e)
             break
 
     final_response = current_response
 
     if not final_response.get("content") and all_tool_results:
-        print(f"[DEBUG] Final response has no content but tools were executed. Checking tool results...")
-        print(f"[DEBUG] Tool results: {[(tr['name'], 'error' in tr.get('result', {}) if isinstance(tr.get('result'), dict) else 'no error') for tr in all_tool_results]}")
-        successful_tools = [tr for tr in all_tool_results if not (isinstance(tr.get("result"), dict) and tr.get("result", {}).get("error"))]
-        print(f"[DEBUG] Successful tools: {[tr['name'] for tr in successful_tools]}")
-        if successful_tools:
-            tool_names = [tr["name"] for tr in successful_tools]
-            print(f"[DEBUG] Tool names from successful tools: {tool_names}")
-            if "update_transaction" in tool_names:
-                final_response["content"] = "Transação atualizada com sucesso!"
-                print(f"[DEBUG] Generated update confirmation message")
-            elif "delete_transaction" in tool_names:
-                final_response["content"] = "Transação excluída com sucesso!"
-                print(f"[DEBUG] Generated delete confirmation message")
-            elif "create_transaction" in tool_names:
-                final_response["content"] = "Transação registrada com sucesso!"
-                print(f"[DEBUG] Generated create confirmation message")
-            else:
-                final_response["content"] = "Operação realizada com sucesso!"
-                print(f"[DEBUG] Generated generic confirmation message for tools: {tool_names}")
+        tool_names = {tr["name"] for tr in all_tool_results if not _is_tool_error(tr.get("result"))}
+        if tool_names:
+            final_response["content"] = next(
+                (message for name, message in _TOOL_FALLBACK_MESSAGES.items() if name in tool_names),
+                _GENERIC_TOOL_FALLBACK_MESSAGE,
+            )
+            logger.debug("Final response had no content; generated confirmation for tools: %s", tool_names)
         else:
-            print(f"[WARNING] No successful tools found in tool_results. All results: {[tr.get('result') for tr in all_tool_results]}")
+            logger.warning(
+                "No successful tools found in tool results: %s",
+                [tr.get("result") for tr in all_tool_results],
+            )
 
-    final_response["metadata"] = metadata.model_dump()
-    print(f"[DEBUG] ========== Returning final response ==========")
-    print(f"[DEBUG] Content length: {len(final_response.get('content', ''))}")
-    print(f"[DEBUG] Metadata: did_update={metadata.did_update_transaction}, did_delete={metadata.did_delete_transaction}, did_create={metadata.did_create_transaction}")
-    print(f"[DEBUG] UI events count: {len(metadata.ui_events)}")
+    final_response["metadata"] = metadata
+    logger.debug(
+        "Returning final response: content_length=%d, did_update=%s, did_delete=%s, did_create=%s, ui_events=%d",
+        len(final_response.get("content") or ""),
+        metadata.did_update_transaction,
+        metadata.did_delete_transaction,
+        metadata.did_create_transaction,
+        len(metadata.ui_events),
+    )
     return final_response
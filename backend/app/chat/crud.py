@@ -3,16 +3,22 @@ CRUD operations for chat messages and conversation summaries.
 Note: conversation_id from client is a logical grouping key only. All queries
 filter by user_id from JWT—conversation isolation is enforced; no cross-user access.
 """
+import asyncio
+import logging
 import os
-from typing import List, Optional
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Sequence, Set, Tuple
 from uuid import UUID, uuid4
 
-from sqlalchemy import select, func
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import Row, func, select
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
 
 from app.models import ChatMessage, ChatConversationSummary
 from app.chat.schemas import ChatMessageCreate
 
+logger = logging.getLogger("zefa.chat")
+
 # Summarization prompt
 SUMMARIZATION_PROMPT = """Você é um assistente que resume conversas de forma concisa e factual.
 
@@ -25,6 +31,105 @@ Resuma a conversa abaixo, mantendo:
 
 Seja objetivo e mantenha apenas informações essenciais. O resumo será usado para dar contexto em conversas futuras."""
 
+# Last known message count per (user_id, conversation_id) (in-process), keyed
+# like the queries it stands in for since conversation ids come from clients. Seeded by the first
+# COUNT(*) for a conversation and incremented on each insert, so the
+# summarization check skips the COUNT while a conversation is under the
+# threshold. Inserts made by other workers are not seen, so the count can lag;
+# the real COUNT runs again once the cached value crosses the threshold.
+_CONV_MESSAGE_COUNT_MAX = 10_000
+_conv_message_count: Dict[Tuple[UUID, UUID], int] = {}
+
+
+# Conversation summary text (None when there is none yet) per (user_id,
+# conversation_id), with a time.monotonic() expiry. update_conversation_summary
+# writes through, so entries are only stale for summaries written by another
+# worker, and for at most the TTL.
+_SUMMARY_CACHE_TTL_SECONDS = 300
+_SUMMARY_CACHE_MAX = 10_000
+_summary_cache: Dict[Tuple[UUID, UUID], Tuple[Optional[str], float]] = {}
+
+
+def _cache_summary(user_id: UUID, conversation_id: UUID, summary: Optional[str]) -> None:
+    """Store a conversation's summary text, evicting the oldest entry when full."""
+    key = (user_id, conversation_id)
+    if key not in _summary_cache and len(_summary_cache) >= _SUMMARY_CACHE_MAX:
+        _summary_cache.pop(next(iter(_summary_cache)))
+    _summary_cache[key] = (summary, time.monotonic() + _SUMMARY_CACHE_TTL_SECONDS)
+
+
+def _record_message_count(user_id: UUID, conversation_id: UUID, count: int) -> None:
+    """Store a conversation's message count, evicting the oldest entry when full."""
+    key = (user_id, conversation_id)
+    if key not in _conv_message_count and len(_conv_message_count) >= _CONV_MESSAGE_COUNT_MAX:
+        _conv_message_count.pop(next(iter(_conv_message_count)))
+    _conv_message_count[key] = count
+
+
+def stage_chat_message(
+    db: AsyncSession,
+    user_id: UUID,
+    conversation_id: UUID,
+    role: str,
+    content: str,
+    content_type: str = "text",
+    tool_name: Optional[str] = None,
+    tool_call_id: Optional[str] = None,
+) -> ChatMessage:
+    """
+    Add a chat message to the session without committing it.
+    
+    id and created_at are assigned here (created_at in UTC, like the server
+    default) so the message is usable before commit_chat_messages, and
+    messages staged in one transaction keep their order (the database now()
+    is the same for the whole transaction).
+    
+    Args:
+        db: Database session
+        user_id: User ID (from JWT)
+        conversation_id: Conversation ID
+        role: Message role (system, user, assistant, tool)
+        content: Message content
+        content_type: Message content type
+        tool_name: Optional tool name (for tool messages)
+        tool_call_id: Optional tool call ID (for tool messages)
+        
+    Returns:
+        The pending ChatMessage object
+    """
+    # Ensure conversation_id belongs to user (or create new one)
+    # For MVP, we trust the conversation_id from payload, but in production
+    # you might want to verify ownership
+    db_message = ChatMessage(
+        id=uuid4(),
+        user_id=user_id,
+        conversation_id=conversation_id,
+        role=role,
+        content=content,
+        content_type=content_type,
+        tool_name=tool_name,
+        tool_call_id=tool_call_id,
+        created_at=datetime.now(timezone.utc),
+    )
+    db.add(db_message)
+    return db_message
+
+
+async def commit_chat_messages(db: AsyncSession, messages: Sequence[ChatMessage]) -> None:
+    """
+    Commit staged chat messages in a single transaction.
+    
+    Args:
+        db: Database session holding the messages from stage_chat_message
+        messages: The staged messages (used to keep message counts current)
+    """
+    await db.commit()
+    # Only conversations already counted are tracked (others are counted lazily)
+    for message in messages:
+        key = (message.user_id, message.conversation_id)
+        if key in _conv_message_count:
+            _conv_message_count[key] += 1
+
 
 async def create_chat_message(
     db: AsyncSession,
@@ -56,22 +161,17 @@ async def create_chat_message(
     if conversation_id is None:
         conversation_id = uuid4()
     
-    # Ensure conversation_id belongs to user (or create new one)
-    # For MVP, we trust the conversation_id from payload, but in production
-    # you might want to verify ownership
-    
-    db_message = ChatMessage(
-        user_id=user_id,
-        conversation_id=conversation_id,
-        role=role,
-        content=content,
+    db_message = stage_chat_message(
+        db,
+        user_id,
+        conversation_id,
+        role,
+        content,
         content_type=payload.content_type,
         tool_name=tool_name,
         tool_call_id=tool_call_id,
     )
-    db.add(db_message)
-    await db.commit()
-    await db.refresh(db_message)
+    await commit_chat_messages(db, [db_message])
     return db_message
 
 
@@ -80,12 +180,14 @@ async def list_recent_messages(
     user_id: UUID,
     conversation_id: UUID,
     limit: int = 50,
-) -> List[ChatMessage]:
+) -> List[Row]:
     """
     List recent messages for a conversation, ordered by created_at ascending.
     
     Gets the N most recent messages and returns them in chronological order
-    (oldest → newest) for LLM context building.
+    (oldest → newest) for LLM context building. Only the columns context
+    building reads are selected, as plain rows (no ORM object hydration).
+    idx_chat_messages_user_conversation_created serves the newest-first scan.
     
     Args:
         db: Database session
@@ -94,11 +196,11 @@ async def list_recent_messages(
         limit: Maximum number of messages to return
         
     Returns:
-        List of ChatMessage objects ordered by created_at ascending
+        Rows with id, role and content, ordered by created_at ascending
     """
     # Query newest N messages (descending order)
     result = await db.execute(
-        select(ChatMessage)
+        select(ChatMessage.id, ChatMessage.role, ChatMessage.content)
         .where(
             ChatMessage.user_id == user_id,
             ChatMessage.conversation_id == conversation_id,
@@ -106,7 +208,7 @@ async def list_recent_messages(
         .order_by(ChatMessage.created_at.desc())
         .limit(limit)
     )
-    messages = list(result.scalars().all())
+    messages = list(result.all())
     # Reverse to get chronological order (oldest → newest) for LLM context
     messages.reverse()
     return messages
@@ -137,6 +239,40 @@ async def get_conversation_summary(
     return result.scalar_one_or_none()
 
 
+async def get_conversation_summary_text(
+    db: AsyncSession,
+    user_id: UUID,
+    conversation_id: UUID,
+) -> Optional[str]:
+    """
+    Get the conversation summary text, from the in-process cache when fresh.
+    
+    A miss reads only the summary column; the result (including "no summary")
+    is cached for _SUMMARY_CACHE_TTL_SECONDS.
+    
+    Args:
+        db: Database session (not used on a cache hit)
+        user_id: User ID
+        conversation_id: Conversation ID
+        
+    Returns:
+        Summary text if a summary exists, None otherwise
+    """
+    cached = _summary_cache.get((user_id, conversation_id))
+    if cached is not None and time.monotonic() < cached[1]:
+        return cached[0]
+    
+    result = await db.execute(
+        select(ChatConversationSummary.summary).where(
+            ChatConversationSummary.user_id == user_id,
+            ChatConversationSummary.conversation_id == conversation_id,
+        )
+    )
+    summary = result.scalar_one_or_none()
+    _cache_summary(user_id, conversation_id, summary)
+    return summary
+
+
 async def update_conversation_summary(
     db: AsyncSession,
     user_id: UUID,
@@ -156,22 +292,26 @@ async def update_conversation_summary(
         ChatConversationSummary object
     """
     existing = await get_conversation_summary(db, user_id, conversation_id)
+    # updated_at is set here rather than by the column defaults, so the object
+    # is complete after the commit without a SELECT
+    updated_at = datetime.now(timezone.utc)
     
     if existing:
         existing.summary = summary
-        # updated_at is handled by onupdate in the model
+        existing.updated_at = updated_at
         await db.commit()
-        await db.refresh(existing)
+        _cache_summary(user_id, conversation_id, summary)
         return existing
     else:
         db_summary = ChatConversationSummary(
             conversation_id=conversation_id,
             user_id=user_id,
             summary=summary,
+            updated_at=updated_at,
         )
         db.add(db_summary)
         await db.commit()
-        await db.refresh(db_summary)
+        _cache_summary(user_id, conversation_id, summary)
         return db_summary
 
 
@@ -199,15 +339,25 @@ async def maybe_update_conversation_summary(
     if max_messages is None:
         max_messages = AI_MAX_CONTEXT_MESSAGES
     
+    # Known to be under the threshold: no COUNT needed
+    cached_count = _conv_message_count.get((user_id, conversation_id))
+    if cached_count is not None and cached_count <= max_messages:
+        return
+    
     # Count total messages for this conversation
-    count_result = await db.execute(
-        select(func.count(ChatMessage.id))
-        .where(
-            ChatMessage.user_id == user_id,
-            ChatMessage.conversation_id == conversation_id,
+    try:
+        count_result = await db.execute(
+            select(func.count(ChatMessage.id))
+            .where(
+                ChatMessage.user_id == user_id,
+                ChatMessage.conversation_id == conversation_id,
+            )
         )
-    )
+    except Exception:
+        _conv_message_count.pop((user_id, conversation_id), None)
+        raise
     total_count = count_result.scalar() or 0
+    _record_message_count(user_id, conversation_id, total_count)
     
     # If count <= max_messages, no summarization needed
     if total_count <= max_messages:
@@ -216,7 +366,7 @@ async def maybe_update_conversation_summary(
     # Fetch older messages to summarize (everything except the last max_messages)
     # Exclude system messages and large tool_result payloads
     older_messages_result = await db.execute(
-        select(ChatMessage)
+        select(ChatMessage.role, ChatMessage.content)
         .where(
             ChatMessage.user_id == user_id,
             ChatMessage.conversation_id == conversation_id,
@@ -226,28 +376,17 @@ async def maybe_update_conversation_summary(
         .order_by(ChatMessage.created_at.asc())
         .limit(total_count - max_messages)
     )
-    older_messages = list(older_messages_result.scalars().all())
+    older_messages = older_messages_result.all()
     
     if not older_messages:
         return
     
-    # Build messages for summarization
-    messages_to_summarize = []
-    for msg in older_messages:
-        # Truncate very long messages
-        content = msg.content
-        if len(content) > 500:
-            content = content[:500] + "..."
-        messages_to_summarize.append({
-            "role": msg.role,
-            "content": content,
-        })
-    
-    # Build summarization prompt
-    conversation_text = "\n".join([
-        f"{msg['role']}: {msg['content']}"
-        for msg in messages_to_summarize
-    ])
+    # Build the conversation text in one pass ("role: content" lines, very long
+    # messages truncated)
+    conversation_text = "\n".join(
+        f"{role}: {content[:500]}..." if len(content) > 500 else f"{role}: {content}"
+        for role, content in older_messages
+    )
     
     summarization_messages = [
         {
@@ -264,7 +403,7 @@ async def maybe_update_conversation_summary(
     api_key = get_api_key(user_id)
     if not api_key:
         # Cannot summarize without API key, skip
-        print(f"[WARNING] Cannot summarize conversation {conversation_id}: no API key")
+        logger.warning("Cannot summarize conversation %s: no API key", conversation_id)
         return
     
     try:
@@ -280,9 +419,61 @@ async def maybe_update_conversation_summary(
         if summary_text:
             # Update conversation summary
             await update_conversation_summary(db, user_id, conversation_id, summary_text)
-            print(f"[DEBUG] Updated conversation summary for {conversation_id}")
+            logger.debug("Updated conversation summary for %s", conversation_id)
     except Exception as e:
         # Log error but don't fail the request
-        print(f"[ERROR] Failed to summarize conversation {conversation_id}: {type(e).__name__}: {e}")
-        import traceback
-        print(f"[ERROR] Traceback:\n{traceback.format_exc()}")
+        logger.exception("Failed to summarize conversation %s: %s: %s", conversation_id, type(e).__name__, e)
+
+
+# (user_id, conversation_id) pairs with a background summarization running (one
+# at a time each),
+# and strong references to the tasks so they are not garbage collected mid-run
+_summaries_in_flight: Set[Tuple[UUID, UUID]] = set()
+_summary_tasks: Set["asyncio.Task[None]"] = set()
+
+
+async def _run_conversation_summary(
+    bind: AsyncEngine,
+    user_id: UUID,
+    conversation_id: UUID,
+) -> None:
+    """Run maybe_update_conversation_summary on its own session, logging failures."""
+    try:
+        async with AsyncSession(bind=bind, expire_on_commit=False) as session:
+            await maybe_update_conversation_summary(session, user_id, conversation_id)
+    except Exception as e:
+        _conv_message_count.pop((user_id, conversation_id), None)
+        logger.exception("Background summarization failed for %s: %s: %s", conversation_id, type(e).__name__, e)
+    finally:
+        _summaries_in_flight.discard((user_id, conversation_id))
+
+
+def schedule_conversation_summary(
+    bind: AsyncEngine,
+    user_id: UUID,
+    conversation_id: UUID,
+) -> bool:
+    """
+    Start maybe_update_conversation_summary in the background.
+    
+    The summarization LLM call can take seconds, so the request returns without
+    waiting for it. The request session closes when the handler returns, so the
+    task opens its own session on the same engine. A conversation that already
+    has a summarization running is skipped.
+    
+    Args:
+        bind: Engine (or connection) of the request session
+        user_id: User ID
+        conversation_id: Conversation ID
+        
+    Returns:
+        True if a task was started, False if one was already running
+    """
+    key = (user_id, conversation_id)
+    if key in _summaries_in_flight:
+        return False
+    _summaries_in_flight.add(key)
+    task = asyncio.create_task(_run_conversation_summary(bind, user_id, conversation_id))
+    _summary_tasks.add(task)
+    task.add_done_callback(_summary_tasks.discard)
+    return True
@@ -1,9 +1,10 @@
 """
 Chat routes for Zefa Finance AI agent.
 """
+import asyncio
 import logging
-from typing import List
-from uuid import UUID
+from typing import List, Optional
+from uuid import UUID, uuid4
 
 from fastapi import APIRouter, Depends, HTTPException, Request, status
 
@@ -11,11 +12,12 @@ logger = logging.getLogger("zefa.chat")
 
 from app.rate_limit import limiter
 from pydantic import BaseModel, Field, field_validator
+from sqlalchemy import inspect
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.auth_utils import get_current_user
 from app.database import get_db
-from app.models import User
+from app.models import ChatMessage as ChatMessageModel, User
 from app.chat import crud as chat_crud
 from app.chat.schemas import ChatMessageCreate, ChatMessageResponse, ChatMessage, ChatAssistantMeta
 from app.ai import gateway
@@ -42,6 +44,49 @@ class ApiKeyRequest(BaseModel):
 router = APIRouter(prefix="/chat", tags=["chat"])
 
 
+async def _persist_user_message(db: AsyncSession, user_message: ChatMessageModel) -> None:
+    """
+    Commit a turn's staged user message when no assistant reply is persisted
+    (the request fails with a 502), so the user's text is not lost.
+
+    A tool handler that failed mid-turn can leave the session unusable; the
+    commit is then retried after a rollback. A message a tool handler already
+    committed is left as is. Failures are logged, never raised.
+    """
+    try:
+        await chat_crud.commit_chat_messages(db, [user_message])
+        return
+    except Exception as e:
+        logger.warning("Retrying user message commit after %s: %s", type(e).__name__, e)
+    try:
+        await db.rollback()
+        # Rollback expunges pending objects; one already committed stays persistent
+        if inspect(user_message).transient:
+            db.add(user_message)
+            await chat_crud.commit_chat_messages(db, [user_message])
+    except Exception as e:
+        logger.exception("Failed to persist user message: %s: %s", type(e).__name__, e)
+
+
+async def _load_conversation_summary(
+    db: AsyncSession,
+    user_id: UUID,
+    conversation_id: UUID,
+) -> Optional[str]:
+    """
+    Read the conversation summary text on a sibling session, so it can overlap
+    with other reads on the request session (an AsyncSession cannot run two
+    statements at once). A session only connects on its first statement, so a
+    summary cache hit uses no connection.
+    """
+    async with AsyncSession(bind=db.bind) as session:
+        return await chat_crud.get_conversation_summary_text(
+            db=session,
+            user_id=user_id,
+            conversation_id=conversation_id,
+        )
+
+
 @router.post("/messages", response_model=ChatMessageResponse, status_code=status.HTTP_201_CREATED)
 @limiter.limit("30/minute")
 async def create_chat_message(
@@ -71,78 +116,49 @@ async def create_chat_message(
         )
     
     user_id = current_user.id
-    conversation_id = payload.conversation_id
+    # Generate conversation_id if not provided
+    conversation_id = payload.conversation_id or uuid4()
     
-    # Persist user message
-    user_message = await chat_crud.create_chat_message(
-        db=db,
-        user_id=user_id,
-        payload=payload,
+    # Stage the user message; it is committed together with the assistant reply,
+    # or on its own if the reply fails. Tool handlers commit this session too,
+    # so on turns that write transactions the user message is committed then,
+    # ahead of the reply. The session does not autoflush, so the reads below do
+    # not see it.
+    user_message = chat_crud.stage_chat_message(
+        db,
+        user_id,
+        conversation_id,
         role="user",
         content=payload.text,
-        conversation_id=conversation_id,
-    )
-    
-    # Update conversation_id if it was None
-    if conversation_id is None:
-        conversation_id = user_message.conversation_id
-    
-    # Get recent messages for context
-    recent_messages_list = await chat_crud.list_recent_messages(
-        db=db,
-        user_id=user_id,
-        conversation_id=conversation_id,
-        limit=AI_MAX_CONTEXT_MESSAGES,
+        content_type=payload.content_type,
     )
     
-    # Convert to format expected by gateway, excluding the just-persisted user message
-    # to avoid duplication (gateway will add it separately)
-    recent_messages = []
-    for msg in recent_messages_list:
-        # Skip the user message we just persisted (it will be added by gateway)
-        if msg.id == user_message.id:
-            continue
-        recent_messages.append({
-            "role": msg.role,
-            "content": msg.content,
-        })
+    # Recent messages and the summary are independent reads: the summary is read
+    # on a sibling session so both queries are in flight at once. A new
+    # conversation has neither.
+    if payload.conversation_id is None:
+        recent_messages_list, conversation_summary = [], None
+    else:
+        recent_messages_list, conversation_summary = await asyncio.gather(
+            chat_crud.list_recent_messages(
+                db=db,
+                user_id=user_id,
+                conversation_id=conversation_id,
+                # The new user message (added by the gateway) takes one slot
+                limit=AI_MAX_CONTEXT_MESSAGES - 1,
+            ),
+            _load_conversation_summary(db, user_id, conversation_id),
+        )
     
-    # Get conversation summary if exists
-    summary_obj = await chat_crud.get_conversation_summary(
-        db=db,
-        user_id=user_id,
-        conversation_id=conversation_id,
-    )
-    conversation_summary = summary_obj.summary if summary_obj else None
+    # Convert to format expected by gateway (the staged user message is not in
+    # the results; the gateway adds it separately)
+    recent_messages = [
+        {"role": role, "content": content}
+        for _, role, content in recent_messages_list
+    ]
     
     # Determine if we should include context pack (heuristic: finance-related intents)
-    # Use the same keyword list as should_attach_tools() for consistency
-    # For heuristic mode: include context pack more liberally to enable insights,
-    # but tools will only be attached for explicit finance actions
-    user_text_lower = payload.text.lower()
-    finance_keywords = [
-        # Query
-        "saldo", "gasto", "gastei", "receita", "despesa", "extrato",
-        "fim do mês", "sobrou", "quanto", "transação", "transacao",
-        "balance", "transaction", "spending",
-        # Create/Add
-        "criar", "registrar", "adicionar", "create", "add", "register",
-        # Edit/Update
-        "alterar", "altera", "mudar", "muda", "editar", "edita", "atualizar", "atualiza",
-        "update", "edit", "change", "modify", "modificar",
-        # Delete/Remove
-        "deletar", "deleta", "remover", "remove", "excluir", "exclui", "apagar", "apaga",
-        "delete", "remove", "exclude",
-        # Analysis
-        "análise", "analise", "insight", "resumo", "total", "soma", "média",
-        # General finance
-        "dinheiro", "valor", "preço", "custo", "pagamento",
-        "como estou", "como vai", "situação", "situacao", "status",
-        "financeiro", "finanças", "financas", "grana", "reais",
-        # List/Show
-        "listar", "list", "mostrar", "show", "ver", "ver todas",
-    ]
-    include_context_pack = any(keyword in user_text_lower for keyword in finance_keywords)
+    include_context_pack = gateway.should_include_context_pack(payload.text)
     
     # Process through AI gateway
     try:
@@ -169,24 +185,19 @@ async def create_chat_message(
                 ),
                 "tool_calls": [],
                 "needs_api_key": True,
-                "metadata": ChatAssistantMeta().model_dump(),
+                "metadata": ChatAssistantMeta(),
             }
         else:
             # For all other AI-related validation errors, avoid leaking internal details
+            await _persist_user_message(db, user_message)
             raise HTTPException(
                 status_code=status.HTTP_502_BAD_GATEWAY,
                 detail="AI service is temporarily unavailable. Please try again later.",
             )
     except Exception as e:
-        # Log error details for debugging
-        import traceback
-        error_traceback = traceback.format_exc()
-        logger.error(
-            "Chat message processing failed: %s: %s\n%s",
-            type(e).__name__,
-            e,
-            error_traceback,
-        )
+        # Log error details for debugging (traceback formatted by the handler)
+        logger.exception("Chat message processing failed: %s: %s", type(e).__name__, e)
+        await _persist_user_message(db, user_message)
         
         # Return safe message to user but log the actual error
         raise HTTPException(
@@ -194,38 +205,29 @@ async def create_chat_message(
             detail="Erro ao processar mensagem. Por favor, tente novamente.",
         )
     
-    # Extract metadata from response
-    metadata_dict = assistant_response.get("metadata", {})
-    if not metadata_dict:
-        metadata_dict = ChatAssistantMeta().model_dump()
+    # Extract metadata from response (the gateway returns the model itself, so it
+    # is serialized once by the response model instead of dumped and re-validated)
+    meta = assistant_response.get("metadata")
+    if not isinstance(meta, ChatAssistantMeta):
+        meta = ChatAssistantMeta(**(meta or {}))
     
-    # Persist assistant message
+    # Persist the assistant message, and the user message unless a tool handler
+    # already committed it
     try:
         logger.debug("Persisting assistant message")
-        assistant_message = await chat_crud.create_chat_message(
-            db=db,
-            user_id=user_id,
-            payload=ChatMessageCreate(
-                conversation_id=conversation_id,
-                text=assistant_response.get("content", ""),
-                content_type="text",
-            ),
+        assistant_message = chat_crud.stage_chat_message(
+            db,
+            user_id,
+            conversation_id,
             role="assistant",
             content=assistant_response.get("content", ""),
-            conversation_id=conversation_id,
         )
+        await chat_crud.commit_chat_messages(db, [user_message, assistant_message])
         logger.debug("Assistant message persisted: %s", assistant_message.id)
         
-        # Trigger summarization check if needed (async, non-blocking)
-        try:
-            await chat_crud.maybe_update_conversation_summary(
-                db=db,
-                user_id=user_id,
-                conversation_id=conversation_id,
-            )
-        except Exception as e:
-            # Log but don't fail the request if summarization fails
-            logger.warning("Summarization check failed: %s: %s", type(e).__name__, e)
+        # Summarization check runs in the background (own session; failures are
+        # logged there and never fail the request)
+        chat_crud.schedule_conversation_summary(db.bind, user_id, conversation_id)
     except Exception as e:
         logger.exception("Failed to persist assistant message: %s: %s", type(e).__name__, e)
         raise
@@ -240,9 +242,6 @@ async def create_chat_message(
         created_at=assistant_message.created_at,
     )
     
-    # Build metadata (convert dict back to Pydantic model for validation)
-    meta = ChatAssistantMeta(**metadata_dict)
-    
     return ChatMessageResponse(
         message=message_response,
         meta=meta,
@@ -7,6 +7,8 @@ from uuid import UUID
 
 from pydantic import BaseModel, ConfigDict, Field
 
+from app.schemas import TransactionCreate, TransactionUpdate
+
 
 # Chat Schemas
 class ChatMessageCreate(BaseModel):
@@ -74,13 +76,14 @@ class ListTransactionsInput(BaseModel):
     to_date: Optional[datetime] = None
 
 
-class CreateTransactionInput(BaseModel):
-    """Input schema for create_transaction tool."""
-    amount: float = Field(gt=0)
+class CreateTransactionInput(TransactionCreate):
+    """
+    Input schema for create_transaction tool.
+    
+    A TransactionCreate, so the validated input is handed to
+    create_user_transaction as is.
+    """
     type: Literal["INCOME", "EXPENSE"]
-    category: str
-    description: Optional[str] = None
-    occurred_at: Optional[datetime] = None
 
 
 class AnalyzeSpendingInput(BaseModel):
@@ -91,14 +94,15 @@ class AnalyzeSpendingInput(BaseModel):
     top_n: Optional[int] = Field(default=None, ge=1, le=50)
 
 
-class UpdateTransactionInput(BaseModel):
-    """Input schema for update_transaction tool."""
+class UpdateTransactionInput(TransactionUpdate):
+    """
+    Input schema for update_transaction tool.
+    
+    TransactionUpdate fields plus the target id, so the provided fields are
+    applied without a second validation.
+    """
     transaction_id: UUID
-    amount: Optional[float] = Field(default=None, gt=0)
     type: Optional[Literal["INCOME", "EXPENSE"]] = None
-    category: Optional[str] = None
-    description: Optional[str] = None
-    occurred_at: Optional[datetime] = None
 
 
 class DeleteTransactionInput(BaseModel):
@@ -1,14 +1,14 @@
 """
 CRUD operations and business logic for User, Transaction, and Dashboard.
 """
-from datetime import datetime
+from datetime import datetime, timezone
 from decimal import Decimal
-from typing import Optional
-from uuid import UUID
+from typing import Any, Optional, Tuple
+from uuid import UUID, uuid4
 import os
 
 from fastapi import HTTPException, status
-from sqlalchemy import delete, select
+from sqlalchemy import delete, func, insert, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.models import RefreshToken, Transaction, User
@@ -20,7 +20,7 @@ from app.schemas import (
     UserCreate,
     UserProfileUpdate,
 )
-from app.auth_utils import get_password_hash, hash_refresh_token, verify_password
+from app.auth_utils import get_password_hash, hash_refresh_token, invalidate_cached_user, verify_password
 
 
 def get_default_monthly_budget() -> Decimal:
@@ -63,15 +63,17 @@ async def create_user(db: AsyncSession, user_in: UserCreate) -> User:
     
     # Create new user
     hashed_password = get_password_hash(user_in.password)
+    # id and created_at are assigned here so no SELECT is needed after the commit
     db_user = User(
+        id=uuid4(),
         email=user_in.email,
         hashed_password=hashed_password,
         full_name=user_in.full_name.strip() if user_in.full_name else None,
         monthly_budget=get_default_monthly_budget(),
+        created_at=datetime.now(timezone.utc),
     )
     db.add(db_user)
     await db.commit()
-    await db.refresh(db_user)
     return db_user
 
 
@@ -135,13 +137,14 @@ async def create_persistent_refresh_token(
     del ip_address  # Reserved for future auditing improvements
 
     token = RefreshToken(
+        id=uuid4(),
         user_id=user_id,
         token_hash=hash_refresh_token(raw_token),
+        created_at=datetime.now(timezone.utc),
         expires_at=expires_at,
     )
     db.add(token)
     await db.commit()
-    await db.refresh(token)
     return token
 
 
@@ -197,21 +200,47 @@ async def revoke_refresh_token_by_raw(
         db: Database session
         raw_token: Plain text refresh token
     """
-    token_hash = hash_refresh_token(raw_token)
-    now = datetime.utcnow()
+    # The hash is matched in the database (never compared in Python), and one
+    # UPDATE replaces a SELECT followed by a flush of the loaded row
     result = await db.execute(
-        select(RefreshToken).where(
-            (RefreshToken.token_hash == token_hash)
+        update(RefreshToken)
+        .where(
+            (RefreshToken.token_hash == hash_refresh_token(raw_token))
             & (RefreshToken.revoked_at.is_(None))
         )
+        .values(revoked_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
     )
-    token = result.scalar_one_or_none()
-    if token:
-        token.revoked_at = now
+    if result.rowcount:
         await db.commit()
 
 
 # Transaction CRUD
+
+# Per-user transaction write counters (in-process). Readers that cache derived
+# data (e.g. the AI finance context pack) include the version in their cache key
+# so any write invalidates them immediately.
+_transaction_versions: dict[UUID, int] = {}
+
+
+def get_transaction_version(user_id: UUID) -> int:
+    """
+    Get the current transaction write version for a user.
+    
+    Args:
+        user_id: ID of the user
+        
+    Returns:
+        Counter incremented on every transaction create/update/delete
+    """
+    return _transaction_versions.get(user_id, 0)
+
+
+def _bump_transaction_version(user_id: UUID) -> None:
+    """Record a transaction write for a user, invalidating derived caches."""
+    _transaction_versions[user_id] = _transaction_versions.get(user_id, 0) + 1
+
+
 async def create_user_transaction(
     db: AsyncSession,
     tx_in: TransactionCreate,
@@ -241,17 +270,23 @@ async def create_user_transaction(
     # Use occurred_at if provided, otherwise use current time
     occurred_at = tx_in.occurred_at if tx_in.occurred_at else datetime.utcnow()
     
-    db_transaction = Transaction(
-        user_id=user_id,
-        amount=tx_in.amount,
-        type=tx_in.type,
-        category=tx_in.category,
-        description=tx_in.description,
-        occurred_at=occurred_at,
+    # INSERT ... RETURNING: the row comes back as stored (amount rounded to the
+    # column scale, server created_at) in the same round-trip, no refresh needed
+    result = await db.execute(
+        insert(Transaction)
+        .values(
+            user_id=user_id,
+            amount=tx_in.amount,
+            type=tx_in.type,
+            category=tx_in.category,
+            description=tx_in.description,
+            occurred_at=occurred_at,
+        )
+        .returning(Transaction)
     )
-    db.add(db_transaction)
+    db_transaction = result.scalar_one()
     await db.commit()
-    await db.refresh(db_transaction)
+    _bump_transaction_version(user_id)
     return db_transaction
 
 
@@ -325,13 +360,39 @@ async def update_user_transaction(
     Raises:
         HTTPException: If validation fails (amount <= 0, etc.)
     """
+    return await update_user_transaction_fields(
+        db, transaction_id, user_id, tx_update.model_dump(exclude_unset=True)
+    )
+
+
+async def update_user_transaction_fields(
+    db: AsyncSession,
+    transaction_id: UUID,
+    user_id: UUID,
+    update_data: dict[str, Any],
+) -> Optional[Transaction]:
+    """
+    Apply already-validated field values to a transaction if it belongs to the user.
+    
+    Args:
+        db: Database session
+        transaction_id: ID of the transaction to update
+        user_id: ID of the user (for ownership verification)
+        update_data: Field name -> new value (validated by TransactionUpdate);
+            None values are skipped
+        
+    Returns:
+        Updated Transaction object if found and updated, None if not found
+        
+    Raises:
+        HTTPException: If amount is not positive
+    """
     # Fetch the transaction
     transaction = await get_user_transaction(db, transaction_id, user_id)
     if not transaction:
         return None
     
     # Check if at least one field is provided
-    update_data = tx_update.model_dump(exclude_unset=True)
     if not update_data:
         # No-op: return current transaction
         return transaction
@@ -350,6 +411,7 @@ async def update_user_transaction(
             setattr(transaction, field, value)
     
     await db.commit()
+    _bump_transaction_version(user_id)
     await db.refresh(transaction)
     return transaction
 
@@ -382,7 +444,42 @@ async def delete_user_transaction(
     await db.commit()
     
     # Return True if a row was deleted, False otherwise
-    return result.rowcount > 0
+    deleted = result.rowcount > 0
+    if deleted:
+        _bump_transaction_version(user_id)
+    return deleted
+
+
+async def delete_user_transaction_returning(
+    db: AsyncSession,
+    transaction_id: UUID,
+    user_id: UUID,
+) -> Optional[Tuple[Decimal, str]]:
+    """
+    Delete a transaction if it belongs to the user, returning what was deleted.
+    
+    A single DELETE ... RETURNING round-trip replaces a lookup followed by a delete.
+    
+    Args:
+        db: Database session
+        transaction_id: ID of the transaction to delete
+        user_id: ID of the user (for ownership verification)
+        
+    Returns:
+        (amount, category) of the deleted transaction, or None if not found
+    """
+    result = await db.execute(
+        delete(Transaction)
+        .where((Transaction.id == transaction_id) & (Transaction.user_id == user_id))
+        .returning(Transaction.amount, Transaction.category)
+    )
+    row = result.one_or_none()
+    await db.commit()
+    
+    if row is None:
+        return None
+    _bump_transaction_version(user_id)
+    return row.amount, row.category
 
 
 # Dashboard CRUD
@@ -400,36 +497,29 @@ async def get_dashboard_summary(
     Returns:
         DashboardSummary with totals and category metrics
     """
-    # Get all transactions for the user
+    # Summed in the database: one row per (type, category) instead of one per
+    # transaction, largest first so expense rows arrive in by_category order
+    category_total = func.sum(Transaction.amount)
     result = await db.execute(
-        select(Transaction).where(Transaction.user_id == user_id)
+        select(Transaction.type, Transaction.category, category_total)
+        .where(Transaction.user_id == user_id)
+        .group_by(Transaction.type, Transaction.category)
+        .order_by(category_total.desc(), Transaction.category)
     )
-    transactions = list(result.scalars().all())
     
-    # Calculate totals
+    # Category totals are for expenses only, as per common dashboard pattern
     total_income = Decimal("0.00")
     total_expense = Decimal("0.00")
-    category_totals: dict[str, Decimal] = {}
-    
-    for tx in transactions:
-        amount = Decimal(str(tx.amount))
-        if tx.type == "INCOME":
-            total_income += amount
+    by_category: list[CategoryMetric] = []
+    for tx_type, category, total in result:
+        if tx_type == "INCOME":
+            total_income += total
         else:  # EXPENSE
-            total_expense += amount
-        
-        # Aggregate by category (for expenses only, as per common dashboard pattern)
-        if tx.type == "EXPENSE":
-            category_totals[tx.category] = category_totals.get(tx.category, Decimal("0.00")) + amount
+            total_expense += total
+            by_category.append(CategoryMetric(name=category, value=total))
     
     total_balance = total_income - total_expense
     
-    # Build category metrics list
-    by_category = [
-        CategoryMetric(name=category, value=value)
-        for category, value in sorted(category_totals.items(), key=lambda x: x[1], reverse=True)
-    ]
-    
     return DashboardSummary(
         total_balance=total_balance,
         total_income=total_income,
@@ -506,5 +596,6 @@ async def update_user_profile(
         user.monthly_budget = update_data["monthly_budget"]
 
     await db.commit()
+    invalidate_cached_user(user_id)
     await db.refresh(user)
     return user
@@ -5,7 +5,7 @@ import asyncio
 import json
 import logging
 import os
-import traceback
+import signal
 from contextlib import asynccontextmanager
 from decimal import Decimal
 
@@ -13,18 +13,44 @@ from fastapi import FastAPI, Request, status
 from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
+from sqlalchemy import Connection, text
+
+try:
+    import orjson  # noqa: F401 - required by ORJSONResponse
+    from fastapi.responses import ORJSONResponse
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
 
 from app.database import Base, engine
 from app.rate_limit import limiter, RATE_LIMIT_AVAILABLE
 from app.routers import auth, dashboard, transactions, user
 from app.chat import routes as chat_routes
+from app.ai.gateway import close_provider_clients, reload_env_api_keys, run_api_key_sweeper
 from app.auth_utils import _validate_secret_key
 
 
+# Indexes replaced under a new name (idx_transactions_user_occurred became
+# idx_transactions_user_occurred_covering)
+_SUPERSEDED_INDEXES = ("idx_transactions_user_occurred",)
+
+
+def _create_schema(connection: Connection) -> None:
+    """Create missing tables and indexes, and drop superseded indexes."""
+    Base.metadata.create_all(connection)
+    # create_all skips every index of a table that already exists, so indexes
+    # added since the table was created are created here (checked by name)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+    for name in _SUPERSEDED_INDEXES:
+        connection.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+
 async def _ensure_tables() -> None:
     """Create tables if not exist (MVP approach - use Alembic in production)."""
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_create_schema)
 
 
 @asynccontextmanager
@@ -36,10 +62,21 @@ async def lifespan(app: FastAPI):
     _validate_secret_key()
     # Run table creation in background so we don't block binding to PORT (Cloud Run timeout)
     asyncio.create_task(_ensure_tables())
+    api_key_sweeper = asyncio.create_task(run_api_key_sweeper())
+    # Provider API keys are snapshotted at import; SIGHUP re-reads them after rotation
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, reload_env_api_keys)
+    except (AttributeError, NotImplementedError, RuntimeError):
+        pass  # No SIGHUP / signal handlers on this platform or thread
     yield
+    api_key_sweeper.cancel()
+    await close_provider_clients()
     await engine.dispose()
 
 
+# App loggers ("zefa.*") log at LOG_LEVEL; DEBUG traces are skipped by default
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
+
 # Configure logger for error handling
 logger = logging.getLogger("zefa.api")
 
@@ -50,6 +87,8 @@ app = FastAPI(
     description="API do Zefa Finance (MVP). Utiliza autenticação via JWT (OAuth2 Password Bearer).",
     version="0.2.0",
     lifespan=lifespan,
+    # Route responses are rendered by orjson (C encoder) when it is installed
+    default_response_class=ORJSONResponse if ORJSON_AVAILABLE else JSONResponse,
 )
 if RATE_LIMIT_AVAILABLE:
     from slowapi import _rate_limit_exceeded_handler
@@ -100,10 +139,10 @@ async def unhandled_exception_handler(request: Request, exc: Exception) -> JSONR
     Logs full traceback server-side and returns a safe generic message to the client.
     """
     logger.error(
-        "Unhandled exception while processing request %s %s: %s",
+        "Unhandled exception while processing request %s %s",
         request.method,
         request.url.path,
-        "".join(traceback.format_exception(type(exc), exc, exc.__traceback__)),
+        exc_info=exc,
     )
     return _safe_500_response()
 
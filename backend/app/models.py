@@ -13,6 +13,7 @@ from sqlalchemy import (
     String,
     Text,
     func,
+    text,
 )
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
@@ -75,9 +76,35 @@ class Transaction(Base):
     # Relationships
     user = relationship("User", back_populates="transactions")
 
-    # Index for optimized dashboard queries
+    # Index for optimized dashboard queries. On Postgres it covers the columns
+    # read by the per-user recent/month queries so they can be index-only scans.
+    # Renamed when it became covering, so existing databases get the new
+    # definition (see _ensure_tables in app.main).
     __table_args__ = (
-        Index("idx_transactions_user_occurred", "user_id", "occurred_at"),
+        Index(
+            "idx_transactions_user_occurred_covering",
+            "user_id",
+            occurred_at.desc(),
+            postgresql_include=["type", "amount", "category", "description"],
+        ),
+        # Partial index for the expense-only analyze_spending aggregate: on
+        # Postgres it holds only EXPENSE rows and covers the grouped columns.
+        Index(
+            "idx_transactions_user_expense_occurred",
+            "user_id",
+            occurred_at.desc(),
+            postgresql_include=["amount", "category"],
+            postgresql_where=text("type = 'EXPENSE'"),
+        ),
+        # Backs the dashboard GROUP BY type, category aggregate (amount covered
+        # on Postgres, so the totals come from an index-only scan).
+        Index(
+            "idx_transactions_user_type_category",
+            "user_id",
+            "type",
+            "category",
+            postgresql_include=["amount"],
+        ),
     )
 
     def __repr__(self) -> str:
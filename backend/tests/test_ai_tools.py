@@ -0,0 +1,219 @@
+"""
+Tests for AI tool execution helpers.
+"""
+import hashlib
+import json
+from datetime import datetime
+from decimal import Decimal
+from uuid import uuid4
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import crud
+from app.ai.tools import (
+    TOOLS,
+    TOOLS_DIGEST,
+    TOOLS_JSON_BYTES,
+    execute_tool,
+    execute_tools_parallel,
+    tool_calls_parallel_safe,
+)
+from app.models import User
+from app.schemas import TransactionCreate
+
+
+async def _create_user(db: AsyncSession) -> User:
+    """Persist a bare user for tool tests."""
+    user = User(email=f"tools-{uuid4().hex[:8]}@example.com", hashed_password="x")
+    db.add(user)
+    await db.commit()
+    return user
+
+
+@pytest.mark.asyncio
+async def test_execute_tools_parallel_keeps_call_order(db_session: AsyncSession) -> None:
+    """Mixed read/write batches return one result per call, in model-emitted order."""
+    # Arrange
+    user = await _create_user(db_session)
+    await crud.create_user_transaction(
+        db_session,
+        TransactionCreate(amount=Decimal("100.00"), type="INCOME", category="Salary"),
+        user.id,
+    )
+
+    # Act
+    results = await execute_tools_parallel(db_session, user.id, [
+        ("get_balance", {}),
+        ("create_transaction", {"amount": 20.0, "type": "EXPENSE", "category": "Food"}),
+        ("delete_transaction", {"transaction_id": str(uuid4())}),
+        ("list_transactions", {"limit": 5}),
+    ])
+
+    # Assert
+    assert len(results) == 4
+    assert results[0]["total_income"] == 100.0
+    assert results[1]["category"] == "Food"
+    assert isinstance(results[2], ValueError)
+    assert "transactions" in results[3]
+
+
+@pytest.mark.asyncio
+async def test_execute_tools_parallel_unknown_tool(db_session: AsyncSession) -> None:
+    """A failing call is returned as its exception without affecting the others."""
+    user = await _create_user(db_session)
+
+    results = await execute_tools_parallel(db_session, user.id, [
+        ("get_balance", {}),
+        ("no_such_tool", {}),
+    ])
+
+    assert results[0]["total_balance"] == 0.0
+    assert isinstance(results[1], ValueError)
+
+
+@pytest.mark.asyncio
+async def test_execute_tools_parallel_propagates_cancellation(
+    db_session: AsyncSession, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """A cancelled read is re-raised, not returned as a tool result."""
+    import asyncio
+
+    from app.ai import tools
+
+    async def cancelled_read(db, user_id, tool_name, tool_args):
+        if tool_name == "get_balance":
+            raise asyncio.CancelledError()
+        return {"transactions": []}
+
+    monkeypatch.setattr(tools, "execute_read_tool_isolated", cancelled_read)
+
+    with pytest.raises(asyncio.CancelledError):
+        await execute_tools_parallel(db_session, uuid4(), [
+            ("get_balance", {}),
+            ("list_transactions", {}),
+        ])
+
+
+def test_tool_calls_parallel_safe() -> None:
+    """Only batches without mutating tools are flagged as parallel safe."""
+    assert tool_calls_parallel_safe(["get_balance", "list_transactions", "analyze_spending"])
+    assert not tool_calls_parallel_safe(["list_transactions", "update_transaction"])
+
+
+@pytest.mark.asyncio
+async def test_execute_tool_invalid_arguments(db_session: AsyncSession) -> None:
+    """Schema violations are reported as ValueError naming the tool and field."""
+    user = await _create_user(db_session)
+
+    with pytest.raises(ValueError, match=r"Invalid arguments for list_transactions: limit"):
+        await execute_tool(db_session, user.id, "list_transactions", {"limit": 0})
+
+
+@pytest.mark.asyncio
+async def test_analyze_spending_groups_in_sql(db_session: AsyncSession) -> None:
+    """Groups are summed and ranked in SQL; the total still covers groups cut by top_n."""
+    # Arrange
+    user = await _create_user(db_session)
+    for amount, tx_type, category, occurred_at in [
+        ("30.00", "EXPENSE", "Food", datetime(2026, 3, 1, 10)),
+        ("20.00", "EXPENSE", "Food", datetime(2026, 3, 2, 10)),
+        ("40.00", "EXPENSE", "Transport", datetime(2026, 3, 2, 18)),
+        ("10.00", "EXPENSE", "Bills", datetime(2026, 2, 27, 9)),
+        ("999.00", "INCOME", "Salary", datetime(2026, 3, 1, 9)),
+    ]:
+        await crud.create_user_transaction(
+            db_session,
+            TransactionCreate(amount=Decimal(amount), type=tx_type, category=category, occurred_at=occurred_at),
+            user.id,
+        )
+
+    # Act
+    by_category = await execute_tool(db_session, user.id, "analyze_spending", {"top_n": 2})
+    by_day = await execute_tool(db_session, user.id, "analyze_spending", {"group_by": "day"})
+    by_month = await execute_tool(db_session, user.id, "analyze_spending", {"group_by": "month"})
+
+    # Assert
+    assert by_category["results"] == [{"group": "Food", "total": 50.0}, {"group": "Transport", "total": 40.0}]
+    assert by_category["total"] == 100.0
+    assert by_day["results"] == [
+        {"group": "2026-03-02", "total": 60.0},
+        {"group": "2026-03-01", "total": 30.0},
+        {"group": "2026-02-27", "total": 10.0},
+    ]
+    assert by_month["results"] == [{"group": "2026-03", "total": 90.0}, {"group": "2026-02", "total": 10.0}]
+
+
+@pytest.mark.asyncio
+async def test_list_transactions_date_filters(db_session: AsyncSession) -> None:
+    """Prebuilt list statements bind each filter combination correctly."""
+    # Arrange
+    user = await _create_user(db_session)
+    for day in (1, 5, 9):
+        await crud.create_user_transaction(
+            db_session,
+            TransactionCreate(
+                amount=Decimal("10.00"), type="EXPENSE", category="Food",
+                description=f"day {day}", occurred_at=datetime(2026, 3, day, 12),
+            ),
+            user.id,
+        )
+
+    async def descriptions(**filters) -> list:
+        result = await execute_tool(db_session, user.id, "list_transactions", filters)
+        return [tx["description"] for tx in result["transactions"]]
+
+    # Act / Assert
+    assert await descriptions() == ["day 9", "day 5", "day 1"]
+    assert await descriptions(from_date="2026-03-04T00:00:00") == ["day 9", "day 5"]
+    assert await descriptions(to_date="2026-03-06T00:00:00", limit=1) == ["day 5"]
+    assert await descriptions(from_date="2026-03-02T00:00:00", to_date="2026-03-06T00:00:00") == ["day 5"]
+
+
+@pytest.mark.asyncio
+async def test_delete_transaction_returns_deleted_row(db_session: AsyncSession) -> None:
+    """Deleting returns the removed amount and category; a second delete is not found."""
+    user = await _create_user(db_session)
+    tx = await crud.create_user_transaction(
+        db_session,
+        TransactionCreate(amount=Decimal("12.34"), type="EXPENSE", category="Food"),
+        user.id,
+    )
+
+    result = await execute_tool(db_session, user.id, "delete_transaction", {"transaction_id": str(tx.id)})
+
+    assert result == {"deleted": True, "id": str(tx.id), "amount": 12.34, "category": "Food"}
+    with pytest.raises(ValueError, match="not found"):
+        await execute_tool(db_session, user.id, "delete_transaction", {"transaction_id": str(tx.id)})
+
+
+@pytest.mark.asyncio
+async def test_create_and_update_transaction_validate_once(db_session: AsyncSession) -> None:
+    """Tool inputs enforce the TransactionCreate/Update rules the CRUD layer relies on."""
+    user = await _create_user(db_session)
+
+    with pytest.raises(ValueError, match=r"Invalid arguments for create_transaction: category"):
+        await execute_tool(db_session, user.id, "create_transaction", {
+            "amount": 10.0, "type": "EXPENSE", "category": "x" * 256,
+        })
+
+    created = await execute_tool(db_session, user.id, "create_transaction", {
+        "amount": 10.0, "type": "EXPENSE", "category": "Food",
+    })
+    with pytest.raises(ValueError, match=r"Invalid arguments for update_transaction: category"):
+        await execute_tool(db_session, user.id, "update_transaction", {
+            "transaction_id": created["id"], "category": "   ",
+        })
+
+    updated = await execute_tool(db_session, user.id, "update_transaction", {
+        "transaction_id": created["id"], "category": "  Transport ",
+    })
+
+    assert updated["category"] == "Transport"
+    assert updated["amount"] == 10.0
+
+
+def test_tools_json_bytes_round_trip() -> None:
+    """The precomputed registry blob parses back to TOOLS."""
+    assert json.loads(TOOLS_JSON_BYTES) == TOOLS
+    assert hashlib.sha256(TOOLS_JSON_BYTES).hexdigest() == TOOLS_DIGEST
@@ -131,3 +131,79 @@ async def test_get_current_user_info_no_token(async_client: AsyncClient) -> None
     
     # Assert
     assert response.status_code == 401
+
+
+def test_verify_password_memoized_in_test_env(monkeypatch: pytest.MonkeyPatch) -> None:
+    """With the verify cache on, a repeated (password, hash) pair skips bcrypt."""
+    from app import auth_utils
+
+    hashed = auth_utils.get_password_hash("securepass123")
+    calls = []
+    original_verify = auth_utils.pwd_context.verify
+
+    def counting_verify(plain: str, hashed_password: str) -> bool:
+        calls.append(plain)
+        return original_verify(plain, hashed_password)
+
+    monkeypatch.setattr(auth_utils, "_VERIFY_CACHE_ENABLED", True)
+    monkeypatch.setattr(auth_utils, "_verify_cache", auth_utils.OrderedDict())
+    monkeypatch.setattr(auth_utils.pwd_context, "verify", counting_verify)
+
+    assert auth_utils.verify_password("securepass123", hashed)
+    assert auth_utils.verify_password("securepass123", hashed)
+    assert not auth_utils.verify_password("wrongpass", hashed)
+    assert not auth_utils.verify_password("wrongpass", hashed)
+    assert calls == ["securepass123", "wrongpass"]
+
+    monkeypatch.setattr(auth_utils, "_VERIFY_CACHE_ENABLED", False)
+    assert auth_utils.verify_password("securepass123", hashed)
+    assert len(calls) == 3
+
+
+def test_hs256_access_token_matches_jose() -> None:
+    """The direct HS256 signer produces the exact token jose would."""
+    from datetime import datetime, timezone
+
+    from jose import jwt
+
+    from app import auth_utils
+
+    claims = {"sub": "user-id", "exp": datetime(2100, 1, 1, tzinfo=timezone.utc), "nonce": "abc"}
+
+    token = auth_utils._encode_hs256(dict(claims))
+
+    assert token == jwt.encode(dict(claims), auth_utils.SECRET_KEY, algorithm="HS256")
+    assert jwt.decode(token, auth_utils.SECRET_KEY, algorithms=["HS256"])["sub"] == "user-id"
+
+
+@pytest.mark.asyncio
+async def test_get_current_user_cached_until_invalidated(db_session, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Repeat lookups for the same token are served from the cache until invalidated."""
+    from uuid import uuid4
+
+    from app import auth_utils
+    from app.models import User
+
+    monkeypatch.setattr(auth_utils, "AUTH_USER_CACHE_TTL", 60)
+    monkeypatch.setattr(auth_utils, "_current_user_cache", auth_utils.OrderedDict())
+    user = User(email=f"cache-{uuid4().hex[:8]}@example.com", hashed_password="x")
+    db_session.add(user)
+    await db_session.commit()
+    token = auth_utils.create_access_token(user.id)
+
+    first = await auth_utils.get_current_user(token, db_session)
+    executed = []
+    original_execute = db_session.execute
+
+    async def counting_execute(*args, **kwargs):
+        executed.append(args)
+        return await original_execute(*args, **kwargs)
+
+    monkeypatch.setattr(db_session, "execute", counting_execute)
+    second = await auth_utils.get_current_user(token, db_session)
+    auth_utils.invalidate_cached_user(user.id)
+    third = await auth_utils.get_current_user(token, db_session)
+
+    assert second is first and second.email == user.email
+    assert len(executed) == 1
+    assert third.id == user.id
@@ -8,6 +8,8 @@ import pytest
 import respx
 from httpx import AsyncClient, Response
 
+from app.ai.gateway import reload_env_api_keys
+
 # Note: We use the /chat/api-key endpoint to set API keys in tests.
 # API keys must match schema: min 20 chars, start with sk-, sk-ant-, or sk-proj-
 TEST_API_KEY = "sk-test-key-for-testing-only-12345"
@@ -21,6 +23,7 @@ async def test_chat_message_missing_api_key(async_client: AsyncClient, test_user
     # Arrange - Ensure no API key is set
     os.environ.pop("OPENAI_API_KEY", None)
     os.environ.pop("ANTHROPIC_API_KEY", None)
+    reload_env_api_keys()
     
     payload = {
         "text": "Qual meu saldo?",
@@ -339,8 +342,8 @@ async def test_chat_message_create_transaction(async_client: AsyncClient, test_u
 
 
 @pytest.mark.asyncio
-async def test_chat_message_provider_error(async_client: AsyncClient, test_user: dict) -> None:
-    """Test that provider failure returns safe 502 and does not persist partial messages."""
+async def test_chat_message_provider_error(async_client: AsyncClient, test_user: dict, db_session) -> None:
+    """Test that provider failure returns safe 502 and keeps only the user message."""
     # Arrange - Set ephemeral API key via endpoint
     await async_client.post(
         "/chat/api-key",
@@ -374,6 +377,14 @@ async def test_chat_message_provider_error(async_client: AsyncClient, test_user:
         data = response.json()
         assert "erro" in data["detail"].lower() or "error" in data["detail"].lower()
 
+    # The user's text is persisted; no assistant reply is
+    from sqlalchemy import select
+
+    from app.models import ChatMessage as ChatMessageModel
+
+    result = await db_session.execute(select(ChatMessageModel.role, ChatMessageModel.content))
+    assert result.all() == [("user", "Qual meu saldo?")]
+
 
 @pytest.mark.asyncio
 async def test_set_ephemeral_api_key(async_client: AsyncClient, test_user: dict) -> None:
@@ -985,3 +996,498 @@ async def test_chat_message_delete_transaction(async_client: AsyncClient, test_u
         transactions = tx_response.json()
         deleted_tx = next((tx for tx in transactions if tx["id"] == transaction_id), None)
         assert deleted_tx is None
+
+
+@pytest.mark.asyncio
+async def test_call_llm_stream_openai(monkeypatch) -> None:
+    """OpenAI streaming yields text deltas, then the joined response with assembled tool calls."""
+    from app.ai import gateway
+
+    monkeypatch.setattr(gateway, "AI_PROVIDER", "openai")
+
+    def _chunk(delta: dict) -> str:
+        payload = {
+            "id": "chatcmpl-stream",
+            "object": "chat.completion.chunk",
+            "created": 1234567890,
+            "model": "gpt-4o-mini",
+            "choices": [{"index": 0, "delta": delta, "finish_reason": None}],
+        }
+        return f"data: {json.dumps(payload)}\n\n"
+
+    body = "".join([
+        _chunk({"role": "assistant", "content": "Seu "}),
+        _chunk({"content": "saldo"}),
+        _chunk({"tool_calls": [{"index": 0, "id": "call_1", "type": "function",
+                                "function": {"name": "get_balance", "arguments": "{\"a\""}}]}),
+        _chunk({"tool_calls": [{"index": 0, "function": {"arguments": ": 1}"}}]}),
+        "data: [DONE]\n\n",
+    ])
+
+    with respx.mock:
+        respx.route(method__in=["POST", b"POST"], url="https://api.openai.com/v1/chat/completions").mock(
+            return_value=Response(200, text=body, headers={"content-type": "text/event-stream"})
+        )
+        events = [
+            event async for event in gateway.call_llm_stream(
+                [{"role": "user", "content": "Qual meu saldo?"}], api_key=TEST_API_KEY
+            )
+        ]
+
+    assert [event["delta"] for event in events if "delta" in event] == ["Seu ", "saldo"]
+    final = events[-1]
+    assert final["done"] is True
+    assert final["response"]["content"] == "Seu saldo"
+    assert final["response"]["tool_calls"] == [{"id": "call_1", "name": "get_balance", "arguments": "{\"a\": 1}"}]
+
+
+@pytest.mark.asyncio
+async def test_call_gemini_extracts_parts_in_one_pass(monkeypatch) -> None:
+    """Gemini text parts are joined and function call parts become tool calls with unique ids."""
+    from types import SimpleNamespace
+
+    from app.ai import gateway
+
+    def _part(text=None, function_call=None):
+        return SimpleNamespace(text=text, function_call=function_call)
+
+    func_call = SimpleNamespace(name="get_balance", args={"period": "month"})
+    response = SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=[
+        _part(text="Seu "),
+        _part(function_call=func_call),
+        _part(text="saldo"),
+        _part(function_call=func_call),
+    ]))])
+
+    async def fake_generate_content(**kwargs):
+        return response
+
+    client = SimpleNamespace(aio=SimpleNamespace(models=SimpleNamespace(generate_content=fake_generate_content)))
+    monkeypatch.setattr(gateway, "_gemini_client", lambda api_key: client)
+    monkeypatch.setattr(gateway, "_gemini_request", lambda messages, tools: ("Qual meu saldo?", None))
+
+    result = await gateway._call_gemini([{"role": "user", "content": "Qual meu saldo?"}])
+
+    assert result["content"] == "Seu saldo"
+    assert [call["name"] for call in result["tool_calls"]] == ["get_balance", "get_balance"]
+    assert result["tool_calls"][0]["arguments"] == "{\"period\": \"month\"}"
+    assert result["tool_calls"][0]["id"] != result["tool_calls"][1]["id"]
+
+
+def test_trim_messages_token_budget(monkeypatch) -> None:
+    """History is trimmed oldest-first to the token budget; system messages and the current message stay."""
+    from app.ai import gateway
+
+    monkeypatch.setattr(gateway, "TIKTOKEN_AVAILABLE", False)  # ~4 chars per token
+    messages = [
+        {"role": "system", "content": "s" * 40},
+        {"role": "user", "content": "a" * 400},
+        {"role": "assistant", "content": "b" * 40},
+        {"role": "user", "content": "c" * 40},
+    ]
+
+    assert gateway.trim_messages(messages, budget=200) is messages
+    assert gateway.trim_messages(messages, budget=0) is messages
+
+    trimmed = gateway.trim_messages(messages, budget=40)
+    assert [m["content"] for m in trimmed] == [
+        "s" * 40,
+        "(1 mensagens anteriores omitidas por limite de contexto)",
+        "b" * 40,
+        "c" * 40,
+    ]
+
+
+def test_trim_messages_keeps_question_after_tool_calls(monkeypatch) -> None:
+    """On the follow-up call, the user's question and its tool-call message survive trimming."""
+    from app.ai import gateway
+
+    monkeypatch.setattr(gateway, "TIKTOKEN_AVAILABLE", False)  # ~4 chars per token
+    tool_calls = [{"id": "call_1", "name": "get_balance", "arguments": "{}"}]
+    messages = [
+        {"role": "system", "content": "s" * 40},
+        *({"role": "user" if i % 2 == 0 else "assistant", "content": "h" * 400} for i in range(6)),
+        {"role": "user", "content": "q" * 40},
+        {"role": "assistant", "content": "", "tool_calls": tool_calls},
+        {"role": "user", "content": "r" * 200},
+    ]
+
+    trimmed = gateway.trim_messages(messages, budget=100)
+
+    assert trimmed == [
+        messages[0],
+        {"role": "system", "content": "(6 mensagens anteriores omitidas por limite de contexto)"},
+        *messages[-3:],
+    ]
+
+
+@pytest.mark.asyncio
+async def test_chat_message_multiple_tool_calls(async_client: AsyncClient, test_user: dict) -> None:
+    """Several tool calls in one reply all run; results are reported in model-emitted order."""
+    # Arrange
+    await async_client.post(
+        "/chat/api-key",
+        json={"api_key": TEST_API_KEY},
+        headers=test_user["headers"],
+    )
+
+    def _completion(message: dict) -> Response:
+        return Response(
+            200,
+            json={
+                "id": "chatcmpl-multi",
+                "object": "chat.completion",
+                "created": 1234567890,
+                "model": "gpt-4o-mini",
+                "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+            },
+        )
+
+    def _tool_call(call_id: str, name: str, arguments: str) -> dict:
+        return {"id": call_id, "type": "function", "function": {"name": name, "arguments": arguments}}
+
+    with respx.mock:
+        route = respx.route(method__in=["POST", b"POST"], url="https://api.openai.com/v1/chat/completions").mock(
+            side_effect=[
+                _completion({
+                    "role": "assistant",
+                    "content": None,
+                    "tool_calls": [
+                        _tool_call("call_1", "get_balance", "{}"),
+                        _tool_call("call_2", "create_transaction", json.dumps({
+                            "amount": 12.5, "type": "EXPENSE", "category": "Food",
+                        })),
+                        _tool_call("call_3", "list_transactions", "{not json"),
+                    ],
+                }),
+                _completion({"role": "assistant", "content": "Pronto!"}),
+            ]
+        )
+
+        # Act
+        response = await async_client.post(
+            "/chat/messages",
+            json={"text": "Registra 12,50 de comida e mostra meu saldo", "content_type": "text"},
+            headers=test_user["headers"],
+        )
+
+        # Assert
+        assert response.status_code == 201
+        assert response.json()["meta"]["did_create_transaction"] is True
+        followup = json.loads(route.calls[1].request.content)["messages"][-1]["content"]
+        balance_at = followup.index("Função get_balance executada com sucesso")
+        create_at = followup.index("Função create_transaction executada com sucesso")
+        error_at = followup.index("ERRO na função list_transactions")
+        assert balance_at < create_at < error_at
+
+
+def test_should_include_context_pack_keywords() -> None:
+    """Finance intents match as whole words (plurals included), case-insensitively; small talk does not."""
+    from app.ai.gateway import should_include_context_pack
+
+    assert should_include_context_pack("Quanto GASTEI esse mês?")
+    assert should_include_context_pack("como estou no Fim do Mês")
+    assert not should_include_context_pack("oi, tudo bem?")
+    assert should_include_context_pack("minhas despesas de ontem")
+    assert not should_include_context_pack("qual o address do banco?")
+
+
+@pytest.mark.asyncio
+async def test_streamed_tool_calls_start_before_reply_ends(
+    async_client: AsyncClient, test_user: dict, monkeypatch
+) -> None:
+    """With AI_STREAM_TOOL_CALLS, read-only tools run while the reply is still streaming."""
+    import asyncio
+
+    from app.ai import gateway
+
+    monkeypatch.setattr(gateway, "AI_STREAM_TOOL_CALLS", True)
+    monkeypatch.setattr(gateway, "AI_TOOLS_MODE", "always")
+    started = []
+    started_before_reply_end = []
+    original_read_tool = gateway.execute_read_tool_isolated
+
+    async def tracking_read_tool(db, user_id, tool_name, tool_args):
+        started.append(tool_name)
+        return await original_read_tool(db, user_id, tool_name, tool_args)
+
+    async def fake_stream(messages, tools=None, api_key=None):
+        balance_call = {"id": "call_1", "name": "get_balance", "arguments": "{}"}
+        yield {"tool_call": balance_call}
+        await asyncio.sleep(0.01)
+        started_before_reply_end.extend(started)
+        yield {"delta": "..."}
+        yield {"done": True, "response": {"role": "assistant", "content": "", "tool_calls": [balance_call]}}
+
+    monkeypatch.setattr(gateway, "execute_read_tool_isolated", tracking_read_tool)
+    monkeypatch.setattr(gateway, "call_llm_stream", fake_stream)
+    await async_client.post("/chat/api-key", json={"api_key": TEST_API_KEY}, headers=test_user["headers"])
+
+    with respx.mock:
+        route = respx.route(method__in=["POST", b"POST"], url="https://api.openai.com/v1/chat/completions").mock(
+            return_value=Response(200, json={
+                "id": "chatcmpl-after-tools",
+                "object": "chat.completion",
+                "created": 1234567890,
+                "model": "gpt-4o-mini",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "Saldo: R$ 0,00"}, "finish_reason": "stop"}],
+            })
+        )
+        response = await async_client.post(
+            "/chat/messages",
+            json={"text": "Qual meu saldo?", "content_type": "text"},
+            headers=test_user["headers"],
+        )
+
+    assert response.status_code == 201
+    assert started_before_reply_end == ["get_balance"]
+    assert started == ["get_balance"]
+    followup = json.loads(route.calls[0].request.content)["messages"][-1]["content"]
+    assert "Função get_balance executada com sucesso" in followup
+
+
+def test_join_bounded_matches_full_join() -> None:
+    """The bounded join equals join-then-cut and stops consuming texts past the cap."""
+    from app.ai.gateway import _join_bounded
+
+    consumed = []
+
+    def texts():
+        for text in ["a" * 6, "b" * 6, "c" * 6]:
+            consumed.append(text)
+            yield text
+
+    assert _join_bounded(texts(), "\n\n", 9) == "aaaaaa\n\nb... (truncated)"
+    assert consumed == ["a" * 6, "b" * 6]
+    assert _join_bounded(["ab", "cd"], "\n\n", 100) == "ab\n\ncd"
+
+
+def test_anthropic_request_marks_cacheable_prefix(monkeypatch) -> None:
+    """With AI_PROMPT_CACHE, the system prompt and the stable history tail carry cache_control."""
+    from app.ai import gateway
+
+    messages = [
+        {"role": "system", "content": "ctx"},
+        {"role": "user", "content": "Oi"},
+        {"role": "assistant", "content": "Olá!"},
+        {"role": "user", "content": "Qual meu saldo?"},
+    ]
+
+    monkeypatch.setattr(gateway, "AI_PROMPT_CACHE", True)
+    params = gateway._anthropic_request_params(messages, None)
+    assert params["system"][0]["cache_control"] == {"type": "ephemeral"}
+    assert params["messages"][1]["content"] == [
+        {"type": "text", "text": "Olá!", "cache_control": {"type": "ephemeral"}}
+    ]
+    assert params["messages"][-1]["content"] == "Qual meu saldo?"
+
+    monkeypatch.setattr(gateway, "AI_PROMPT_CACHE", False)
+    params = gateway._anthropic_request_params(messages, None)
+    assert params["system"] == gateway.SYSTEM_PROMPT
+    assert params["messages"][1]["content"] == "Olá!"
+
+
+def test_record_tool_metadata_cards_match_validated_events() -> None:
+    """Unvalidated success cards serialize exactly like validated ChatUiEvent instances."""
+    from app.ai.gateway import _record_tool_metadata
+    from app.chat.schemas import ChatAssistantMeta, ChatUiEvent
+
+    metadata = ChatAssistantMeta()
+    result = {
+        "id": "6f1c5b7e-4d1a-4c1e-9a52-0d6f4c3b2a10",
+        "amount": 42.5,
+        "type": "EXPENSE",
+        "category": "Food",
+        "description": "mercado",
+        "occurred_at": "2026-03-14T12:00:00",
+    }
+
+    _record_tool_metadata(metadata, "update_transaction", result)
+    _record_tool_metadata(metadata, "delete_transaction", {**result, "deleted": True})
+
+    assert metadata.did_update_transaction and metadata.did_delete_transaction
+    assert [event.model_dump() for event in metadata.ui_events] == [
+        ChatUiEvent.model_validate(event.model_dump()).model_dump() for event in metadata.ui_events
+    ]
+    assert metadata.ui_events[0].data == {"transaction": {key: result[key] for key in result}}
+    assert metadata.model_dump_json()
+
+
+def test_token_counts_memoized_across_trims(monkeypatch) -> None:
+    """Messages re-sent on later tool iterations are not re-encoded."""
+    from app.ai import gateway
+
+    encoded = []
+
+    class FakeEncoder:
+        def encode(self, text, disallowed_special=()):
+            encoded.append(text)
+            return text.split()
+
+    monkeypatch.setattr(gateway, "TIKTOKEN_AVAILABLE", True)
+    monkeypatch.setattr(gateway, "AI_PROVIDER", "openai")
+    monkeypatch.setattr(gateway, "_token_encoder", FakeEncoder())
+    monkeypatch.setattr(gateway, "_token_counts", gateway.OrderedDict())
+
+    messages = [
+        {"role": "system", "content": "sys prompt"},
+        {"role": "user", "content": "one two three"},
+        {"role": "assistant", "content": "four five"},
+        {"role": "user", "content": "six"},
+    ]
+    assert gateway.trim_messages(messages, budget=100) is messages
+    assert gateway.trim_messages([*messages, {"role": "user", "content": "seven"}], budget=100)
+
+    assert sorted(encoded) == sorted([m["content"] for m in messages] + ["seven"])
+    assert gateway._count_tokens("one two three") == 3
+    # The memo holds fixed-size digests, not the message texts
+    assert all(isinstance(key, bytes) and len(key) == 16 for key in gateway._token_counts)
+
+
+def test_compact_tool_result_respects_max_chars() -> None:
+    """An explicit limit cuts the compact form like the default limit does."""
+    from app.ai.gateway import compact_tool_result
+
+    result = {"transactions": [{"id": index, "category": "Food"} for index in range(5)], "total": 5}
+    full = compact_tool_result(result)
+
+    assert compact_tool_result(result, max_chars=20) == full[:20] + "... (truncated)"
+    assert compact_tool_result(result, max_chars=len(full)) == full
+
+
+@pytest.mark.asyncio
+async def test_schedule_conversation_summary_runs_once_per_conversation(monkeypatch) -> None:
+    """Summarization runs in the background, one task per (user, conversation) at a time."""
+    import asyncio
+    from uuid import uuid4
+
+    from app.chat import crud as chat_crud
+
+    release = asyncio.Event()
+    calls = []
+
+    async def fake_summary(db, user_id, conversation_id, max_messages=None):
+        calls.append(conversation_id)
+        await release.wait()
+        raise RuntimeError("summary failed")
+
+    monkeypatch.setattr(chat_crud, "maybe_update_conversation_summary", fake_summary)
+    user_id, other_user_id, conversation_id = uuid4(), uuid4(), uuid4()
+
+    assert chat_crud.schedule_conversation_summary(None, user_id, conversation_id) is True
+    assert chat_crud.schedule_conversation_summary(None, user_id, conversation_id) is False
+    # Conversation ids come from clients: another user's id collision is not deduplicated
+    assert chat_crud.schedule_conversation_summary(None, other_user_id, conversation_id) is True
+    await asyncio.sleep(0)
+    release.set()
+    await asyncio.gather(*chat_crud._summary_tasks)
+
+    assert calls == [conversation_id, conversation_id]
+    assert not chat_crud._summaries_in_flight
+
+
+@pytest.mark.asyncio
+async def test_summary_check_skips_count_under_threshold(db_session) -> None:
+    """After the first COUNT, short conversations are checked from the in-process count."""
+    from uuid import uuid4
+
+    from app.chat import crud as chat_crud
+    from app.chat.schemas import ChatMessageCreate
+
+    user_id, conversation_id = uuid4(), uuid4()
+    payload = ChatMessageCreate(conversation_id=conversation_id, text="oi")
+    await chat_crud.create_chat_message(db_session, user_id, payload, "user", "oi", conversation_id)
+    assert (user_id, conversation_id) not in chat_crud._conv_message_count
+
+    await chat_crud.maybe_update_conversation_summary(db_session, user_id, conversation_id, max_messages=5)
+    assert chat_crud._conv_message_count[(user_id, conversation_id)] == 1
+
+    await chat_crud.create_chat_message(db_session, user_id, payload, "assistant", "olá", conversation_id)
+    assert chat_crud._conv_message_count[(user_id, conversation_id)] == 2
+
+    statements = []
+    original_execute = db_session.execute
+
+    async def tracking_execute(statement, *args, **kwargs):
+        statements.append(statement)
+        return await original_execute(statement, *args, **kwargs)
+
+    db_session.execute = tracking_execute
+    await chat_crud.maybe_update_conversation_summary(db_session, user_id, conversation_id, max_messages=5)
+    assert statements == []
+
+    # Another user's message with the same conversation id does not touch this count
+    await chat_crud.create_chat_message(db_session, uuid4(), payload, "user", "oi", conversation_id)
+    assert chat_crud._conv_message_count[(user_id, conversation_id)] == 2
+
+
+@pytest.mark.asyncio
+async def test_staged_messages_commit_together_in_order(db_session) -> None:
+    """A turn's staged messages keep their order, also when a tool handler commits mid-turn."""
+    from decimal import Decimal
+    from uuid import uuid4
+
+    from app import crud
+    from app.chat import crud as chat_crud
+    from app.models import User
+    from app.schemas import TransactionCreate
+
+    user = User(email=f"staged-{uuid4().hex[:8]}@example.com", hashed_password="x")
+    db_session.add(user)
+    await db_session.commit()
+
+    # Turn without tools: both messages are written by one commit
+    conversation_id = uuid4()
+    user_message = chat_crud.stage_chat_message(db_session, user.id, conversation_id, "user", "oi")
+    assert await chat_crud.list_recent_messages(db_session, user.id, conversation_id) == []
+
+    assistant_message = chat_crud.stage_chat_message(db_session, user.id, conversation_id, "assistant", "olá")
+    await chat_crud.commit_chat_messages(db_session, [user_message, assistant_message])
+
+    rows = await chat_crud.list_recent_messages(db_session, user.id, conversation_id)
+    assert [(row.id, row.role) for row in rows] == [(user_message.id, "user"), (assistant_message.id, "assistant")]
+
+    # Turn with a write tool: the handler's commit writes the staged user message early
+    conversation_id = uuid4()
+    user_message = chat_crud.stage_chat_message(db_session, user.id, conversation_id, "user", "gastei 10 em Food")
+    await crud.create_user_transaction(
+        db_session,
+        TransactionCreate(amount=Decimal("10.00"), type="EXPENSE", category="Food"),
+        user.id,
+    )
+    rows = await chat_crud.list_recent_messages(db_session, user.id, conversation_id)
+    assert [row.id for row in rows] == [user_message.id]
+
+    assistant_message = chat_crud.stage_chat_message(db_session, user.id, conversation_id, "assistant", "feito")
+    await chat_crud.commit_chat_messages(db_session, [user_message, assistant_message])
+
+    rows = await chat_crud.list_recent_messages(db_session, user.id, conversation_id)
+    assert [(row.id, row.role) for row in rows] == [(user_message.id, "user"), (assistant_message.id, "assistant")]
+
+
+@pytest.mark.asyncio
+async def test_conversation_summary_text_cached_with_write_through(db_session) -> None:
+    """Summary reads are served from cache; updates write the new text through."""
+    from uuid import uuid4
+
+    from app.chat import crud as chat_crud
+    from app.models import User
+
+    user = User(email=f"summary-{uuid4().hex[:8]}@example.com", hashed_password="x")
+    db_session.add(user)
+    await db_session.commit()
+    conversation_id = uuid4()
+
+    assert await chat_crud.get_conversation_summary_text(db_session, user.id, conversation_id) is None
+    await chat_crud.update_conversation_summary(db_session, user.id, conversation_id, "resumo 1")
+
+    statements = []
+    original_execute = db_session.execute
+
+    async def tracking_execute(statement, *args, **kwargs):
+        statements.append(statement)
+        return await original_execute(statement, *args, **kwargs)
+
+    db_session.execute = tracking_execute
+    assert await chat_crud.get_conversation_summary_text(db_session, user.id, conversation_id) == "resumo 1"
+    assert statements == []
@@ -0,0 +1,310 @@
+"""
+Tests for the finance context pack builder injected into LLM prompts.
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from types import SimpleNamespace
+from typing import Optional
+from uuid import uuid4
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import crud
+from app.ai import context as context_module
+from app.ai.context import (
+    build_finance_context_pack,
+    build_finance_context_pack_text,
+    serialize_finance_context_pack,
+)
+from app.models import Transaction, User
+from app.schemas import TransactionCreate
+
+
+async def _create_user(db: AsyncSession) -> User:
+    """Persist a bare user for context pack tests."""
+    user = User(email=f"ctx-{uuid4().hex[:8]}@example.com", hashed_password="x")
+    db.add(user)
+    await db.commit()
+    return user
+
+
+async def _add_tx(
+    db: AsyncSession,
+    user: User,
+    amount: str,
+    tx_type: str,
+    category: str,
+    occurred_at: datetime,
+    description: Optional[str] = None,
+) -> None:
+    """Persist a transaction for the given user."""
+    db.add(
+        Transaction(
+            user_id=user.id,
+            amount=Decimal(amount),
+            type=tx_type,
+            category=category,
+            description=description,
+            occurred_at=occurred_at,
+        )
+    )
+    await db.commit()
+
+
+@pytest.mark.asyncio
+async def test_context_pack_month_to_date_totals(db_session: AsyncSession) -> None:
+    """Month-to-date totals and top categories only include the current month."""
+    # Arrange
+    now = datetime(2026, 3, 15, 12, 0, 0)
+    user = await _create_user(db_session)
+    await _add_tx(db_session, user, "3000.00", "INCOME", "Salary", now - timedelta(days=5))
+    await _add_tx(db_session, user, "100.00", "EXPENSE", "Food", now - timedelta(days=3))
+    await _add_tx(db_session, user, "50.00", "EXPENSE", "Food", now - timedelta(days=2))
+    await _add_tx(db_session, user, "200.00", "EXPENSE", "Transport", now - timedelta(days=1))
+    # Previous month: counts towards balance but not month-to-date
+    await _add_tx(db_session, user, "999.00", "EXPENSE", "Rent", now - timedelta(days=30))
+
+    # Act
+    pack = await build_finance_context_pack(db_session, user.id, now=now)
+
+    # Assert
+    mtd = pack["month_to_date"]
+    assert mtd["income_total"] == 3000.0
+    assert mtd["expense_total"] == 350.0
+    assert mtd["top_expense_categories"] == [
+        {"category": "Transport", "amount": 200.0},
+        {"category": "Food", "amount": 150.0},
+    ]
+    assert pack["balance"]["amount"] == 3000.0 - 350.0 - 999.0
+
+
+@pytest.mark.asyncio
+async def test_context_pack_recent_transactions_limit(db_session: AsyncSession) -> None:
+    """Recent transactions are newest first and capped by tx_limit."""
+    # Arrange
+    now = datetime(2026, 3, 15, 12, 0, 0)
+    user = await _create_user(db_session)
+    for day in range(1, 5):
+        await _add_tx(
+            db_session, user, f"{day}0.00", "EXPENSE", "Food", now - timedelta(days=day),
+            description=f"tx {day}",
+        )
+
+    # Act
+    pack = await build_finance_context_pack(db_session, user.id, now=now, tx_limit=2)
+
+    # Assert
+    recent = pack["recent_transactions"]
+    assert [tx["description"] for tx in recent] == ["tx 1", "tx 2"]
+    assert recent[0]["amount"] == 10.0
+    assert recent[0]["type"] == "EXPENSE"
+
+
+@pytest.mark.asyncio
+async def test_context_pack_empty(db_session: AsyncSession) -> None:
+    """A user without transactions gets zeroed totals and no recent transactions."""
+    # Arrange
+    user = await _create_user(db_session)
+
+    # Act
+    pack = await build_finance_context_pack(db_session, user.id)
+
+    # Assert
+    assert pack["balance"]["amount"] == 0.0
+    assert pack["month_to_date"]["income_total"] == 0.0
+    assert pack["month_to_date"]["expense_total"] == 0.0
+    assert pack["month_to_date"]["top_expense_categories"] == []
+    assert pack["recent_transactions"] == []
+
+
+@pytest.mark.asyncio
+async def test_context_pack_cache_invalidated_by_transaction_write(
+    db_session: AsyncSession,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Cached packs are reused until the user writes a transaction."""
+    # Arrange - freeze the cache time bucket so the test cannot straddle a boundary
+    monkeypatch.setattr("app.ai.context.time", SimpleNamespace(time=lambda: 1_000_000.0))
+    user = await _create_user(db_session)
+    first = await build_finance_context_pack(db_session, user.id)
+
+    # Act - a direct insert bypasses CRUD, so the cached pack is still served
+    await _add_tx(db_session, user, "10.00", "EXPENSE", "Food", datetime.utcnow())
+    cached = await build_finance_context_pack(db_session, user.id)
+    await crud.create_user_transaction(
+        db_session,
+        TransactionCreate(amount=Decimal("5.00"), type="EXPENSE", category="Food"),
+        user.id,
+    )
+    fresh = await build_finance_context_pack(db_session, user.id)
+
+    # Assert
+    assert cached is first
+    assert fresh["month_to_date"]["expense_total"] == 15.0
+    assert len(fresh["recent_transactions"]) == 2
+
+
+@pytest.mark.asyncio
+async def test_context_pack_relevant_recent_transactions(db_session: AsyncSession) -> None:
+    """With relevant_to, matching transactions beat newer unrelated ones."""
+    # Arrange
+    now = datetime(2026, 3, 15, 12, 0, 0)
+    user = await _create_user(db_session)
+    await _add_tx(db_session, user, "32.50", "EXPENSE", "Transport", now - timedelta(days=6), "uber aeroporto")
+    for day in range(1, 5):
+        await _add_tx(db_session, user, "10.00", "EXPENSE", "Food", now - timedelta(days=day), f"cafe {day}")
+
+    # Act
+    pack = await build_finance_context_pack(
+        db_session, user.id, now=now, tx_limit=2, relevant_to="quanto gastei de uber?"
+    )
+
+    # Assert - best match kept, remaining slot filled by recency, newest first
+    assert [tx["description"] for tx in pack["recent_transactions"]] == ["cafe 1", "uber aeroporto"]
+
+
+@pytest.mark.asyncio
+async def test_context_pack_serialization_is_stable(db_session: AsyncSession) -> None:
+    """Packs built within the same hour from the same data serialize identically."""
+    # Arrange
+    now = datetime(2026, 3, 15, 12, 5, 0)
+    user = await _create_user(db_session)
+    await _add_tx(db_session, user, "40.00", "EXPENSE", "Food", now - timedelta(days=1))
+    await _add_tx(db_session, user, "40.00", "EXPENSE", "Bills", now - timedelta(days=1))
+
+    # Act
+    first_text, first_version = serialize_finance_context_pack(
+        await build_finance_context_pack(db_session, user.id, now=now)
+    )
+    second_text, second_version = serialize_finance_context_pack(
+        await build_finance_context_pack(db_session, user.id, now=now + timedelta(minutes=40))
+    )
+
+    # Assert - as_of is quantized and ties are broken on the row contents
+    assert first_text == second_text
+    assert first_version == second_version
+    assert '"as_of":"2026-03-15T12:00:00Z"' in first_text
+    assert '"top_expense_categories":[{"amount":40.0,"category":"Bills"}' in first_text
+
+
+@pytest.mark.asyncio
+async def test_context_pack_timestamps_are_utc(db_session: AsyncSession) -> None:
+    """Timezone-aware now values are converted to a single UTC tag."""
+    # Arrange
+    now = datetime(2026, 3, 15, 9, 30, 0, tzinfo=timezone(timedelta(hours=-3)))
+    user = await _create_user(db_session)
+    await _add_tx(db_session, user, "10.00", "EXPENSE", "Food", datetime(2026, 3, 14, 8, 15, 30, 123456))
+
+    # Act
+    pack = await build_finance_context_pack(db_session, user.id, now=now)
+
+    # Assert
+    assert pack["as_of"] == "2026-03-15T12:00:00Z"
+    assert pack["recent_transactions"][0]["occurred_at"] == "2026-03-14T08:15:30Z"
+    assert pack["month_to_date"]["expense_total"] == 10.0
+
+
+def test_serialize_context_pack_fallback_matches(monkeypatch: pytest.MonkeyPatch) -> None:
+    """The stdlib JSON fallback produces the same text and version as orjson."""
+    pytest.importorskip("orjson")
+    pack = {"currency": "BRL", "month_to_date": {"top_expense_categories": [{"category": "Alimentação", "amount": 40.0}]}}
+
+    fast = serialize_finance_context_pack(pack)
+    monkeypatch.setattr("app.ai.context.ORJSON_AVAILABLE", False)
+    fallback = serialize_finance_context_pack(pack)
+
+    assert fast == fallback
+
+
+@pytest.mark.asyncio
+async def test_context_pack_truncates_long_descriptions(db_session: AsyncSession) -> None:
+    """Descriptions over the char cap are cut with an ellipsis; short ones are untouched."""
+    # Arrange
+    now = datetime(2026, 3, 15, 12, 0, 0)
+    user = await _create_user(db_session)
+    await _add_tx(db_session, user, "10.00", "EXPENSE", "Food", now - timedelta(days=1), "x" * 200)
+    await _add_tx(db_session, user, "10.00", "EXPENSE", "Food", now - timedelta(days=2), "y" * 80)
+
+    # Act
+    pack = await build_finance_context_pack(db_session, user.id, now=now)
+
+    # Assert
+    descriptions = [tx["description"] for tx in pack["recent_transactions"]]
+    assert descriptions == ["x" * 80 + "…", "y" * 80]
+
+
+@pytest.mark.asyncio
+async def test_context_pack_concurrent_misses_share_one_build(
+    db_session: AsyncSession,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Concurrent cache misses for the same user coalesce into a single build."""
+    # Arrange
+    monkeypatch.setattr("app.ai.context.time", SimpleNamespace(time=lambda: 2_000_000.0))
+    user = await _create_user(db_session)
+    original_build = context_module._build_finance_context_pack
+    calls = []
+
+    async def counting_build(*args, **kwargs):
+        calls.append(args)
+        return await original_build(*args, **kwargs)
+
+    monkeypatch.setattr(context_module, "_build_finance_context_pack", counting_build)
+
+    # Act
+    first, second = await asyncio.gather(
+        build_finance_context_pack(db_session, user.id),
+        build_finance_context_pack(db_session, user.id),
+    )
+
+    # Assert
+    assert len(calls) == 1
+    assert first is second
+
+
+@pytest.mark.asyncio
+async def test_context_pack_text_rendering(db_session: AsyncSession) -> None:
+    """The text variant renders totals and one line per recent transaction."""
+    # Arrange
+    now = datetime(2026, 3, 15, 12, 0, 0)
+    user = await _create_user(db_session)
+    await _add_tx(db_session, user, "3000.00", "INCOME", "Salary", now - timedelta(days=2))
+    await _add_tx(db_session, user, "42.50", "EXPENSE", "Food", now - timedelta(days=1), "mercado\ncentral")
+
+    # Act
+    text = await build_finance_context_pack_text(db_session, user.id, now=now)
+
+    # Assert
+    lines = text.split("\n")
+    assert "balance=2957.50" in lines
+    assert "mtd_top_expense_categories=Food:42.50" in lines
+    assert lines[-2:] == [
+        "2026-03-14T12:00:00Z|EXPENSE|42.50|Food|mercado central",
+        "2026-03-13T12:00:00Z|INCOME|3000.00|Salary|",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_context_pack_optional_sections(db_session: AsyncSession) -> None:
+    """Disabled sections are omitted; tx_limit=0 keeps an empty recent list."""
+    # Arrange
+    now = datetime(2026, 3, 15, 12, 0, 0)
+    user = await _create_user(db_session)
+    await _add_tx(db_session, user, "20.00", "EXPENSE", "Food", now - timedelta(days=1))
+
+    # Act
+    balance_only = await build_finance_context_pack(
+        db_session, user.id, now=now, include_recent=False, include_mtd=False
+    )
+    mtd_only = await build_finance_context_pack(db_session, user.id, now=now, include_recent=False)
+    no_recent_rows = await build_finance_context_pack(db_session, user.id, now=now, tx_limit=0)
+
+    # Assert
+    assert balance_only["balance"]["amount"] == -20.0
+    assert "month_to_date" not in balance_only and "recent_transactions" not in balance_only
+    assert mtd_only["month_to_date"]["expense_total"] == 20.0
+    assert "recent_transactions" not in mtd_only
+    assert no_recent_rows["recent_transactions"] == []
+    assert no_recent_rows["month_to_date"]["expense_total"] == 20.0
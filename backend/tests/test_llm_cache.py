@@ -0,0 +1,316 @@
+"""
+Tests for the AI gateway in-memory state: response caches (exact L1, semantic L2), provider clients and ephemeral API keys.
+"""
+import asyncio
+import hashlib
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+from uuid import uuid4
+
+import pytest
+
+from app import crud
+from app.ai import gateway, semantic_cache
+
+_VECTORS = {
+    "qual meu saldo?": [1.0, 0.0, 0.0],
+    "quanto tenho de saldo?": [0.98, 0.2, 0.0],
+    "me conta uma piada": [0.0, 0.0, 1.0],
+}
+
+
+async def _fake_embed(text: str, api_key: Optional[str]) -> Optional[List[float]]:
+    """Deterministic embeddings so similarity is controlled by the test."""
+    return semantic_cache._normalize(_VECTORS[text])
+
+
+@pytest.fixture(autouse=True)
+def _isolate_caches(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(semantic_cache, "_embed", _fake_embed)
+    monkeypatch.setattr(semantic_cache, "_entries", semantic_cache.OrderedDict())
+    monkeypatch.setattr(gateway, "_l1_cache", gateway.OrderedDict())
+
+
+@pytest.mark.asyncio
+async def test_l1_cache_replays_identical_requests(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Identical requests hit the provider once; tool-call replies are never cached."""
+    calls: List[List[Dict[str, Any]]] = []
+    replies = iter([
+        {"role": "assistant", "content": "Olá!", "tool_calls": []},
+        {"role": "assistant", "content": "", "tool_calls": [{"id": "1", "name": "get_balance", "arguments": "{}"}]},
+        {"role": "assistant", "content": "", "tool_calls": [{"id": "2", "name": "get_balance", "arguments": "{}"}]},
+    ])
+
+    async def fake_call_openai(messages, tools=None, api_key=None):
+        calls.append(messages)
+        return next(replies)
+
+    monkeypatch.setattr(gateway, "AI_PROVIDER", "openai")
+    monkeypatch.setattr(gateway, "_call_openai", fake_call_openai)
+    user_id = uuid4()
+    greeting = [{"role": "user", "content": "Olá"}]
+    balance = [{"role": "user", "content": "qual meu saldo?"}]
+
+    first = await gateway.call_llm(greeting, user_id=user_id)
+    second = await gateway.call_llm(greeting, user_id=user_id)
+    await gateway.call_llm(balance, tools=gateway.TOOLS, user_id=user_id)
+    await gateway.call_llm(balance, tools=gateway.TOOLS, user_id=user_id)
+
+    assert first == second
+    assert len(calls) == 3
+
+
+@pytest.mark.asyncio
+async def test_l1_cache_invalidated_by_transaction_write(monkeypatch: pytest.MonkeyPatch) -> None:
+    """A transaction write between identical requests makes the second one reach the provider."""
+    calls: List[List[Dict[str, Any]]] = []
+
+    async def fake_call_openai(messages, tools=None, api_key=None):
+        calls.append(messages)
+        return {"role": "assistant", "content": f"Resposta {len(calls)}", "tool_calls": []}
+
+    monkeypatch.setattr(gateway, "AI_PROVIDER", "openai")
+    monkeypatch.setattr(gateway, "_call_openai", fake_call_openai)
+    user_id = uuid4()
+    messages = [{"role": "user", "content": "como estou este mês?"}]
+
+    first = await gateway.call_llm(messages, user_id=user_id)
+    crud._bump_transaction_version(user_id)
+    second = await gateway.call_llm(messages, user_id=user_id)
+
+    assert len(calls) == 2
+    assert first["content"] != second["content"]
+
+
+@pytest.mark.asyncio
+async def test_semantic_cache_hit_for_similar_message() -> None:
+    """A rephrased question is answered from the same user's cache."""
+    user_id = uuid4()
+    response = {"role": "assistant", "content": "Seu saldo é R$ 100,00.", "tool_calls": []}
+    await semantic_cache.store(user_id, [{"role": "user", "content": "qual meu saldo?"}], response)
+
+    hit = await semantic_cache.lookup(user_id, [{"role": "user", "content": "quanto tenho de saldo?"}])
+    unrelated = await semantic_cache.lookup(user_id, [{"role": "user", "content": "me conta uma piada"}])
+    other_user = await semantic_cache.lookup(uuid4(), [{"role": "user", "content": "qual meu saldo?"}])
+
+    assert hit is not None and hit["content"] == response["content"]
+    assert unrelated is None
+    assert other_user is None
+
+
+@pytest.mark.asyncio
+async def test_semantic_cache_invalidated_by_transaction_write() -> None:
+    """Replies cached before a transaction write are no longer served."""
+    user_id = uuid4()
+    messages = [{"role": "user", "content": "qual meu saldo?"}]
+    await semantic_cache.store(user_id, messages, {"role": "assistant", "content": "R$ 100,00", "tool_calls": []})
+
+    crud._bump_transaction_version(user_id)
+
+    assert await semantic_cache.lookup(user_id, messages) is None
+
+
+@pytest.mark.asyncio
+async def test_semantic_cache_bounded_across_users(monkeypatch: pytest.MonkeyPatch) -> None:
+    """The least recently used user's entries are evicted once the user cap is reached."""
+    monkeypatch.setattr(semantic_cache, "_MAX_CACHED_USERS", 2)
+    messages = [{"role": "user", "content": "qual meu saldo?"}]
+    response = {"role": "assistant", "content": "R$ 100,00", "tool_calls": []}
+    first, second, third = uuid4(), uuid4(), uuid4()
+
+    await semantic_cache.store(first, messages, response)
+    await semantic_cache.store(second, messages, response)
+    assert await semantic_cache.lookup(first, messages) is not None
+    await semantic_cache.store(third, messages, response)
+
+    assert list(semantic_cache._entries) == [first, third]
+    assert semantic_cache._entries[first][0][0].typecode == "f"
+
+
+def test_provider_clients_reused_per_key(monkeypatch: pytest.MonkeyPatch) -> None:
+    """SDK clients are reused per (provider, key) and the pool is LRU-bounded."""
+    monkeypatch.setattr(gateway, "_provider_clients", gateway.OrderedDict())
+    monkeypatch.setattr(gateway, "_PROVIDER_CLIENTS_MAX", 2)
+
+    first = gateway._cached_client("openai", "key-a", lambda key: object())
+    again = gateway._cached_client("openai", "key-a", lambda key: object())
+    gateway._cached_client("openai", "key-b", lambda key: object())
+    gateway._cached_client("openai", "key-c", lambda key: object())
+
+    assert first is again
+    assert list(gateway._provider_clients) == [
+        ("openai", hashlib.sha256(b"key-b").hexdigest()),
+        ("openai", hashlib.sha256(b"key-c").hexdigest()),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_close_provider_clients(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Shutdown closes every cached client and empties the pool."""
+    monkeypatch.setattr(gateway, "_provider_clients", gateway.OrderedDict())
+    closed = []
+
+    class FakeClient:
+        async def close(self) -> None:
+            closed.append(self)
+
+    client = gateway._cached_client("openai", "key-a", lambda key: FakeClient())
+    gateway._cached_client("gemini", "key-a", lambda key: object())
+
+    await gateway.close_provider_clients()
+
+    assert closed == [client]
+    assert not gateway._provider_clients
+
+
+@pytest.mark.asyncio
+async def test_evicted_clients_with_own_transport_closed(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Evicted Gemini clients are closed; clients on the shared pool are only dropped."""
+    monkeypatch.setattr(gateway, "_provider_clients", gateway.OrderedDict())
+    monkeypatch.setattr(gateway, "_PROVIDER_CLIENTS_MAX", 1)
+    monkeypatch.setattr(gateway, "_EVICTED_CLIENT_CLOSE_DELAY", 0)
+    closed = []
+
+    class FakeClient:
+        async def close(self) -> None:
+            closed.append(self)
+
+    gemini = gateway._cached_client("gemini", "key-a", lambda key: FakeClient())
+    gateway._cached_client("openai", "key-b", lambda key: FakeClient())
+    gateway._cached_client("openai", "key-c", lambda key: FakeClient())
+    await asyncio.gather(*gateway._client_close_tasks)
+
+    assert closed == [gemini]
+
+
+@pytest.mark.asyncio
+async def test_trivial_shortcut_skips_provider(monkeypatch: pytest.MonkeyPatch) -> None:
+    """With the shortcut enabled, small talk is answered locally; other messages still call the provider."""
+    calls: List[List[Dict[str, Any]]] = []
+
+    async def fake_call_openai(messages, tools=None, api_key=None):
+        calls.append(messages)
+        return {"role": "assistant", "content": "Seu saldo é R$ 10,00.", "tool_calls": []}
+
+    monkeypatch.setattr(gateway, "AI_PROVIDER", "openai")
+    monkeypatch.setattr(gateway, "AI_TRIVIAL_SHORTCUT", True)
+    monkeypatch.setattr(gateway, "_call_openai", fake_call_openai)
+
+    thanks = await gateway.call_llm([{"role": "user", "content": "  Obrigado!! "}])
+    balance = await gateway.call_llm([{"role": "user", "content": "qual meu saldo?"}])
+
+    assert thanks["content"] == gateway.TRIVIAL_RESPONSES["obrigado"]
+    assert balance["content"] == "Seu saldo é R$ 10,00."
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_trivial_shortcut_skipped_for_confirmation(monkeypatch: pytest.MonkeyPatch) -> None:
+    """An "ok" answering a confirmation question reaches the provider with tools."""
+    calls: List[Any] = []
+
+    async def fake_call_openai(messages, tools=None, api_key=None):
+        calls.append(tools)
+        return {"role": "assistant", "content": "Transação registrada.", "tool_calls": []}
+
+    monkeypatch.setattr(gateway, "AI_PROVIDER", "openai")
+    monkeypatch.setattr(gateway, "AI_TRIVIAL_SHORTCUT", True)
+    monkeypatch.setattr(gateway, "_call_openai", fake_call_openai)
+    messages = [
+        {"role": "user", "content": "gastei 50 no mercado"},
+        {"role": "assistant", "content": "Despesa de R$ 50,00 em Mercado. Pode confirmar?"},
+        {"role": "user", "content": "ok"},
+    ]
+
+    response = await gateway.call_llm(messages, tools=gateway.TOOLS)
+    without_tools = await gateway.call_llm(messages)
+
+    assert response["content"] == "Transação registrada."
+    assert without_tools["content"] == "Transação registrada."
+    assert calls == [gateway.TOOLS, None]
+
+
+def test_sweep_expired_api_keys(monkeypatch: pytest.MonkeyPatch) -> None:
+    """The sweeper drops expired ephemeral keys and keeps live ones."""
+    monkeypatch.setattr(gateway, "_ephemeral_api_keys", {})
+    expired_user, live_user = uuid4(), uuid4()
+    gateway.set_ephemeral_api_key(expired_user, "sk-expired-key-000000000", ttl_minutes=0)
+    gateway.set_ephemeral_api_key(live_user, "sk-live-key-0000000000000", ttl_minutes=60)
+
+    removed = gateway.sweep_expired_api_keys()
+
+    assert removed == 1
+    assert list(gateway._ephemeral_api_keys) == [live_user]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_embeddings_share_one_request(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Embeddings requested in the same window are sent as one batched call."""
+    requests: List[List[str]] = []
+
+    class _FakeEmbeddings:
+        async def create(self, model: str, input: List[str]):
+            requests.append(input)
+            data = [SimpleNamespace(index=i, embedding=[float(len(text)), 1.0]) for i, text in enumerate(input)]
+            return SimpleNamespace(data=data)
+
+    monkeypatch.setattr(gateway, "_openai_client", lambda key: SimpleNamespace(embeddings=_FakeEmbeddings()))
+    monkeypatch.setattr(semantic_cache, "_embeddings", semantic_cache.OrderedDict())
+    embed = semantic_cache._submit_embedding
+
+    vectors = await asyncio.gather(embed("a", "key"), embed("bb", "key"), embed("a", "key"))
+
+    assert requests == [["a", "bb"]]
+    assert vectors[0] == vectors[2] != vectors[1]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_requests_share_one_call(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Concurrent duplicates without tools coalesce; requests with tools never do."""
+    calls: List[List[Dict[str, Any]]] = []
+
+    async def slow_call_openai(messages, tools=None, api_key=None):
+        calls.append(messages)
+        await asyncio.sleep(0.01)
+        return {"role": "assistant", "content": "Olá!", "tool_calls": []}
+
+    monkeypatch.setattr(gateway, "AI_PROVIDER", "openai")
+    monkeypatch.setattr(gateway, "AI_CACHE_TTL", 0)
+    monkeypatch.setattr(gateway, "_call_openai", slow_call_openai)
+    user_id = uuid4()
+    greeting = [{"role": "user", "content": "Olá"}]
+
+    first, second = await asyncio.gather(
+        gateway.call_llm(greeting, user_id=user_id),
+        gateway.call_llm(greeting, user_id=user_id),
+    )
+    await asyncio.gather(
+        gateway.call_llm(greeting, tools=gateway.TOOLS, user_id=user_id),
+        gateway.call_llm(greeting, tools=gateway.TOOLS, user_id=user_id),
+    )
+
+    assert first == second and first is not second
+    assert len(calls) == 3
+    assert gateway._llm_inflight == {}
+
+
+def test_context_pack_message_reused_for_same_pack(monkeypatch: pytest.MonkeyPatch) -> None:
+    """The pack prompt is rendered once per cached pack and again for a new pack."""
+    rendered: List[Dict[str, Any]] = []
+
+    def counting_serialize(pack):
+        rendered.append(pack)
+        return "{}", "v"
+
+    monkeypatch.setattr(gateway, "serialize_finance_context_pack", counting_serialize)
+    monkeypatch.setattr(gateway, "AI_CONTEXT_PACK_FORMAT", "json")
+    monkeypatch.setattr(gateway, "_context_pack_messages", {})
+    user_id = uuid4()
+    pack = {"balance": {"amount": 1.0}}
+
+    first = gateway._context_pack_message(user_id, pack)
+    second = gateway._context_pack_message(user_id, pack)
+    gateway._context_pack_message(user_id, dict(pack))
+
+    assert first is second
+    assert len(rendered) == 2
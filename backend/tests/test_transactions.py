@@ -35,6 +35,23 @@ async def test_create_transaction_success(async_client: AsyncClient, test_user:
     assert "occurred_at" in data
 
 
+@pytest.mark.asyncio
+async def test_create_transaction_returns_stored_values(async_client: AsyncClient, test_user: dict) -> None:
+    """The create response shows the row as stored (amount rounded to cents), same as the list."""
+    # Arrange
+    transaction_data = {"amount": "10.129", "type": "EXPENSE", "category": "Food"}
+    
+    # Act
+    created = await async_client.post("/transactions", json=transaction_data, headers=test_user["headers"])
+    listed = await async_client.get("/transactions", headers=test_user["headers"])
+    
+    # Assert
+    assert created.status_code == 201
+    assert listed.status_code == 200
+    assert created.json()["amount"] == "10.13"
+    assert listed.json() == [created.json()]
+
+
 @pytest.mark.asyncio
 async def test_create_transaction_unauthorized(async_client: AsyncClient) -> None:
     """Test creating a transaction without token returns 401."""
@@ -382,3 +399,38 @@ async def test_update_transaction_validation(async_client: AsyncClient, test_use
     
     # Assert
     assert response.status_code == 422  # Validation error
+
+
+@pytest.mark.asyncio
+async def test_startup_schema_updates_indexes_of_existing_tables() -> None:
+    """Indexes added or renamed since a table was created are applied on startup."""
+    from sqlalchemy import inspect, text
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    from app.database import Base
+    from app.main import _create_schema
+
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    async with engine.begin() as conn:
+        # A database created before the covering/aggregate indexes existed
+        await conn.run_sync(Base.metadata.create_all)
+        for name in (
+            "idx_transactions_user_occurred_covering",
+            "idx_transactions_user_expense_occurred",
+            "idx_transactions_user_type_category",
+        ):
+            await conn.execute(text(f"DROP INDEX {name}"))
+        await conn.execute(text("CREATE INDEX idx_transactions_user_occurred ON transactions (user_id, occurred_at)"))
+
+        await conn.run_sync(_create_schema)
+        names = await conn.run_sync(
+            lambda sync_conn: {index["name"] for index in inspect(sync_conn).get_indexes("transactions")}
+        )
+    await engine.dispose()
+
+    assert "idx_transactions_user_occurred" not in names
+    assert {
+        "idx_transactions_user_occurred_covering",
+        "idx_transactions_user_expense_occurred",
+        "idx_transactions_user_type_category",
+    } <= names